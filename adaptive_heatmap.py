@@ -0,0 +1,125 @@
+import math
+import numpy as np
+import scipy.interpolate
+
+import final_project_model
+
+
+class AdaptiveHeatmap:
+    def __init__(self, values, points, samples, evaluations, error_estimate, check_error):
+        # values is the (resolution, resolution) grid, indexed [x, y] like the sweep results
+        self.values = values
+        self.points = points
+        self.samples = samples
+        self.evaluations = evaluations
+        self.error_estimate = error_estimate
+        self.check_error = check_error
+
+
+def adaptive_heatmap(evaluate, x_range, y_range, resolution=100, coarse=8, tol=2e-3, check=100, seed=0):
+    """
+    Sample a 2-D response surface on a quadtree instead of a full grid.
+
+    Starts from a coarse x coarse grid of cells (coarse is rounded up to a
+    power of two) and evaluates each cell's center and edge midpoints. A
+    cell where any of them differs by more than tol from the linear
+    interpolation of the points around it (the corners for the center,
+    the edge's ends for a midpoint) is split into four, down to cells one
+    step of a lattice at least as fine as the output grid. Each level's new
+    points go to evaluate(xs, ys) as one vectorized call. The samples are
+    then linearly interpolated back onto a regular resolution x resolution
+    grid.
+
+    error_estimate is the largest such difference in a cell that was not
+    split, so it is at most tol. It is the error linear interpolation
+    would make at those midpoints without sampling them; with them sampled
+    the error left inside a smooth cell is a fraction of it. It is an
+    estimate, not a guarantee: a feature narrower than a cell that shows
+    at none of its nine samples can still be missed.
+
+    check random points of the output grid are also evaluated, in one
+    more call, and check_error is the largest error among them (NaN if
+    check is 0). These points are held out from the samples.
+
+    Returns:
+    - An AdaptiveHeatmap with the interpolated grid, the sampled points and
+      values, the number of evaluations including the check points, the
+      error estimate and the check error
+    """
+    levels = math.ceil(math.log2(max(resolution - 1, 1)))
+    coarse_levels = min(math.ceil(math.log2(max(coarse, 1))), levels)
+    size = 2 ** levels
+    coarse_step = 2 ** (levels - coarse_levels)
+
+    samples = {}
+
+    def sample(lattice_points):
+        missing = sorted(set(lattice_points) - samples.keys())
+        if missing:
+            index = np.array(missing, dtype=float)
+            xs = x_range[0] + (x_range[1] - x_range[0]) * index[:, 0] / size
+            ys = y_range[0] + (y_range[1] - y_range[0]) * index[:, 1] / size
+            samples.update(zip(missing, np.asarray(evaluate(xs, ys), dtype=float)))
+
+    def corners(i, j, step):
+        return [(i, j), (i + step, j), (i, j + step), (i + step, j + step)]
+
+    def midpoints(i, j, step):
+        # each midpoint with the points it is linearly interpolated from
+        half = step // 2
+        return [((i + half, j + half), corners(i, j, step)),
+                ((i + half, j), [(i, j), (i + step, j)]),
+                ((i + half, j + step), [(i, j + step), (i + step, j + step)]),
+                ((i, j + half), [(i, j), (i, j + step)]),
+                ((i + step, j + half), [(i + step, j), (i + step, j + step)])]
+
+    cells = [(i, j, coarse_step) for i in range(0, size, coarse_step) for j in range(0, size, coarse_step)]
+    sample([point for cell in cells for point in corners(*cell)])
+
+    error_estimate = 0.0
+    while cells:
+        # cells one lattice step wide are resolved at the output resolution
+        splittable = [cell for cell in cells if cell[2] > 1]
+        sample([point for cell in splittable for point, _ in midpoints(*cell)])
+
+        cells = []
+        for i, j, step in splittable:
+            error = max(abs(samples[point] - np.mean([samples[end] for end in ends]))
+                        for point, ends in midpoints(i, j, step))
+            if error > tol:
+                half = step // 2
+                cells.extend((i + di, j + dj, half) for di in (0, half) for dj in (0, half))
+            else:
+                error_estimate = max(error_estimate, error)
+
+    lattice = np.array(list(samples.keys()), dtype=float)
+    values = np.array(list(samples.values()))
+    points = np.column_stack([
+        x_range[0] + (x_range[1] - x_range[0]) * lattice[:, 0] / size,
+        y_range[0] + (y_range[1] - y_range[0]) * lattice[:, 1] / size,
+    ])
+
+    grid_x, grid_y = np.meshgrid(np.linspace(*x_range, resolution), np.linspace(*y_range, resolution), indexing='ij')
+    grid = scipy.interpolate.griddata(points, values, (grid_x, grid_y), method='linear')
+
+    check_error = np.nan
+    if check:
+        held_out = np.random.default_rng(seed).choice(grid.size, size=min(check, grid.size), replace=False)
+        exact = np.asarray(evaluate(grid_x.flat[held_out], grid_y.flat[held_out]), dtype=float)
+        check_error = float(np.max(np.abs(grid.flat[held_out] - exact)))
+
+    return AdaptiveHeatmap(grid, points, values, len(samples) + (len(held_out) if check else 0), error_estimate,
+                           check_error)
+
+
+def restock_evaluator(params, simulation_years=10, reducer=final_project_model.mean_C):
+    # evaluate(C_restocks, D_restocks) for every cohort and the intake restocked alike
+    def evaluate(C_restock, D_restock):
+        restock = np.stack([C_restock, 1 - C_restock - D_restock, D_restock], axis=-1)
+        final_state = final_project_model.run_batch(
+            params.get('p_CS', 0.05), params.get('p_SC', 0.05), params.get('p_DS', 0.05), params.get('p_SD', 0.05),
+            params['A'], params['B'], np.repeat(restock[:, np.newaxis], np.shape(params['A'])[-1], axis=1), restock,
+            simulation_years=simulation_years, output='final')
+        return reducer(final_state)
+
+    return evaluate
@@ -0,0 +1,43 @@
+import final_project_model
+
+import time
+import numpy as np
+
+
+def time_it(fn, repeats):
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == "__main__":
+    print("info: benchmarking cohort count scaling")
+    simulation_years = 10
+    rng = np.random.default_rng(0)
+
+    print(f"{'K':>6} {'construct (us)':>16} {'step (us/year)':>16} {'step / K^2 (ns)':>16}")
+    for K in [4, 64, 1024]:
+        initial_state = rng.dirichlet([1, 1, 1], size=K)
+        parameters = {
+            'p_SC': .4,
+            'p_CS': .2,
+            'p_SD': .4,
+            'p_DS': .2,
+            'A': np.full((K, K), 1 / K),
+            'B': final_project_model.elder_efficacy_B(.4, .1 / K, K),
+        }
+        repeats = 50 if K < 1024 else 5
+
+        construct = time_it(lambda: final_project_model.DiscreteReligiousBeliefModel(
+            parameters, initial_state, simulation_years=simulation_years), repeats)
+
+        def run():
+            model = final_project_model.DiscreteReligiousBeliefModel(
+                parameters, initial_state, simulation_years=simulation_years)
+            model.run_simulation(output='final')
+
+        step = (time_it(run, repeats) - construct) / simulation_years
+        print(f"{K:>6} {construct * 1e6:>16.1f} {step * 1e6:>16.1f} {step * 1e9 / K ** 2:>16.2f}")
@@ -0,0 +1,56 @@
+import sys
+import argparse
+import subprocess
+
+# a fresh interpreter imports the model and runs one 10 year simulation
+COLD_START = """
+import sys, time
+start = time.perf_counter()
+import final_project_model
+model = final_project_model.DiscreteReligiousBeliefModel({'p_SC': .4, 'p_CS': .2, 'p_SD': .4, 'p_DS': .2}, {}, simulation_years=10)
+model.run_simulation()
+elapsed = time.perf_counter() - start
+print(elapsed, int(any(name.split('.')[0] in ('matplotlib', 'seaborn', 'scipy') for name in sys.modules)))
+"""
+
+BARE_START = """
+import time
+start = time.perf_counter()
+import numpy
+print(time.perf_counter() - start, 0)
+"""
+
+
+def cold_start_seconds(code, repeats):
+    # best of repeats, each in a new process so nothing is already imported
+    times = []
+    heavy = False
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+        elapsed, imported = output.split()
+        times.append(float(elapsed))
+        heavy = heavy or bool(int(imported))
+    return min(times), heavy
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Guard the cold start cost of importing the model and running one simulation.')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--max-overhead', type=float, default=0.1,
+                        help='allowed seconds on top of importing numpy alone')
+    args = parser.parse_args()
+
+    print("info: benchmarking cold start")
+    numpy_only, _ = cold_start_seconds(BARE_START, args.repeats)
+    cold, heavy = cold_start_seconds(COLD_START, args.repeats)
+    overhead = cold - numpy_only
+    print(f"import numpy: {numpy_only * 1000:.1f} ms")
+    print(f"import final_project_model and run one simulation: {cold * 1000:.1f} ms "
+          f"({overhead * 1000:.1f} ms over numpy)")
+
+    if heavy:
+        print("error: matplotlib, seaborn or scipy was imported by the simulation core")
+        sys.exit(1)
+    if overhead > args.max_overhead:
+        print(f"error: cold start overhead above {args.max_overhead * 1000:.0f} ms")
+        sys.exit(1)
@@ -0,0 +1,85 @@
+import final_project_model
+
+import time
+import tracemalloc
+import numpy as np
+
+
+def make_batch(n):
+    beta = np.linspace(0, 1, n)
+    return {
+        'p_SC': beta,
+        'p_CS': 1 - beta,
+        'p_SD': beta,
+        'p_DS': 1 - beta,
+        'A': final_project_model.sta_A(),
+        'B': final_project_model.elder_efficacy_B(beta, .1),
+        'initial_states': np.full((n, 4, 3), 1 / 3),
+        'incoming': [.3, .4, .3],
+    }
+
+
+def make_steppers(inputs):
+    n = len(inputs['initial_states'])
+    rates = final_project_model._batch_rates(
+        n, 4, inputs['p_CS'], inputs['p_SC'], inputs['p_DS'], inputs['p_SD'],
+        inputs['A'], inputs['B'], inputs['incoming'])
+
+    state = inputs['initial_states']
+    kernel = final_project_model._InplaceKernel(rates)
+    kernel.load(state)
+    return {
+        'reference': lambda: final_project_model._step_batch(state, rates),
+        'inplace': kernel.step,
+    }
+
+
+def ns_per_step(step, repeats):
+    start = time.perf_counter_ns()
+    for _ in range(repeats):
+        step()
+    return (time.perf_counter_ns() - start) / repeats
+
+
+def temporary_bytes_per_step(step, steps=2 * 4):
+    """
+    Memory above the resting level while each of steps consecutive steps
+    runs, so work done only every few steps (the in-place kernel's ring
+    shift every K years) is caught. steps defaults to 2K for K = 4.
+
+    Returns:
+    - The peak and the mean over the steps, in bytes
+    """
+    step()
+    tracemalloc.start()
+    temporaries = []
+    for _ in range(steps):
+        baseline, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        step()
+        _, peak = tracemalloc.get_traced_memory()
+        temporaries.append(peak - baseline)
+    tracemalloc.stop()
+    return max(temporaries), sum(temporaries) / steps
+
+
+if __name__ == "__main__":
+    print("info: benchmarking yearly update kernels")
+    print(f"{'N':>7} {'kernel':>10} {'ns / step':>12} {'ns / model':>12} {'peak temp':>12} {'mean temp':>12}")
+    for n in [1, 100, 10000]:
+        steppers = make_steppers(make_batch(n))
+        repeats = max(20, 200000 // n)
+        for name, step in steppers.items():
+            ns = ns_per_step(step, repeats)
+            peak, mean = temporary_bytes_per_step(step)
+            print(f"{n:>7} {name:>10} {ns:>12.0f} {ns / n:>12.1f} {peak:>12} {mean:>12.0f}")
+
+    # single model path through DiscreteReligiousBeliefModel.run_simulation
+    simulation_years = 1000
+    for kernel in ['reference', 'inplace']:
+        model = final_project_model.DiscreteReligiousBeliefModel(
+            {'p_SC': .4, 'p_CS': .2, 'p_SD': .4, 'p_DS': .2}, {}, simulation_years=simulation_years)
+        start = time.perf_counter_ns()
+        model.run_simulation(output='final', kernel=kernel)
+        ns = (time.perf_counter_ns() - start) / simulation_years
+        print(f"run_simulation kernel={kernel}: {ns:.0f} ns / year")
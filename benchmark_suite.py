@@ -0,0 +1,192 @@
+import sys
+import json
+import time
+import argparse
+import platform
+import numpy as np
+
+import final_project_model
+import adaptive_heatmap
+
+STA = final_project_model.sta_A()
+HOMOPHILY = final_project_model.homophily_A()
+HETEROPHILY = final_project_model.heterophily_A()
+RESTOCK = {f'{compartment}_{age}': 1 / 3 for age in [1, 2, 3, 4, 'incoming'] for compartment in 'CSD'}
+
+
+def single_run():
+    model = final_project_model.DiscreteReligiousBeliefModel(
+        {'p_SC': .4, 'p_CS': 1.0, 'p_SD': .4, 'p_DS': 1.0, 'A': STA,
+         'B': final_project_model.elder_efficacy_B(.4, .1)},
+        RESTOCK, simulation_years=10)
+    model.run_simulation()
+
+
+def graph_two(backend):
+    betas = np.linspace(0, 1, 50)
+    final_project_model.run_sweep(
+        [('beta', betas), ('beta_ret', betas)], params={'A': STA, 'B_step': .1},
+        initial_conds=RESTOCK, simulation_years=10, backend=backend)
+
+
+def graph_three(backend):
+    betas = np.linspace(0, 1, 50)
+    final_project_model.run_sweep(
+        [('B_step', [0, .1]), ('A', [HOMOPHILY, HETEROPHILY, STA]), ('beta', betas), ('beta_ret', betas)],
+        initial_conds=RESTOCK, simulation_years=10, backend=backend)
+
+
+def graph_five():
+    parameters = {'p_SC': .4, 'p_CS': .2, 'p_SD': .4, 'p_DS': .2, 'A': STA,
+                  'B': final_project_model.elder_efficacy_B(.4, .1)}
+    adaptive_heatmap.adaptive_heatmap(
+        adaptive_heatmap.restock_evaluator(parameters, simulation_years=10), (0, .5), (0, .5), resolution=100)
+
+
+def restock_grid(backend):
+    # the full 100 x 100 grid that graph five refines adaptively
+    restocks = np.linspace(0, .5, 100)
+    final_project_model.run_sweep(
+        [('C_restock', restocks), ('D_restock', restocks)],
+        params={'p_SC': .4, 'p_CS': .2, 'p_SD': .4, 'p_DS': .2, 'A': STA, 'B_step': .1},
+        simulation_years=10, backend=backend)
+
+
+def ensemble(n, num_age_groups=4, kernel='reference'):
+    # n models with K cohorts, stacked up front so only run_batch is timed
+    rng = np.random.default_rng(0)
+    beta = rng.random(n)
+    inputs = {
+        'p_CS': 1 - beta,
+        'p_SC': beta,
+        'p_DS': 1 - beta,
+        'p_SD': beta,
+        'A': np.full((num_age_groups, num_age_groups), 1 / num_age_groups),
+        'B': final_project_model.elder_efficacy_B(beta, .1 / num_age_groups, num_age_groups),
+        'initial_states': rng.dirichlet([1, 1, 1], size=(n, num_age_groups)),
+        'incoming': [.3, .4, .3],
+    }
+    return lambda: final_project_model.run_batch(simulation_years=10, output='final', kernel=kernel, **inputs)
+
+
+def workloads(backend):
+    """
+    Returns:
+    - {name: (fn, models per call)} for every benchmark in the suite
+    """
+    suite = {
+        'single_run': (single_run, 1),
+        'graph_two': (lambda: graph_two(backend), 50 * 50),
+        'graph_three': (lambda: graph_three(backend), 6 * 50 * 50),
+        'graph_five_adaptive': (graph_five, None),
+        'restock_grid': (lambda: restock_grid(backend), 100 * 100),
+    }
+    for n in [1, 10, 100, 1000, 10000, 100000]:
+        suite[f'ensemble_N{n}'] = (ensemble(n), n)
+        suite[f'ensemble_N{n}_inplace'] = (ensemble(n, kernel='inplace'), n)
+    for K in [4, 16, 64, 256]:
+        suite[f'cohorts_K{K}'] = (ensemble(1000, K), 1000)
+    return suite
+
+
+def time_workload(fn, min_time=0.5, max_repeats=50):
+    # repeat until min_time has passed, after one untimed warm-up call
+    fn()
+    times = []
+    while sum(times) < min_time and len(times) < max_repeats:
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def run_suite(names=None, backend='serial', min_time=0.5):
+    """
+    Time each workload.
+
+    Returns:
+    - A JSON-serializable dict with the environment under 'metadata' and,
+      under 'results', each workload's median and best seconds, the number
+      of repeats and, where it is known, the time per model
+    """
+    results = {}
+    for name, (fn, models) in workloads(backend).items():
+        if names and name not in names:
+            continue
+        times = time_workload(fn, min_time)
+        median = float(np.median(times))
+        results[name] = {
+            'median_seconds': median,
+            'min_seconds': float(np.min(times)),
+            'repeats': len(times),
+        }
+        if models is not None:
+            results[name]['models'] = models
+            results[name]['ns_per_model'] = median * 1e9 / models
+        print(f"{name:>24} {median * 1000:>12.3f} ms  ({len(times)} repeats)")
+
+    return {
+        'metadata': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'backend': backend,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'model_version': final_project_model.MODEL_VERSION,
+        },
+        'results': results,
+    }
+
+
+def compare(current, baseline, threshold=0.1):
+    """
+    Compare median times with a stored baseline.
+
+    Returns:
+    - [(name, baseline seconds, current seconds, ratio)] for workloads in
+      both runs
+    - The names whose median is more than threshold slower than baseline
+    """
+    rows = []
+    regressions = []
+    for name, result in current['results'].items():
+        if name not in baseline['results']:
+            continue
+        before = baseline['results'][name]['median_seconds']
+        after = result['median_seconds']
+        rows.append((name, before, after, after / before))
+        if after > before * (1 + threshold):
+            regressions.append(name)
+    return rows, regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Time the canonical workloads and compare with a baseline.')
+    parser.add_argument('-o', '--output', help='write the results as JSON to this file')
+    parser.add_argument('--compare', help='baseline JSON from an earlier run')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='relative slowdown reported as a regression')
+    parser.add_argument('--only', nargs='+', help='names of the workloads to run')
+    parser.add_argument('--backend', default='serial', help="sweep backend, 'serial', 'thread' or 'process'")
+    parser.add_argument('--min-time', type=float, default=0.5, help='seconds spent repeating each workload')
+    args = parser.parse_args()
+
+    print("info: running benchmark suite")
+    current = run_suite(args.only, args.backend, args.min_time)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(current, f, indent=2)
+        print(f"info: wrote {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        rows, regressions = compare(current, baseline, args.threshold)
+        print(f"{'workload':>24} {'baseline ms':>12} {'current ms':>12} {'ratio':>8}")
+        for name, before, after, ratio in rows:
+            flag = '  REGRESSION' if name in regressions else ''
+            print(f"{name:>24} {before * 1000:>12.3f} {after * 1000:>12.3f} {ratio:>8.2f}{flag}")
+        if regressions:
+            print(f"error: {len(regressions)} workloads slower than baseline by more than {args.threshold:.0%}")
+            sys.exit(1)
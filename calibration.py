@@ -0,0 +1,170 @@
+import time
+import concurrent.futures
+import numpy as np
+import scipy.optimize
+
+import final_project_model
+
+# fitted parameters; the incoming distribution is (u, (1 - u)(1 - v), (1 - u)v)
+# so that box bounds on u and v keep it a valid distribution
+FIT_NAMES = ('p_SC', 'p_CS', 'p_SD', 'p_DS', 'B_step', 'incoming_u', 'incoming_v')
+LOWER = np.array([0, 0, 0, 0, -.25, 0, 0])
+UPPER = np.array([1, 1, 1, 1, .25, 1, 1])
+
+
+class CalibrationResult:
+    def __init__(self, theta, cost, starts, evaluations):
+        self.theta = theta
+        self.cost = cost
+        self.starts = starts
+        self.evaluations = evaluations
+
+    @property
+    def params(self):
+        # the fitted values as model params, plus B_step and the incoming distribution
+        p_SC, p_CS, p_SD, p_DS, B_step, _, _ = self.theta
+        return {
+            'p_SC': p_SC,
+            'p_CS': p_CS,
+            'p_SD': p_SD,
+            'p_DS': p_DS,
+            'B_step': B_step,
+            'incoming': _incoming(self.theta[np.newaxis])[0],
+        }
+
+
+def _incoming(theta):
+    u, v = theta[:, 5], theta[:, 6]
+    return np.stack([u, (1 - u) * (1 - v), (1 - u) * v], axis=-1)
+
+
+class CalibrationProblem:
+    def __init__(self, observed, A, weights=None):
+        """
+        Fit to observed per-cohort C, S, D proportions of shape (T, K, 3), one
+        row per year. Year 0 is the initial state and years 1..T-1 are
+        fitted. NaN entries are treated as missing. B is
+        p_SC + B_step * (j - i), the elder-efficacy form without rounding.
+        """
+        self.observed = np.asarray(observed, dtype=float)
+        self.simulation_years = len(self.observed) - 1
+        self.num_age_groups = self.observed.shape[1]
+        self.A = np.asarray(A, dtype=float)
+        self.initial_state = self.observed[0]
+
+        self.mask = np.isfinite(self.observed[1:])
+        weights = np.ones_like(self.observed[1:]) if weights is None else np.asarray(weights, dtype=float)
+        self.weights = weights[self.mask]
+        self.target = self.observed[1:][self.mask]
+
+        ages = np.arange(self.num_age_groups)
+        self.offsets = ages[np.newaxis, :] - ages[:, np.newaxis]
+
+    def batch_inputs(self, theta):
+        p_SC, p_CS, p_SD, p_DS, B_step = theta[:, :5].T
+        n = len(theta)
+        return {
+            'p_CS': p_CS,
+            'p_SC': p_SC,
+            'p_DS': p_DS,
+            'p_SD': p_SD,
+            'A': self.A,
+            'B': p_SC[:, np.newaxis, np.newaxis] + B_step[:, np.newaxis, np.newaxis] * self.offsets,
+            'initial_states': np.broadcast_to(self.initial_state, (n,) + self.initial_state.shape),
+            'incoming': _incoming(theta),
+        }
+
+    def residuals_batch(self, theta):
+        # weighted residuals for N candidate parameter sets in one batched run
+        theta = np.atleast_2d(theta)
+        results = final_project_model.run_batch(
+            simulation_years=self.simulation_years, **self.batch_inputs(theta))
+        return (results[:, 1:][:, self.mask] - self.target) * self.weights
+
+    def residuals(self, theta):
+        return self.residuals_batch(theta)[0]
+
+    def jacobian(self, theta):
+        # chain rule from run_batch_sensitivities' model parameters to FIT_NAMES
+        theta = np.atleast_2d(theta)
+        _, tangents = final_project_model.run_batch_sensitivities(
+            simulation_years=self.simulation_years, output='full', **self.batch_inputs(theta))
+        tangents = tangents[0, 1:][self.mask]
+
+        K = self.num_age_groups
+        b_cols = slice(3 + K * K, 3 + 2 * K * K)
+        u, v = theta[0, 5], theta[0, 6]
+        d_incoming = tangents[:, -3:]
+
+        jacobian = np.empty((len(tangents), len(FIT_NAMES)))
+        jacobian[:, 0] = tangents[:, b_cols].sum(axis=1)
+        jacobian[:, 1] = tangents[:, 0]
+        jacobian[:, 2] = tangents[:, 2]
+        jacobian[:, 3] = tangents[:, 1]
+        jacobian[:, 4] = tangents[:, b_cols] @ self.offsets.ravel().astype(float)
+        jacobian[:, 5] = d_incoming @ np.array([1, -(1 - v), -v])
+        jacobian[:, 6] = d_incoming @ np.array([0, -(1 - u), 1 - u])
+        return jacobian * self.weights[:, np.newaxis]
+
+
+def _fit_from(problem, theta0):
+    fit = scipy.optimize.least_squares(
+        problem.residuals, theta0, jac=problem.jacobian, bounds=(LOWER, UPPER), x_scale='jac')
+    return fit.x, fit.cost, fit.nfev
+
+
+def calibrate(observed, A, n_starts=8, n_candidates=4096, seed=0, weights=None,
+              backend='process', max_workers=None):
+    """
+    Least-squares fit of FIT_NAMES to observed proportions.
+
+    n_candidates random parameter sets are scored in one batched run, and
+    the n_starts best seed scipy.optimize.least_squares with the analytic
+    jacobian from run_batch_sensitivities. The starts run on backend:
+    'serial', 'thread', 'process' or a concurrent.futures.Executor.
+
+    Returns:
+    - A CalibrationResult for the lowest-cost start, with every start's
+      (theta, cost) in starts
+    """
+    problem = CalibrationProblem(observed, A, weights)
+    rng = np.random.default_rng(seed)
+    candidates = LOWER + (UPPER - LOWER) * rng.random((n_candidates, len(FIT_NAMES)))
+    costs = 0.5 * np.sum(problem.residuals_batch(candidates) ** 2, axis=1)
+    starts = candidates[np.argsort(costs)[:n_starts]]
+
+    if backend == 'serial':
+        fits = list(map(_fit_from, [problem] * len(starts), starts))
+    elif isinstance(backend, concurrent.futures.Executor):
+        fits = list(backend.map(_fit_from, [problem] * len(starts), starts))
+    else:
+        executor_type = {
+            'process': concurrent.futures.ProcessPoolExecutor,
+            'thread': concurrent.futures.ThreadPoolExecutor,
+        }[backend]
+        with executor_type(max_workers=max_workers) as executor:
+            fits = list(executor.map(_fit_from, [problem] * len(starts), starts))
+
+    best = min(range(len(fits)), key=lambda k: fits[k][1])
+    evaluations = n_candidates + sum(nfev for _, _, nfev in fits)
+    return CalibrationResult(fits[best][0], fits[best][1],
+                             [(theta, cost) for theta, cost, _ in fits], evaluations)
+
+
+if __name__ == "__main__":
+    print("info: calibration demo on synthetic survey data")
+    A = final_project_model.sta_A()
+    true_theta = np.array([.4, .2, .35, .25, .08, .3, .45])
+
+    problem = CalibrationProblem(np.full((11, 4, 3), 1 / 3), A)
+    observed = final_project_model.run_batch(
+        simulation_years=10, **problem.batch_inputs(true_theta[np.newaxis]))[0]
+    observed += np.random.default_rng(1).normal(0, .005, observed.shape)
+
+    start = time.perf_counter()
+    result = calibrate(observed, A)
+    elapsed = time.perf_counter() - start
+
+    print(f"fit in {elapsed:.2f} s, {result.evaluations} model evaluations, cost {result.cost:.3g}")
+    for name, true, fitted in zip(FIT_NAMES, true_theta, result.theta):
+        print(f"{name:>12}: true {true:.3f} fitted {fitted:.3f}")
@@ -0,0 +1,333 @@
+import time
+import numpy as np
+
+import final_project_model
+from final_project_model import C_IDX
+
+# sweep axes that are a single number, and so can be continued in
+CONTINUATION_PARAMETERS = ('beta', 'beta_ret', 'B_step', 'C_restock', 'D_restock')
+
+
+class ContinuationResult:
+    def __init__(self, name, parameter, states, eigenvalues, tangents, bifurcations, solves):
+        self.name = name
+        self.parameter = parameter
+        self.states = states
+        self.eigenvalues = eigenvalues
+        self.tangents = tangents
+        self.bifurcations = bifurcations
+        self.solves = solves
+
+    @property
+    def mean_C(self):
+        return final_project_model.mean_C(self.states)
+
+    @property
+    def spectral_radius(self):
+        return np.max(np.abs(self.eigenvalues), axis=1)
+
+    @property
+    def stable(self):
+        # a fixed point of a map is stable when every multiplier is inside the unit circle
+        return self.spectral_radius < 1
+
+
+class _FixedPointProblem:
+    def __init__(self, name, params, initial_conds):
+        if name not in CONTINUATION_PARAMETERS:
+            raise ValueError(f'cannot continue in {name!r}, expected one of {CONTINUATION_PARAMETERS}')
+        self.name = name
+        self.params = params
+        self.num_age_groups = final_project_model.SweepPlan([], params, initial_conds, 0, None).num_age_groups
+        self.initial_conds = initial_conds
+
+    def rates(self, lam):
+        """
+        Batch rates for each value of the parameter in lam. B is built
+        without elder_efficacy_B's rounding to 3 decimals, which would make
+        the map piecewise constant in beta and B_step.
+        """
+        lam = np.atleast_1d(np.asarray(lam, dtype=float))
+        plan = final_project_model.SweepPlan([(self.name, lam)], self.params, self.initial_conds, 0, None)
+        inputs = plan.inputs_at(np.arange(len(lam)))
+
+        B_step = lam if self.name == 'B_step' else self.params.get('B_step')
+        if B_step is not None:
+            inputs['B'] = final_project_model.elder_efficacy_B(inputs['p_SC'], B_step, self.num_age_groups,
+                                                               decimals=None)
+
+        guess = np.array(inputs.pop('initial_states'))
+        return final_project_model._batch_rates(len(lam), self.num_age_groups, **inputs), guess
+
+    def residual(self, x, lam):
+        # G(x, lam) = F(x; lam) - x for (M, 3K) states and (M,) parameters
+        rates, _ = self.rates(lam)
+        state = x.reshape(-1, self.num_age_groups, 3)
+        return (final_project_model._step_batch(state, rates) - state).reshape(len(x), -1)
+
+    def jacobian(self, x, lam, h=1e-7):
+        """
+        Returns:
+        - dF/dx, the (M, 3K, 3K) analytic Jacobian of the yearly map
+        - dG/dlam, (M, 3K), by central differences
+        """
+        rates, _ = self.rates(lam)
+        state = x.reshape(-1, self.num_age_groups, 3)
+        d_state = final_project_model._step_jacobian_batch(state, rates)
+        both = self.residual(np.concatenate([x, x]), np.concatenate([lam + h, lam - h]))
+        d_lam = (both[:len(x)] - both[len(x):]) / (2 * h)
+        return d_state, d_lam
+
+
+def _tangent(d_state, d_lam, previous):
+    # unit null vector of [dF/dx - I, dG/dlam], oriented along previous
+    size = d_state.shape[-1]
+    augmented = np.zeros((size + 1, size + 1))
+    augmented[:size, :size] = d_state - np.eye(size)
+    augmented[:size, size] = d_lam
+    augmented[size] = previous
+    rhs = np.zeros(size + 1)
+    rhs[size] = 1
+    tangent = np.linalg.solve(augmented, rhs)
+    return tangent / np.linalg.norm(tangent)
+
+
+def _classify(previous, current, tangent_previous, tangent_current):
+    # test functions that change sign between consecutive points of the branch
+    events = []
+    if np.sign(tangent_previous[-1]) != np.sign(tangent_current[-1]):
+        events.append('fold')
+    flips = [np.sum((np.abs(e.imag) < 1e-9) & (e.real < -1)) for e in (previous, current)]
+    if flips[0] != flips[1]:
+        events.append('flip')
+    rotations = [np.sum((np.abs(e.imag) >= 1e-9) & (np.abs(e) > 1)) for e in (previous, current)]
+    if rotations[0] != rotations[1]:
+        events.append('neimark-sacker')
+    if (np.max(np.abs(previous)) < 1) != (np.max(np.abs(current)) < 1) and not events:
+        # a real multiplier through +1 without a fold, i.e. a branch point
+        events.append('branch point')
+    return events
+
+
+def continue_steady_state(name, parameter_range, params=None, initial_conds=None, start=None,
+                          ds=0.02, ds_min=1e-5, ds_max=0.05, max_points=500, tol=1e-11):
+    """
+    Trace the steady states of the yearly map as one parameter varies, by
+    pseudo-arclength continuation on G(x, lam) = F(x; lam) - x = 0.
+
+    name is one of CONTINUATION_PARAMETERS and the other inputs are as for
+    run_sweep. The branch starts at start (default the low end of
+    parameter_range) from the steady state reached by Newton's method and is
+    followed in arclength s over (x, lam): each step predicts along the
+    tangent, the null vector of [dF/dx - I, dG/dlam], and corrects with
+    Newton's method on G together with the arclength condition, so the
+    curve can be followed around folds where lam turns back. ds adapts
+    between ds_min and ds_max with the number of corrector iterations.
+
+    Stability comes from the eigenvalues (multipliers) of dF/dx at each
+    point. Between consecutive points a sign change of the tangent's lam
+    component is a fold, a real multiplier crossing -1 a flip, a complex
+    pair leaving the unit circle a Neimark-Sacker bifurcation, and any
+    other change of stability a branch point. Each is located by linear
+    interpolation between the two points.
+
+    Returns:
+    - A ContinuationResult with the parameter values, (M, K, 3) states,
+      (M, 3K) multipliers, tangents, the bifurcations as dicts with kind,
+      parameter and mean_C, and the number of linear solves used
+    """
+    problem = _FixedPointProblem(name, params or {}, initial_conds or {})
+    lo, hi = parameter_range
+    lam0 = lo if start is None else start
+
+    x, solves = _initial_steady_state(problem, lam0, tol)
+
+    size = x.size
+    u = np.append(x, lam0)
+    d_state, d_lam = problem.jacobian(x[np.newaxis], np.array([lam0]))
+    direction = np.zeros(size + 1)
+    direction[-1] = 1 if lam0 < hi or start is None else -1
+    tangent = _tangent(d_state[0], d_lam[0], direction)
+    solves += 1
+
+    points = [u]
+    tangents = [tangent]
+    multipliers = [np.linalg.eigvals(d_state[0])]
+
+    landing = False
+    while len(points) < max_points:
+        predicted = u + ds * tangent
+        corrected, iterations, solves_used = _correct(problem, predicted, tangent, tol)
+        solves += solves_used
+        if corrected is None:
+            ds /= 2
+            if ds < ds_min:
+                break
+            continue
+
+        d_state, d_lam = problem.jacobian(corrected[np.newaxis, :-1], corrected[-1:])
+        new_tangent = _tangent(d_state[0], d_lam[0], tangent)
+        solves += 1
+
+        outside = not lo - 1e-9 <= corrected[-1] <= hi + 1e-9
+        if outside and not landing:
+            # step back to end the branch on the edge of the range
+            bound = hi if corrected[-1] > hi else lo
+            ds *= (bound - u[-1]) / (corrected[-1] - u[-1])
+            landing = True
+            continue
+
+        u, tangent = corrected, new_tangent
+        points.append(u)
+        tangents.append(tangent)
+        multipliers.append(np.linalg.eigvals(d_state[0]))
+        if outside or landing:
+            break
+        ds = min(ds * 1.5, ds_max) if iterations <= 3 else max(ds / 2, ds_min)
+
+    points = np.array(points)
+    tangents = np.array(tangents)
+    multipliers = np.array(multipliers)
+    states = points[:, :-1].reshape(-1, problem.num_age_groups, 3)
+
+    bifurcations = []
+    for k in range(1, len(points)):
+        for kind in _classify(multipliers[k - 1], multipliers[k], tangents[k - 1], tangents[k]):
+            # where the spectral radius, or for folds the tangent's lam part, crosses over
+            if kind == 'fold':
+                a, b = tangents[k - 1][-1], tangents[k][-1]
+            else:
+                a, b = np.max(np.abs(multipliers[k - 1])) - 1, np.max(np.abs(multipliers[k])) - 1
+            weight = a / (a - b) if a != b else 0.5
+            at = points[k - 1] + weight * (points[k] - points[k - 1])
+            bifurcations.append({
+                'kind': kind,
+                'index': k,
+                'parameter': float(at[-1]),
+                'mean_C': float(np.mean(at[:-1].reshape(-1, 3)[:, C_IDX])),
+            })
+
+    return ContinuationResult(name, points[:, -1], states, multipliers, tangents, bifurcations, solves)
+
+
+def _initial_steady_state(problem, lam, tol):
+    rates, guess = problem.rates(lam)
+    p_CS, p_SC, p_DS, p_SD, combined_influence, incoming = rates
+    # combined_influence already is A * B, so it goes in as A with B = 1
+    result = final_project_model.solve_steady_state_batch(
+        p_CS[:, 0], p_SC[:, 0], p_DS[:, 0], p_SD[:, 0], combined_influence, 1.0, guess, incoming, tol=tol)
+    if not result.converged[0]:
+        raise RuntimeError(f'no steady state found at {problem.name}={lam}')
+    return result.state[0].ravel(), int(result.iterations[0])
+
+
+def _correct(problem, predicted, tangent, tol, max_iter=8):
+    """
+    Newton's method on [G(x, lam); tangent . (u - predicted)] = 0.
+
+    Returns:
+    - The corrected point, or None if Newton did not converge
+    - The number of iterations and of linear solves
+    """
+    u = predicted.copy()
+    size = u.size - 1
+    for iteration in range(1, max_iter + 1):
+        x, lam = u[np.newaxis, :-1], u[-1:]
+        g = problem.residual(x, lam)[0]
+        d_state, d_lam = problem.jacobian(x, lam)
+
+        augmented = np.zeros((size + 1, size + 1))
+        augmented[:size, :size] = d_state[0] - np.eye(size)
+        augmented[:size, size] = d_lam[0]
+        augmented[size] = tangent
+        rhs = -np.append(g, tangent @ (u - predicted))
+        try:
+            step = np.linalg.solve(augmented, rhs)
+        except np.linalg.LinAlgError:
+            return None, iteration, iteration
+        u = u + step
+        if not np.all(np.isfinite(u)):
+            return None, iteration, iteration
+        if np.max(np.abs(step)) < tol ** 0.5 and np.max(np.abs(problem.residual(u[np.newaxis, :-1], u[-1:]))) < tol:
+            return u, iteration, iteration
+    return None, max_iter, max_iter
+
+
+def plot_continuation(result, ax=None, color='k', label=None):
+    """
+    Draw mean C along the branch, solid where stable and dashed where not,
+    with each bifurcation marked and labeled.
+
+    Returns:
+    - The axes
+    """
+    import matplotlib.pyplot as plt
+
+    if ax is None:
+        ax = plt.gca()
+    stable = result.stable
+    mean_C = result.mean_C
+    # split into runs of equal stability, overlapping by one point so the curve is unbroken
+    breaks = np.flatnonzero(stable[1:] != stable[:-1]) + 1
+    for run_start, run_stop in zip(np.r_[0, breaks], np.r_[breaks, len(stable)]):
+        segment = slice(max(run_start - 1, 0), run_stop)
+        ax.plot(result.parameter[segment], mean_C[segment], '-' if stable[run_start] else '--', color=color,
+                label=label if run_start == 0 else None)
+    for bifurcation in result.bifurcations:
+        ax.plot(bifurcation['parameter'], bifurcation['mean_C'], 'o', color='r')
+        ax.annotate(bifurcation['kind'], (bifurcation['parameter'], bifurcation['mean_C']),
+                    textcoords='offset points', xytext=(5, 5))
+    ax.set_xlabel(result.name)
+    ax.set_ylabel('Steady state C Percentage')
+    return ax
+
+
+if __name__ == "__main__":
+    import matplotlib.pyplot as plt
+    import seaborn as sb
+
+    print("info: continuation of the steady state in beta")
+    A = final_project_model.sta_A()
+    restock = {f'{compartment}_{age}': 1 / 3 for age in [1, 2, 3, 4, 'incoming'] for compartment in 'CSD'}
+    beta_rets = [.2, .5, .8]
+    colors = ['orange', 'c', 'm']
+
+    start = time.perf_counter()
+    curves = [continue_steady_state('beta', (0, 1), params={'A': A, 'B_step': .1, 'p_CS': r, 'p_DS': r},
+                                    initial_conds=restock)
+              for r in beta_rets]
+    elapsed = time.perf_counter() - start
+    for r, curve in zip(beta_rets, curves):
+        print(f"beta_ret {r}: {len(curve.parameter)} points, {curve.solves} linear solves, "
+              f"stable throughout: {bool(np.all(curve.stable))}, bifurcations: {curve.bifurcations}")
+    print(f"{sum(len(c.parameter) for c in curves)} points in {elapsed:.2f} s")
+
+    # the 50 x 50 heatmap of graph two, run for 10 years, next to the long-run curves
+    steps = 50
+    betas = np.linspace(0, 1, steps)
+    sweep = final_project_model.run_sweep(
+        [('beta', betas), ('beta_ret', betas)], params={'A': A, 'B_step': .1},
+        initial_conds=restock, simulation_years=10, backend='serial')
+
+    fig, (heatmap_ax, curve_ax) = plt.subplots(1, 2, figsize=(16, 7))
+    sb.heatmap(np.flipud(sweep.values), cmap='viridis', ax=heatmap_ax, cbar_kws={'label': 'Final C Percentage'})
+    tick_positions = np.linspace(0, steps - 1, 6)
+    tick_labels = np.round(np.linspace(0, 1, 6), 2)
+    heatmap_ax.set_xticks(tick_positions)
+    heatmap_ax.set_xticklabels(tick_labels)
+    heatmap_ax.set_yticks(tick_positions)
+    heatmap_ax.set_yticklabels(np.flip(tick_labels))
+    heatmap_ax.set_xlabel('Beta Ret (p_CS, p_DS)')
+    heatmap_ax.set_ylabel('Beta (p_SC, p_SD)')
+    heatmap_ax.set_title('Beta Values vs Final C Percent')
+    for r, color in zip(beta_rets, colors):
+        # each curve is a vertical slice of the heatmap at its beta_ret
+        heatmap_ax.axvline(r * (steps - 1) + .5, color=color, linestyle=':')
+
+    for r, curve, color in zip(beta_rets, curves, colors):
+        plot_continuation(curve, curve_ax, color=color, label=f'beta_ret {r}')
+    curve_ax.legend()
+    curve_ax.set_xlabel('Beta (p_SC, p_SD)')
+    curve_ax.set_title('Steady State C Percent by Beta')
+    plt.tight_layout()
+    plt.show()
@@ -0,0 +1,307 @@
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+
+import final_project_model
+from final_project_model import C_IDX
+
+
+def load_spec(path):
+    # experiment specs are JSON, or TOML where tomllib is available (3.11+)
+    if path.endswith('.toml'):
+        import tomllib
+        with open(path, 'rb') as f:
+            return tomllib.load(f)
+    with open(path) as f:
+        return json.load(f)
+
+
+def _matrix(value, matrices):
+    # a named matrix, {"diagonal": x, "off_diagonal": y}, or a literal nested list
+    if isinstance(value, str):
+        return _matrix(matrices[value], matrices)
+    if isinstance(value, dict):
+        return final_project_model.mixing_A(value['diagonal'], value['off_diagonal'], value.get('size', 4))
+    return np.asarray(value, dtype=float)
+
+
+def _values(value):
+    # an axis is a literal list or {"linspace": [start, stop, num]}
+    if isinstance(value, dict):
+        return np.linspace(*value['linspace'])
+    return value
+
+
+def _initial_conds(value, num_age_groups):
+    # "restock": [C, S, D] puts every cohort and the intake at the same mix
+    if value is None:
+        return {}
+    if 'restock' in value:
+        C, S, D = value['restock']
+        conds = {f'{compartment}_{age}': share
+                 for age in range(1, num_age_groups + 1) for compartment, share in zip('CSD', (C, S, D))}
+        conds.update({'C_incoming': C, 'S_incoming': S, 'D_incoming': D})
+        return conds
+    return value
+
+
+def row_layout(num_age_groups):
+    # run_batch inputs and their per-simulation shapes, in the order they are laid out in a row
+    K = num_age_groups
+    return [
+        ('p_CS', ()),
+        ('p_SC', ()),
+        ('p_DS', ()),
+        ('p_SD', ()),
+        ('A', (K, K)),
+        ('B', (K, K)),
+        ('initial_states', (K, 3)),
+        ('incoming', (3,)),
+    ]
+
+
+class Experiment:
+    def __init__(self, spec, defaults, matrices):
+        self.spec = spec
+        self.name = spec['name']
+        self.kind = spec.get('kind', 'heatmap')
+        self.simulation_years = spec.get('simulation_years', defaults.get('simulation_years', 10))
+
+        params = dict(defaults.get('params', {}))
+        params.update(spec.get('params', {}))
+        if 'beta' in params:
+            params['p_SC'] = params['p_SD'] = params.pop('beta')
+        if 'beta_ret' in params:
+            params['p_CS'] = params['p_DS'] = params.pop('beta_ret')
+        if 'A' in params:
+            params['A'] = _matrix(params['A'], matrices)
+
+        axes = []
+        for name, value in spec.get('axes', []):
+            if name == 'A':
+                value = {label: _matrix(label, matrices) for label in value}
+            else:
+                value = _values(value)
+            axes.append((name, value))
+
+        self.plan = final_project_model.SweepPlan(axes, params, {}, self.simulation_years, None)
+        # the plan works out the number of cohorts, which a restock mix is spread over
+        self.plan.initial_conds = _initial_conds(spec.get('initial_conds', defaults.get('initial_conds')),
+                                                 self.plan.num_age_groups)
+
+    def rows(self):
+        return plan_rows(self.plan, 0, self.plan.size)
+
+
+def plan_rows(plan, start, stop):
+    # one flat row of every model input per simulation, used to find duplicates
+    inputs = plan.batch_inputs(start, stop)
+    n = stop - start
+    columns = [np.full((n, 1), float(plan.simulation_years))]
+    for key, shape in row_layout(plan.num_age_groups):
+        columns.append(np.broadcast_to(np.asarray(inputs[key], dtype=float), (n,) + shape).reshape(n, -1))
+    return np.concatenate(columns, axis=1)
+
+
+def _unpack_rows(rows, num_age_groups):
+    # inverse of plan_rows, without the leading simulation_years column
+    inputs = {}
+    offset = 1
+    for key, shape in row_layout(num_age_groups):
+        width = int(np.prod(shape))
+        inputs[key] = rows[:, offset:offset + width].reshape((-1,) + shape)
+        offset += width
+    return inputs
+
+
+def simulate(experiments, chunk_size=10000):
+    """
+    Run every distinct simulation across the experiments exactly once.
+
+    Returns:
+    - {experiment name: trajectories shaped like its grid + (years + 1, K, 3)}
+    - The number of simulations requested and the number actually run
+    """
+    outputs = {}
+    requested = run = 0
+    # rows only line up between experiments with as many cohorts
+    for num_age_groups in sorted({experiment.plan.num_age_groups for experiment in experiments}):
+        group = [experiment for experiment in experiments if experiment.plan.num_age_groups == num_age_groups]
+        rows = [experiment.rows() for experiment in group]
+        unique, inverse = np.unique(np.concatenate(rows), axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+
+        trajectories = {}
+        for years in np.unique(unique[:, 0]):
+            # simulations of one horizon stack into one batch
+            idx = np.flatnonzero(unique[:, 0] == years)
+            results = np.empty((idx.size, int(years) + 1, num_age_groups, 3))
+            for start in range(0, idx.size, chunk_size):
+                chunk = idx[start:start + chunk_size]
+                results[start:start + chunk.size] = final_project_model.run_batch(
+                    simulation_years=int(years), **_unpack_rows(unique[chunk], num_age_groups))
+            trajectories[int(years)] = (idx, results)
+
+        offset = 0
+        for experiment, experiment_rows in zip(group, rows):
+            positions = inverse[offset:offset + len(experiment_rows)]
+            offset += len(experiment_rows)
+            idx, results = trajectories[experiment.simulation_years]
+            lookup = np.searchsorted(idx, positions)
+            outputs[experiment.name] = results[lookup].reshape(experiment.plan.shape + results.shape[1:])
+
+        requested += sum(len(r) for r in rows)
+        run += len(unique)
+
+    return outputs, requested, run
+
+
+def heatmap_job(experiment, values):
+    # the last two axes are the heatmap's rows and columns, any leading axes lay out panels
+    spec = experiment.spec
+    panel_names = experiment.plan.names[:-2]
+    panel_coords = experiment.plan.coords[:-2]
+    titles = np.empty([len(c) for c in panel_coords], dtype=object)
+    for index in np.ndindex(titles.shape):
+        labels = {name: coords[i] for name, coords, i in zip(panel_names, panel_coords, index)}
+        titles[index] = spec.get('title', experiment.name).format(**labels)
+
+    job = {
+        'kind': 'heatmap',
+        'name': experiment.name,
+        'values': values,
+        'x': experiment.plan.values[-1],
+        'y': experiment.plan.values[-2],
+        'titles': titles,
+        'xlabel': spec.get('xlabel', experiment.plan.names[-1]),
+        'ylabel': spec.get('ylabel', experiment.plan.names[-2]),
+        'colorbar': spec.get('colorbar', 'Final C Percentage'),
+    }
+    if 'figsize' in spec:
+        job['figsize'] = spec['figsize']
+    return [job]
+
+
+def trajectory_jobs(experiment, trajectories):
+    # one job per grid point, suffixed with the point's labels
+    jobs = []
+    for index in np.ndindex(experiment.plan.shape):
+        suffix = ''.join(f'-{name}={coords[i]}' for name, coords, i
+                         in zip(experiment.plan.names, experiment.plan.coords, index))
+        jobs.append({'kind': 'trajectory', 'name': experiment.name + suffix, 'states': trajectories[index]})
+    return jobs
+
+
+def matrix_jobs(experiment, matrices):
+    jobs = []
+    for label, value in experiment.spec['matrices'].items():
+        if isinstance(value, dict) and 'B_step' in value:
+            matrix = final_project_model.elder_efficacy_B(value['beta'], value['B_step'])
+        else:
+            matrix = _matrix(value, matrices)
+        ages = np.arange(len(matrix))
+        jobs.append({
+            'kind': 'heatmap',
+            'name': f'{experiment.name}-{label}',
+            'values': matrix,
+            'x': ages,
+            'y': ages,
+            'ticks': None,
+            'titles': label,
+            'colorbar': experiment.spec.get('colorbar', ''),
+            'figsize': (6.4, 4.8),
+        })
+    return jobs
+
+
+def run_experiments(spec, out_dir, only=None, formats=('png',), render_backend='process', max_workers=None):
+    """
+    Run the experiments of a spec headlessly, simulating each distinct
+    parameter set once, and write <name>.npz numeric results, figures and a
+    summary.json with timings and simulation counts to out_dir. Figures
+    are drawn by figure_renderer.render on render_backend.
+
+    Returns:
+    - The summary dict
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    matrices = spec.get('matrices', {})
+    defaults = spec.get('defaults', {})
+    experiments = [Experiment(e, defaults, matrices) for e in spec['experiments']
+                   if only is None or e['name'] in only]
+
+    start = time.perf_counter()
+    simulated = [e for e in experiments if e.kind != 'matrices']
+    outputs, requested, run = simulate(simulated)
+    simulation_time = time.perf_counter() - start
+
+    files = []
+    jobs = []
+    for experiment in experiments:
+        if experiment.kind == 'matrices':
+            jobs.extend(matrix_jobs(experiment, matrices))
+            continue
+
+        trajectories = outputs[experiment.name]
+        final_C = np.mean(trajectories[..., -1, :, C_IDX], axis=-1)
+        np.savez_compressed(
+            os.path.join(out_dir, f'{experiment.name}.npz'),
+            trajectories=trajectories, final_C=final_C,
+            axis_names=np.array(experiment.plan.names, dtype=str),
+            **{f'axis_{name}': np.array(coords) for name, coords
+               in zip(experiment.plan.names, experiment.plan.coords)})
+        files.append(f'{experiment.name}.npz')
+
+        if experiment.kind == 'trajectory':
+            jobs.extend(trajectory_jobs(experiment, trajectories))
+        else:
+            jobs.extend(heatmap_job(experiment, final_C))
+
+    # matplotlib is only loaded once there is something to draw
+    import figure_renderer
+    figures, render_time = figure_renderer.render(jobs, out_dir, formats, render_backend, max_workers)
+    files.extend(figures)
+
+    summary = {
+        'experiments': [e.name for e in experiments],
+        'simulations_requested': requested,
+        'simulations_run': run,
+        'simulation_seconds': simulation_time,
+        'render_seconds': render_time,
+        'figures': len(figures),
+        'files': files,
+    }
+    with open(os.path.join(out_dir, 'summary.json'), 'w') as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run experiment specs headlessly and write results and figures.')
+    parser.add_argument('specs', nargs='+', help='JSON or TOML experiment specs')
+    parser.add_argument('-o', '--out-dir', default='figures', help='output directory')
+    parser.add_argument('--only', nargs='+', help='names of the experiments to run')
+    parser.add_argument('--format', nargs='+', default=['png'], help='image formats, e.g. png svg')
+    parser.add_argument('--workers', type=int, help='rendering processes, one per CPU by default')
+    args = parser.parse_args(argv)
+
+    # experiments from several specs are merged so duplicates across them are run once too
+    spec = {'matrices': {}, 'defaults': {}, 'experiments': []}
+    for path in args.specs:
+        loaded = load_spec(path)
+        spec['matrices'].update(loaded.get('matrices', {}))
+        spec['defaults'].update(loaded.get('defaults', {}))
+        spec['experiments'].extend(loaded['experiments'])
+
+    summary = run_experiments(spec, args.out_dir, args.only, args.format, max_workers=args.workers)
+    print(f"info: {summary['simulations_run']} distinct simulations for "
+          f"{summary['simulations_requested']} requested, "
+          f"{summary['simulation_seconds']:.2f} s simulating, {summary['render_seconds']:.2f} s rendering")
+    print(f"info: wrote {len(summary['files'])} files to {args.out_dir}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,218 @@
+import os
+import time
+import concurrent.futures
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+COMPARTMENTS = ['Confessing (C)', 'Searching (S)', 'Denying (D)']
+
+
+class HeatmapCanvas:
+    def __init__(self, rows, cols, ny, nx, figsize):
+        # one image per panel, shared colour limits and one colorbar for the grid
+        self.figure = Figure(figsize=figsize)
+        FigureCanvasAgg(self.figure)
+        self.axes = self.figure.subplots(rows, cols, squeeze=False)
+        self.images = np.empty((rows, cols), dtype=object)
+        for index, ax in np.ndenumerate(self.axes):
+            self.images[index] = ax.imshow(np.zeros((ny, nx)), origin='lower', aspect='auto',
+                                           cmap='viridis', interpolation='nearest')
+
+        if rows * cols > 1:
+            cbar_ax = self.figure.add_axes([0.15, 0.95, 0.7, 0.02])
+            self.colorbar = self.figure.colorbar(self.images[0, 0], cax=cbar_ax, orientation='horizontal')
+            self.figure.subplots_adjust(top=0.9)
+        else:
+            self.colorbar = self.figure.colorbar(self.images[0, 0], ax=self.axes[0, 0])
+
+    def draw(self, job):
+        values = np.asarray(job['values'], dtype=float)
+        values = values.reshape(self.axes.shape + values.shape[-2:])
+        vmin, vmax = np.nanmin(values), np.nanmax(values)
+        titles = np.broadcast_to(np.asarray(job.get('titles', ''), dtype=object), self.axes.shape)
+        shared = self.axes.size > 1
+
+        for (row, col), ax in np.ndenumerate(self.axes):
+            image = self.images[row, col]
+            image.set_data(values[row, col])
+            image.set_clim(vmin, vmax)
+            _set_ticks(ax.set_xticks, ax.set_xticklabels, job['x'], job.get('ticks', 6))
+            _set_ticks(ax.set_yticks, ax.set_yticklabels, job['y'], job.get('ticks', 6))
+            # shared grids label only the bottom row and the left column
+            ax.set_xlabel(job.get('xlabel', '') if not shared or row == self.axes.shape[0] - 1 else '')
+            ax.set_ylabel(job.get('ylabel', '') if not shared or col == 0 else '')
+            ax.set_title(titles[row, col])
+        self.colorbar.set_label(job.get('colorbar', ''))
+        return {'': self.figure}
+
+
+def _set_ticks(set_positions, set_labels, values, ticks):
+    # ticks=None labels every cell, otherwise `ticks` evenly spaced labels over the value range
+    values = np.asarray(values)
+    if ticks is None:
+        set_positions(np.arange(len(values)))
+        set_labels(values)
+    else:
+        set_positions(np.linspace(0, len(values) - 1, ticks))
+        set_labels(np.round(np.linspace(np.min(values), np.max(values), ticks), 2))
+
+
+class TrajectoryCanvas:
+    def __init__(self, years, num_age_groups):
+        # the two figures of final_project_model.plot_trajectory, with line artists kept for reuse
+        t = np.arange(years)
+        zeros = np.zeros(years)
+
+        self.by_compartment = Figure(figsize=(14, 10))
+        FigureCanvasAgg(self.by_compartment)
+        axes = self.by_compartment.subplots(2, 2).ravel()
+
+        self.total_lines = [axes[0].plot(t, zeros, style, label=label)[0] for style, label in
+                            zip(['b-', 'g-', 'r-'], ['Christian (C)', 'Susceptible (S)', 'Denying (D)'])]
+        axes[0].set_title('Total Population Proportions by Compartment')
+        axes[0].legend()
+
+        if num_age_groups <= 4:
+            colors = ['b', 'g', 'r', 'y']
+        else:
+            import matplotlib
+            colors = matplotlib.colormaps['viridis'](np.linspace(0, 1, num_age_groups))
+
+        self.cohort_lines = []
+        for c_idx, compartment in enumerate(COMPARTMENTS):
+            ax = axes[c_idx + 1]
+            self.cohort_lines.append([ax.plot(t, zeros, '-', color=colors[age],
+                                              label=f'{compartment} - Year {age + 1}')[0]
+                                      for age in range(num_age_groups)])
+            ax.set_title(f'{compartment} by Academic Year')
+            if num_age_groups <= 8:
+                ax.legend()
+
+        for ax in axes:
+            ax.set_xlabel('Years')
+            ax.set_ylabel('Population Proportion')
+            ax.grid(True)
+            ax.set_ylim(0, 1.0)
+        self.by_compartment.tight_layout()
+
+        self.stacked = Figure(figsize=(12, 6))
+        FigureCanvasAgg(self.stacked)
+        self.stacked_ax = self.stacked.subplots()
+        self.stacked_ax.set_xlabel('Years')
+        self.stacked_ax.set_ylabel('Population Proportion')
+        self.stacked_ax.set_title('Evolution of Religious Belief Proportions')
+        self.stacked_ax.grid(True, alpha=0.3)
+        self.stacked_ax.set_ylim(0, 1.0)
+        self.stacked_ax.set_xlim(0, years - 1)
+        self.areas = []
+
+    def draw(self, job):
+        states = np.asarray(job['states'])
+        totals = np.mean(states, axis=1)
+        for line, total in zip(self.total_lines, totals.T):
+            line.set_ydata(total)
+        for c_idx, lines in enumerate(self.cohort_lines):
+            for age, line in enumerate(lines):
+                line.set_ydata(states[:, age, c_idx])
+
+        # stacked areas are polygons, so only they are redrawn
+        for area in self.areas:
+            area.remove()
+        self.areas = self.stacked_ax.stackplot(np.arange(len(states)), *totals.T, labels=COMPARTMENTS,
+                                               colors=['b', 'g', 'r'], alpha=0.7)
+        self.stacked_ax.legend(loc='upper right')
+        return {'-compartments': self.by_compartment, '-stacked': self.stacked}
+
+
+def _canvas_key(job):
+    if job['kind'] == 'trajectory':
+        return ('trajectory',) + np.shape(job['states'])[:2]
+    shape = np.shape(job['values'])
+    panels = (shape[:-2] + (1, 1))[:2]
+    figsize = job.get('figsize', (6 * panels[1], 6 * panels[0]) if panels != (1, 1) else (10, 8))
+    return ('heatmap',) + panels + shape[-2:] + (tuple(figsize),)
+
+
+class FigureRenderer:
+    def __init__(self):
+        """
+        Draws render jobs onto Agg figures that are built once per canvas
+        shape and then reused, updating image data, line data, ticks and
+        labels instead of creating new figures.
+
+        A job is a dict with a 'kind' and a 'name', the file name without
+        extension. 'heatmap' jobs take 'values' shaped (ny, nx) or
+        (rows, cols, ny, nx) with row 0 drawn at the bottom, 'x' and 'y' tick
+        values, and optional 'titles', 'xlabel', 'ylabel', 'colorbar',
+        'ticks' (None labels every cell) and 'figsize'. 'trajectory' jobs take
+        a (years + 1, K, 3) 'states' and write name-compartments and
+        name-stacked.
+        """
+        self.canvases = {}
+
+    def draw(self, job):
+        key = _canvas_key(job)
+        if key not in self.canvases:
+            if job['kind'] == 'trajectory':
+                self.canvases[key] = TrajectoryCanvas(*key[1:])
+            else:
+                self.canvases[key] = HeatmapCanvas(*key[1:5], figsize=key[5])
+        return self.canvases[key].draw(job)
+
+    def render(self, job, out_dir, formats=('png',)):
+        files = []
+        for suffix, figure in self.draw(job).items():
+            for image_format in formats:
+                filename = f"{job['name']}{suffix}.{image_format}"
+                figure.savefig(os.path.join(out_dir, filename))
+                files.append(filename)
+        return files
+
+
+_renderer = None
+
+
+def _render_chunk(jobs, out_dir, formats):
+    # each worker process keeps one renderer, so its canvases are reused across chunks
+    global _renderer
+    if _renderer is None:
+        _renderer = FigureRenderer()
+    return [filename for job in jobs for filename in _renderer.render(job, out_dir, formats)]
+
+
+def render(jobs, out_dir, formats=('png',), backend='process', max_workers=None):
+    """
+    Render jobs to files in out_dir, in every one of formats ('png', 'svg', ...).
+
+    Jobs are grouped by canvas shape and dealt out in contiguous chunks, one
+    per worker, so each worker builds as few figures as possible. backend is
+    'serial', 'process' or a concurrent.futures.Executor.
+
+    Returns:
+    - The written file names, in job order
+    - The wall-clock rendering time in seconds
+    """
+    start = time.perf_counter()
+    os.makedirs(out_dir, exist_ok=True)
+    order = sorted(range(len(jobs)), key=lambda k: repr(_canvas_key(jobs[k])))
+
+    if backend == 'serial':
+        files = {k: _render_chunk([jobs[k]], out_dir, formats) for k in order}
+    else:
+        workers = max_workers or os.cpu_count() or 1
+        chunks = [[(k, jobs[k]) for k in chunk] for chunk in np.array_split(order, min(workers, max(len(jobs), 1)))]
+        if isinstance(backend, concurrent.futures.Executor):
+            results = list(backend.map(_render_indexed, chunks, [out_dir] * len(chunks), [formats] * len(chunks)))
+        elif backend == 'process':
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(_render_indexed, chunks, [out_dir] * len(chunks), [formats] * len(chunks)))
+        else:
+            raise ValueError(f'unknown render backend {backend!r}')
+        files = {k: names for result in results for k, names in result}
+
+    return [filename for k in range(len(jobs)) for filename in files[k]], time.perf_counter() - start
+
+
+def _render_indexed(indexed_jobs, out_dir, formats):
+    return [(k, _render_chunk([job], out_dir, formats)) for k, job in indexed_jobs]
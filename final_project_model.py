@@ -1,148 +1,517 @@
-import pprint as pp
+import os
+import time
+import itertools
+import collections
+import concurrent.futures
 import numpy as np
-import matplotlib.pyplot as plt
+
+from result_cache import simulation_key
 
 C_IDX = 0
 S_IDX = 1
 D_IDX = 2
 
+# bump whenever the yearly update changes so cached results are invalidated
+MODEL_VERSION = 1
+
+
+# 'C_1', 'S_1', 'D_1', 'C_2', ... per number of cohorts, formatted once
+_COND_KEYS = {}
+
+
+def initial_state_from_conds(initial_conds, num_age_groups=4):
+    # create initial state matrix [age_group, compartment]
+    # compartments in order C, S, D
+    keys = _COND_KEYS.get(num_age_groups)
+    if keys is None:
+        keys = _COND_KEYS[num_age_groups] = [f'{compartment}_{age_idx}' for age_idx in range(1, num_age_groups + 1)
+                                             for compartment in 'CSD']
+
+    # initialize first generation, filled from a list in one go rather than element by element
+    state = np.array([initial_conds.get(key, 1 / 3) for key in keys], dtype=float).reshape(num_age_groups, 3)
+
+    # normalize the state matrix once
+    row_sums = state.sum(axis=1, keepdims=True)
+    return state / row_sums
+
+
+def incoming_from_conds(initial_conds):
+    fresh_C = initial_conds.get('C_incoming', 1 / 3)
+    fresh_S = initial_conds.get('S_incoming', 1 / 3)
+    fresh_D = initial_conds.get('D_incoming', 1 / 3)
+    total = fresh_C + fresh_S + fresh_D
+    return np.array([fresh_C/total, fresh_S/total, fresh_D/total])
+
+
+def elder_efficacy_B(beta, B_step, num_age_groups=4, decimals=3):
+    """
+    Build the B transmission matrix B[i][j] = round(beta + B_step*(j - i), 3).
+
+    beta and B_step may be scalars or vectors of length N, in which case the
+    result has shape (N, num_age_groups, num_age_groups). decimals=None
+    skips the rounding, for callers that need B smooth in beta and B_step.
+    """
+    ages = np.arange(num_age_groups)
+    offsets = ages[np.newaxis, :] - ages[:, np.newaxis]
+    beta = np.asarray(beta, dtype=float)[..., np.newaxis, np.newaxis]
+    B_step = np.asarray(B_step, dtype=float)[..., np.newaxis, np.newaxis]
+    B = beta + B_step * offsets
+    return B if decimals is None else np.round(B, decimals)
+
+
+# each cohort's share of contacts with each academic year, from the STA survey
+STA_CONTACTS = (.3, .3, .25, .15)
+
+
+def mixing_A(diagonal, off_diagonal=None, num_age_groups=4):
+    """
+    Build an A contact matrix with diagonal on the diagonal and off_diagonal
+    everywhere else, by default (1 - diagonal) / (num_age_groups - 1) so
+    rows sum to 1. A large diagonal is homophily, a small one heterophily.
+
+    diagonal and off_diagonal may be scalars or vectors of length N, in
+    which case the result has shape (N, num_age_groups, num_age_groups).
+    """
+    diagonal = np.asarray(diagonal, dtype=float)
+    if off_diagonal is None:
+        off_diagonal = (1 - diagonal) / (num_age_groups - 1)
+    diagonal = diagonal[..., np.newaxis, np.newaxis]
+    off_diagonal = np.asarray(off_diagonal, dtype=float)[..., np.newaxis, np.newaxis]
+    return np.where(np.eye(num_age_groups, dtype=bool), diagonal, off_diagonal)
+
+
+def homophily_A(num_age_groups=4):
+    # case (1) of graph one, .7 on the diagonal and .1 elsewhere
+    return mixing_A(.7, .1, num_age_groups)
+
+
+def heterophily_A(num_age_groups=4):
+    # case (2) of graph one, .1 on the diagonal and .3 elsewhere
+    return mixing_A(.1, .3, num_age_groups)
+
+
+def sta_A():
+    # case (3) of graph one, every cohort splits its contacts as in STA_CONTACTS
+    return np.tile(STA_CONTACTS, (len(STA_CONTACTS), 1))
+
+
+def _frozen(value):
+    array = np.array(value, dtype=float)
+    array.flags.writeable = False
+    return array
+
+
+class ModelParams:
+    """
+    Model parameters, validated once and read-only, with the quantities
+    every yearly update needs worked out up front: the combined influence
+    A * B and the normalized incoming distribution.
+
+    The rates p_CS, p_SC, p_DS, p_SD are scalars, or vectors of length N
+    for a batch of N models, A and B are (K, K) or (N, K, K), and incoming
+    is (3,), (N, 3) or None to leave it to the initial conditions. Without
+    B, B is elder_efficacy_B(p_SC, B_step), or p_SC everywhere if B_step is
+    None too; either way it is remembered as built from p_SC, so replace
+    and sweeps over beta rebuild it. Missing rates and A get
+    DiscreteReligiousBeliefModel's defaults.
+    """
+
+    __slots__ = ('p_CS', 'p_SC', 'p_DS', 'p_SD', 'A', 'B', 'incoming', 'combined_influence', 'num_age_groups',
+                 'size', 'B_step', '_B_given')
+
+    def __init__(self, p_CS=0.05, p_SC=0.05, p_DS=0.05, p_SD=0.05, A=None, B=None, incoming=None,
+                 num_age_groups=None, B_step=None):
+        values = (p_CS, p_SC, p_DS, p_SD)
+        # plain numbers, as a single model's rates usually are, are checked as they are and become immutable
+        # numpy scalars, which skips the array round trips that made up most of the cost of building a model
+        scalar = all(isinstance(value, (int, float)) for value in values)
+        if scalar:
+            valid = all(0 <= value < np.inf for value in values)
+            rates = dict(zip(self.__slots__, map(np.float64, values)))
+        else:
+            rates = dict(zip(self.__slots__, map(_frozen, values)))
+            rate_values = np.concatenate([r.ravel() for r in rates.values()])
+            valid = (rate_values >= 0).all() and np.isfinite(rate_values).all()
+        A = None if A is None else _frozen(A)
+        B_given = B is not None
+        if B_given:
+            B = _frozen(B)
+            B_step = None
+        if num_age_groups is None:
+            num_age_groups = next((m.shape[-1] for m in (A, B) if m is not None and m.ndim), 4)
+        K = num_age_groups
+        if A is None:
+            A = _frozen(np.full((K, K), 1 / K))
+        if not B_given:
+            if B_step is not None:
+                B_step = _frozen(B_step)
+                B = _frozen(elder_efficacy_B(rates['p_SC'], B_step, K))
+            else:
+                B = _frozen(rates['p_SC'][..., np.newaxis, np.newaxis] * np.ones((K, K)))
+
+        for name, matrix in [('A', A), ('B', B)]:
+            if matrix.ndim not in (2, 3) or matrix.shape[-2:] != (K, K):
+                raise ValueError(f'{name} must have shape (K, K) or (N, K, K) with K = {K}, not {matrix.shape}')
+
+        if incoming is not None:
+            incoming = np.array(incoming, dtype=float)
+            if incoming.shape[-1:] != (3,) or np.any(incoming < 0) or np.any(np.sum(incoming, axis=-1) <= 0):
+                raise ValueError('incoming must be (3,) or (N, 3), non-negative, with a positive sum')
+            incoming = _frozen(incoming / np.sum(incoming, axis=-1, keepdims=True))
+        if scalar and A.ndim == 2 and B.ndim == 2 and (incoming is None or incoming.ndim == 1):
+            batch_shape = ()
+        else:
+            batch_shapes = [np.shape(r) for r in rates.values()] + [A.shape[:-2], B.shape[:-2]]
+            if incoming is not None:
+                batch_shapes.append(incoming.shape[:-1])
+            try:
+                batch_shape = np.broadcast_shapes(*batch_shapes)
+            except ValueError:
+                raise ValueError(f'batch shapes {batch_shapes} do not broadcast') from None
+            if len(batch_shape) > 1:
+                raise ValueError(f'a batch of parameters is one dimensional, not {batch_shape}')
+
+        # as few passes as possible over what has to be non-negative and finite, naming the culprit only on
+        # failure; B only has to be finite, elder_efficacy_B goes below zero for small beta. A * B is finite
+        # exactly when A and B are, an inf or NaN in either gives an inf or NaN in the product
+        combined_influence = A * B
+        if not (valid and A.min() >= 0 and np.isfinite(combined_influence).all()):
+            named = dict(rates, A=A)
+            name = next((n for n, v in named.items() if not ((v >= 0).all() and np.isfinite(v).all())), None)
+            if name is None:
+                raise ValueError('B must be finite')
+            raise ValueError(f'{name} must be finite and non-negative')
+
+        combined_influence.flags.writeable = False
+        for name, value in zip(self.__slots__, (*rates.values(), A, B, incoming, combined_influence, K,
+                                                batch_shape[0] if batch_shape else None, B_step, B_given)):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        # combined_influence would go stale, make a new one with replace
+        raise AttributeError(f'{type(self).__name__} is read-only, use replace()')
+
+    def __reduce__(self):
+        # pickle and copy go through __init__, the default state restore would hit __setattr__
+        return type(self), (self.p_CS, self.p_SC, self.p_DS, self.p_SD, self.A, self.B if self._B_given else None,
+                            self.incoming, self.num_age_groups, self.B_step)
+
+    def __repr__(self):
+        batch = '' if self.size is None else f', size={self.size}'
+        return f'ModelParams(num_age_groups={self.num_age_groups}{batch})'
+
+    @classmethod
+    def from_dict(cls, params, num_age_groups=None, incoming=None):
+        # the params dicts taken by DiscreteReligiousBeliefModel and run_sweep
+        keys = ('p_CS', 'p_SC', 'p_DS', 'p_SD', 'A', 'B')
+        return cls(**{key: params[key] for key in keys if key in params}, incoming=incoming,
+                   num_age_groups=num_age_groups)
+
+    @classmethod
+    def from_betas(cls, beta, beta_ret, A=None, B_step=None, incoming=None):
+        """
+        Parameters as the scripts and sweeps set them: beta is p_SC and
+        p_SD, beta_ret is p_CS and p_DS, and B is elder_efficacy_B(beta,
+        B_step), or beta everywhere without B_step. beta, beta_ret and
+        B_step may be vectors of length N for a batch.
+        """
+        return cls(beta_ret, beta, beta_ret, beta, A, None, incoming, B_step=B_step)
+
+    @classmethod
+    def stack(cls, params_list):
+        """
+        Returns:
+        - One batch ModelParams of the single-model ModelParams in params_list
+        """
+        incoming = [params.incoming for params in params_list]
+        if any(value is None for value in incoming):
+            if not all(value is None for value in incoming):
+                raise ValueError('either every or no ModelParams in a stack sets incoming')
+            incoming = None
+        fields = {name: np.stack([getattr(params, name) for params in params_list])
+                  for name in ('p_CS', 'p_SC', 'p_DS', 'p_SD', 'A', 'B')}
+        return cls(**fields, incoming=incoming, num_age_groups=params_list[0].num_age_groups)
+
+    def replace(self, **changes):
+        # a B built from p_SC is rebuilt from the new one, unless B or B_step is changed too
+        values = {name: getattr(self, name) for name in ('p_CS', 'p_SC', 'p_DS', 'p_SD', 'A', 'incoming')}
+        if self._B_given:
+            values.update(B=self.B, B_step=None)
+        else:
+            values.update(B=None, B_step=self.B_step)
+        if 'B_step' in changes:
+            values['B'] = None
+        values.update(changes)
+        return type(self)(**values, num_age_groups=self.num_age_groups)
+
+    def as_dict(self):
+        # the params dict form, e.g. for cache keys
+        return {name: getattr(self, name) for name in ('p_CS', 'p_SC', 'p_DS', 'p_SD', 'A', 'B')}
+
+    def sweep_params(self):
+        """
+        Returns:
+        - The params dict of run_sweep for these parameters: B only if it was
+          given, else B_step if set, so a swept beta rebuilds B, and incoming
+          if set
+        """
+        if self.size is not None:
+            raise ValueError('a sweep takes the parameters of a single model, not a batch')
+        params = {name: getattr(self, name) for name in ('p_CS', 'p_SC', 'p_DS', 'p_SD', 'A')}
+        if self._B_given:
+            params['B'] = self.B
+        elif self.B_step is not None:
+            params['B_step'] = self.B_step
+        if self.incoming is not None:
+            params['incoming'] = self.incoming
+        return params
+
+    def batch_inputs(self):
+        """
+        Returns:
+        - run_batch's rate, A, B and incoming arguments, to go with initial_states
+        """
+        if self.incoming is None:
+            raise ValueError('batch inputs need incoming to be set')
+        return dict(self.as_dict(), incoming=self.incoming)
+
+    def rates(self, n=None, dtype=np.float64):
+        """
+        The stacked rates of _batch_rates for n models (default the batch
+        size, or 1), from the precomputed combined influence.
+
+        Returns:
+        - p_CS, p_SC, p_DS, p_SD as (n, 1), combined_influence (n, K, K)
+          and incoming (n, 3)
+        """
+        if self.incoming is None:
+            raise ValueError('rates need incoming to be set')
+        n = (self.size or 1) if n is None else n
+        columns = [np.broadcast_to(np.asarray(p, dtype=dtype), (n,))[:, np.newaxis]
+                   for p in (self.p_CS, self.p_SC, self.p_DS, self.p_SD)]
+        K = self.num_age_groups
+        combined_influence = np.broadcast_to(np.asarray(self.combined_influence, dtype=dtype), (n, K, K))
+        incoming = np.broadcast_to(np.asarray(self.incoming, dtype=dtype), (n, 3))
+        return (*columns, combined_influence, incoming)
+
 
 class DiscreteReligiousBeliefModel:
-    def __init__(self, params, initial_conds, simulation_years=4):
+    def __init__(self, params, initial_conds, simulation_years=4, num_age_groups=None, incoming=None,
+                 dtype=np.float64):
+        """
+        initial_conds is either the dict form with 'C_1' ... 'D_<K>' and
+        'C_incoming' ... 'D_incoming' keys, or a (K, 3) array of C, S, D per
+        cohort. The number of cohorts K is taken from the array, or from
+        num_age_groups (default 4) for the dict form. incoming, a length 3
+        array, overrides the incoming distribution of either form.
+
+        dtype is the floating point type of the state, the rates and the
+        results. np.float32 halves their memory at about 7 significant
+        digits per step, see precision.py for how much of that survives a
+        run.
+
+        params is a dict with any of p_CS, p_SC, p_DS, p_SD, A and B, or a
+        ModelParams, whose incoming distribution, if set, takes the place of
+        the one in initial_conds. Either way it is validated and read once,
+        here; later changes to a params dict have no effect.
+        """
         self.params = params
         self.simulation_years = simulation_years
-        self.num_age_groups = 4
+        self.dtype = np.dtype(dtype)
 
-        # create initial state matrix [age_group, compartment]
-        # compartments in order C, S, D
-        state = np.zeros((self.num_age_groups, 3))
+        if incoming is None and isinstance(params, ModelParams):
+            incoming = params.incoming
+        if incoming is not None:
+            incoming = np.array(incoming, dtype=float)
+            incoming /= np.sum(incoming)
 
-        # initialize first generation
-        for i in range(self.num_age_groups):
-            age_idx = i + 1
+        if isinstance(initial_conds, dict):
+            self.num_age_groups = 4 if num_age_groups is None else num_age_groups
+            state = initial_state_from_conds(initial_conds, self.num_age_groups)
+            if incoming is None:
+                incoming = incoming_from_conds(initial_conds)
+        else:
+            state = np.array(initial_conds, dtype=float)
+            if state.ndim != 2 or state.shape[1] != 3:
+                raise ValueError(f'initial state must have shape (K, 3), not {state.shape}')
+            if num_age_groups is not None and num_age_groups != state.shape[0]:
+                raise ValueError(f'initial state has {state.shape[0]} cohorts, expected {num_age_groups}')
+            self.num_age_groups = state.shape[0]
+            state /= np.sum(state, axis=1, keepdims=True)
+            if incoming is None:
+                incoming = np.full(3, 1 / 3)
 
-            c_val = initial_conds.get(f'C_{age_idx}', 1 / 3)
-            s_val = initial_conds.get(f'S_{age_idx}', 1 / 3)
-            d_val = initial_conds.get(f'D_{age_idx}', 1 / 3)
+        # both are fresh arrays by now, only a different dtype needs a copy
+        self.incoming = incoming.astype(self.dtype, copy=False)
+        self.state = state.astype(self.dtype, copy=False)
+        self.initial_conditions = initial_conds
 
-            state[i, C_IDX] = c_val
-            state[i, S_IDX] = s_val
-            state[i, D_IDX] = d_val
+        if isinstance(params, ModelParams):
+            if params.size is not None or params.num_age_groups != self.num_age_groups:
+                raise ValueError(f'params must be a single model with {self.num_age_groups} age groups')
+            self.model_params = params
+        else:
+            self.model_params = ModelParams.from_dict(params, self.num_age_groups)
+        model_params = self.model_params
+        self._rate_values = (model_params.p_CS, model_params.p_SC, model_params.p_DS, model_params.p_SD,
+                             model_params.A, model_params.B)
+        if self.dtype != np.float64:
+            # rates in the model's dtype, so a float64 scalar cannot promote a float32 state
+            self._rate_values = tuple(np.asarray(value, dtype=self.dtype) for value in self._rate_values)
+        self.combined_influence = np.asarray(model_params.combined_influence, dtype=self.dtype)
 
-        # normalize the state matrix once
-        row_sums = np.sum(state, axis=1, keepdims=True)
-        state = state / row_sums
+        # filled by run_simulation depending on its output mode
+        self.results = None
+        self.reduced = None
 
-        self.state = state
-        self.initial_conditions = initial_conds
+    def run_simulation(self, cache=None, output='full', kernel='reference', tracer=None):
+        """
+        Advance the model simulation_years years.
 
-        self.results = np.zeros((simulation_years + 1, self.num_age_groups, 3))
-        self.results[0] = self.state.copy()
+        output selects what is kept:
+        - 'full': every year's state in self.results, shape (years + 1, K, 3)
+        - 'final': only the final state, in self.state
+        - {name: reducer}: each reducer is called on every year's (K, 3)
+          state, year 0 included, and only its values are kept, in
+          self.reduced; see mean_C and senior_minus_freshman_C
 
-    def run_simulation(self):
-        p_CS = self.params.get('p_CS', 0.05)
-        p_SC = self.params.get('p_SC', 0.05)
-        p_DS = self.params.get('p_DS', 0.05)
-        p_SD = self.params.get('p_SD', 0.05)
-        A = np.array(self.params.get('A', [[0.25, 0.25, 0.25, 0.25] for _ in range(self.num_age_groups)]))
-        B = np.array(self.params.get('B', [[p_SC for _ in range(self.num_age_groups)] for _ in range(self.num_age_groups)]))
+        cache is only consulted for output='full'.
+
+        kernel selects the yearly update: 'reference' allocates fresh arrays
+        each year, 'inplace' steps preallocated buffers with no per-year
+        allocation (see _InplaceKernel). Both agree to rounding error.
+
+        tracer, e.g. an instrumentation.StepTracer, has its record method
+        called after every year with the step's wall time, the previous
+        state and the batch rates. A run with a tracer skips the cache.
+
+        Returns:
+        - self.results, self.state or self.reduced respectively
+        """
+        reducers = output if isinstance(output, dict) else None
+        if reducers is None and output not in ('full', 'final'):
+            raise ValueError(f"output must be 'full', 'final' or a dict of reducers, not {output!r}")
+        full = output == 'full'
+
+        if tracer is not None:
+            cache = None
+        if full and cache is not None:
+            # the validated copy, a params dict may have changed since __init__
+            key = simulation_key(self.model_params.as_dict(), self.state, self.incoming, self.simulation_years,
+                                 MODEL_VERSION, *_precision_key(self.dtype))
+            results = cache.get(key)
+            if results is not None:
+                self.results = results
+                self.state = results[-1].copy()
+                return self.results
+
+        p_CS, p_SC, p_DS, p_SD, A, B = self._rates()
 
         # incoming distribution
-        fresh_C = self.initial_conditions.get('C_incoming', 1 / 3)
-        fresh_S = self.initial_conditions.get('S_incoming', 1 / 3)
-        fresh_D = self.initial_conditions.get('D_incoming', 1 / 3)
-        total = fresh_C + fresh_S + fresh_D
-        incoming = np.array([fresh_C/total, fresh_S/total, fresh_D/total])
+        incoming = self.incoming
+
+        if full:
+            self.results = np.empty((self.simulation_years + 1, self.num_age_groups, 3), dtype=self.dtype)
+            self.results[0] = self.state
+        if reducers is not None:
+            reduced = {name: [reducer(self.state)] for name, reducer in reducers.items()}
+
+        if kernel == 'inplace':
+            stepper = _InplaceKernel(
+                _batch_rates(1, self.num_age_groups, p_CS, p_SC, p_DS, p_SD, A, B, incoming, self.dtype))
+            stepper.load(self.state[np.newaxis])
+        elif kernel != 'reference':
+            raise ValueError(f"kernel must be 'reference' or 'inplace', not {kernel!r}")
+        if tracer is not None:
+            traced_rates = _batch_rates(1, self.num_age_groups, p_CS, p_SC, p_DS, p_SD, A, B, incoming,
+                                        self.dtype)
 
         for year in range(1, self.simulation_years + 1):
-            new_state = np.zeros_like(self.state)
+            if tracer is not None:
+                previous, start = self.state[np.newaxis].copy(), time.perf_counter()
+            if kernel == 'inplace':
+                self.state = stepper.step()[0]
+                if full:
+                    self.results[year] = self.state
+            else:
+                # normalize straight into the results when kept
+                out = self.results[year] if full else None
+                self.state = self._step(self.state, p_CS, p_DS, p_SD, self.combined_influence, incoming, out)
+            if tracer is not None:
+                tracer.record(year, time.perf_counter() - start, previous, traced_rates)
 
-            # move students up a year
-            new_state[1:] = self.state[:-1]
-            new_state[0] = incoming
+            if reducers is not None:
+                for name, reducer in reducers.items():
+                    reduced[name].append(reducer(self.state))
 
-            # belief transitions
-            C = new_state[:, C_IDX]
-            S = new_state[:, S_IDX]
-            D = new_state[:, D_IDX]
+        if kernel == 'inplace':
+            # the stepper's view is overwritten by the next run
+            self.state = self.state.copy()
 
-            combined_influence = A * B
-            S_to_C = S * np.dot(combined_influence, C)
-            C_to_S = C * D * S * p_CS
-            S_to_D = D * S * p_SD
-            D_to_S = C * D * S * p_DS
+        if reducers is not None:
+            self.reduced = {name: np.array(values) for name, values in reduced.items()}
+            return self.reduced
+        if not full:
+            return self.state
 
-            # update
-            new_state[:, C_IDX] = C - C_to_S + S_to_C
-            new_state[:, S_IDX] = S - S_to_C - S_to_D + C_to_S + D_to_S
-            new_state[:, D_IDX] = D - D_to_S + S_to_D
+        if cache is not None:
+            cache.put(key, self.results)
 
-            # no negatives from floating point
-            new_state = np.maximum(new_state, 0)
+        return self.results
 
-            # normalize in a single operation
-            row_sums = np.sum(new_state, axis=1, keepdims=True)
-            new_state = new_state / row_sums
+    def run_sensitivities(self):
+        """
+        Run the model from its current state while propagating forward-mode
+        sensitivities, see run_batch_sensitivities.
 
-            # update and store the state
-            self.state = new_state
-            self.results[year] = self.state.copy()
+        Returns:
+        - The final (K, 3) state
+        - {parameter name: d(final state)/d(parameter)}, each (K, 3)
+        """
+        p_CS, p_SC, p_DS, p_SD, A, B = self._rates()
+        final_state, jacobian = run_batch_sensitivities(
+            p_CS, p_SC, p_DS, p_SD, A, B, self.state[np.newaxis], self.incoming, self.simulation_years)
+        names = sensitivity_names(self.num_age_groups)
+        return final_state[0], {name: jacobian[0, :, :, k] for k, name in enumerate(names)}
 
-        return self.results
+    def _step(self, state, p_CS, p_DS, p_SD, combined_influence, incoming, out=None):
+        new_state = np.zeros_like(state)
 
-    def plot_results(self):
-        states = self.results
-        years = np.arange(len(states))
+        # move students up a year
+        new_state[1:] = state[:-1]
+        new_state[0] = incoming
 
-        # mean across age groups
-        # assume equal cohort sizes
-        total_C = np.mean(states[:, :, 0], axis=1)
-        total_S = np.mean(states[:, :, 1], axis=1)
-        total_D = np.mean(states[:, :, 2], axis=1)
+        # belief transitions
+        C = new_state[:, C_IDX]
+        S = new_state[:, S_IDX]
+        D = new_state[:, D_IDX]
 
-        plt.figure(figsize=(14, 10))
+        S_to_C = S * np.dot(combined_influence, C)
+        C_to_S = C * D * S * p_CS
+        S_to_D = D * S * p_SD
+        D_to_S = C * D * S * p_DS
 
-        plt.subplot(2, 2, 1)
-        plt.plot(years, total_C, 'b-', label='Christian (C)')
-        plt.plot(years, total_S, 'g-', label='Susceptible (S)')
-        plt.plot(years, total_D, 'r-', label='Denying (D)')
-        plt.xlabel('Years')
-        plt.ylabel('Population Proportion')
-        plt.title('Total Population Proportions by Compartment')
-        plt.legend()
-        plt.grid(True)
-        plt.ylim(0, 1.0)
+        # update
+        new_state[:, C_IDX] = C - C_to_S + S_to_C
+        new_state[:, S_IDX] = S - S_to_C - S_to_D + C_to_S + D_to_S
+        new_state[:, D_IDX] = D - D_to_S + S_to_D
 
-        compartments = ['Confessing (C)', 'Searching (S)', 'Denying (D)']
-        colors = ['b', 'g', 'r', 'y']
+        # no negatives from floating point
+        new_state = np.maximum(new_state, 0)
 
-        for c_idx, compartment in enumerate(compartments):
-            plt.subplot(2, 2, c_idx + 2)
-            for age in range(self.num_age_groups):
-                plt.plot(years, states[:, age, c_idx], f'{colors[age]}-',
-                         label=f'{compartment} - Year {age + 1}')
-            plt.xlabel('Years')
-            plt.ylabel('Population Proportion')
-            plt.title(f'{compartment} by Academic Year')
-            plt.legend()
-            plt.grid(True)
-            plt.ylim(0, 1.0)
+        # normalize in a single operation
+        row_sums = np.sum(new_state, axis=1, keepdims=True)
+        return np.divide(new_state, row_sums, out=out)
 
-        plt.tight_layout()
-        plt.show()
+    def _rates(self):
+        # p_CS, p_SC, p_DS, p_SD, A, B, worked out once in __init__
+        return self._rate_values
 
-        # stacked area chart
-        plt.figure(figsize=(12, 6))
-        plt.stackplot(years, total_C, total_S, total_D,
-                      labels=['Confessing (C)', 'Searching (S)', 'Denying (D)'],
-                      colors=['b', 'g', 'r'], alpha=0.7)
-        plt.xlabel('Years')
-        plt.ylabel('Population Proportion')
-        plt.title('Evolution of Religious Belief Proportions')
-        plt.legend(loc='upper right')
-        plt.grid(True, alpha=0.3)
-        plt.ylim(0, 1.0)
-        plt.tight_layout()
+    def plot_results(self):
+        # pyplot is only imported when something is plotted, see benchmark_import.py
+        import matplotlib.pyplot as plt
+
+        plot_trajectory(self.results)
         plt.show()
 
     def find_steady_state(self):
@@ -171,8 +540,987 @@ class DiscreteReligiousBeliefModel:
         print("Warning: Did not find a clear steady state")
         return None
 
+    def solve_steady_state(self, tol=1e-12, max_iter=50):
+        """
+        Solve for the steady state of the yearly update directly instead of
+        scanning self.results, starting from the current state.
+
+        Returns:
+        - A SteadyStateResult with the (K, 3) steady state, the number of
+          iterations, the final residual max|F(x) - x| and whether it
+          converged within tol
+        """
+        p_CS, p_SC, p_DS, p_SD, A, B = self._rates()
+        result = solve_steady_state_batch(p_CS, p_SC, p_DS, p_SD, A, B, self.state[np.newaxis], self.incoming,
+                                          tol=tol, max_iter=max_iter)
+        return SteadyStateResult(result.state[0], int(result.iterations[0]),
+                                 float(result.residual[0]), bool(result.converged[0]))
+
+
+def plot_trajectory(states):
+    """
+    Draw a (years + 1, K, 3) trajectory as two figures: proportions by
+    compartment and by academic year, and a stacked area chart.
+
+    Returns:
+    - The two figures, left open for the caller to show or save
+    """
+    import matplotlib.pyplot as plt
+
+    years = np.arange(len(states))
+    num_age_groups = states.shape[1]
+
+    # mean across age groups
+    # assume equal cohort sizes
+    total_C = np.mean(states[:, :, 0], axis=1)
+    total_S = np.mean(states[:, :, 1], axis=1)
+    total_D = np.mean(states[:, :, 2], axis=1)
+
+    by_compartment = plt.figure(figsize=(14, 10))
+
+    plt.subplot(2, 2, 1)
+    plt.plot(years, total_C, 'b-', label='Christian (C)')
+    plt.plot(years, total_S, 'g-', label='Susceptible (S)')
+    plt.plot(years, total_D, 'r-', label='Denying (D)')
+    plt.xlabel('Years')
+    plt.ylabel('Population Proportion')
+    plt.title('Total Population Proportions by Compartment')
+    plt.legend()
+    plt.grid(True)
+    plt.ylim(0, 1.0)
+
+    compartments = ['Confessing (C)', 'Searching (S)', 'Denying (D)']
+    if num_age_groups <= 4:
+        colors = ['b', 'g', 'r', 'y']
+    else:
+        colors = plt.cm.viridis(np.linspace(0, 1, num_age_groups))
+
+    for c_idx, compartment in enumerate(compartments):
+        plt.subplot(2, 2, c_idx + 2)
+        for age in range(num_age_groups):
+            plt.plot(years, states[:, age, c_idx], '-', color=colors[age],
+                     label=f'{compartment} - Year {age + 1}')
+        plt.xlabel('Years')
+        plt.ylabel('Population Proportion')
+        plt.title(f'{compartment} by Academic Year')
+        # one legend entry per cohort stops being readable past a handful
+        if num_age_groups <= 8:
+            plt.legend()
+        plt.grid(True)
+        plt.ylim(0, 1.0)
+
+    plt.tight_layout()
+
+    # stacked area chart
+    stacked = plt.figure(figsize=(12, 6))
+    plt.stackplot(years, total_C, total_S, total_D,
+                  labels=['Confessing (C)', 'Searching (S)', 'Denying (D)'],
+                  colors=['b', 'g', 'r'], alpha=0.7)
+    plt.xlabel('Years')
+    plt.ylabel('Population Proportion')
+    plt.title('Evolution of Religious Belief Proportions')
+    plt.legend(loc='upper right')
+    plt.grid(True, alpha=0.3)
+    plt.ylim(0, 1.0)
+    plt.tight_layout()
+    return by_compartment, stacked
+
+
+def stack_inputs(params_list, initial_conds_list, num_age_groups=4):
+    """
+    Stack per-model params and initial_conds dicts into the arrays taken by
+    run_batch, applying the same defaults as DiscreteReligiousBeliefModel.
+
+    Returns:
+    - A dict of keyword arguments for run_batch
+    """
+    n = len(params_list)
+    uniform_A = [[1 / num_age_groups] * num_age_groups for _ in range(num_age_groups)]
+
+    stacked = {
+        'p_CS': np.empty(n),
+        'p_SC': np.empty(n),
+        'p_DS': np.empty(n),
+        'p_SD': np.empty(n),
+        'A': np.empty((n, num_age_groups, num_age_groups)),
+        'B': np.empty((n, num_age_groups, num_age_groups)),
+        'initial_states': np.empty((n, num_age_groups, 3)),
+        'incoming': np.empty((n, 3)),
+    }
+    for k, (params, initial_conds) in enumerate(zip(params_list, initial_conds_list)):
+        p_SC = params.get('p_SC', 0.05)
+        stacked['p_CS'][k] = params.get('p_CS', 0.05)
+        stacked['p_SC'][k] = p_SC
+        stacked['p_DS'][k] = params.get('p_DS', 0.05)
+        stacked['p_SD'][k] = params.get('p_SD', 0.05)
+        stacked['A'][k] = params.get('A', uniform_A)
+        stacked['B'][k] = params.get('B', p_SC)
+        stacked['initial_states'][k] = initial_state_from_conds(initial_conds, num_age_groups)
+        stacked['incoming'][k] = incoming_from_conds(initial_conds)
+
+    return stacked
+
+
+def _batch_rates(n, num_age_groups, p_CS, p_SC, p_DS, p_SD, A, B, incoming, dtype=np.float64):
+    # rates as (N, 1) columns so they broadcast over age groups
+    p_CS = np.broadcast_to(np.asarray(p_CS, dtype=dtype), (n,))[:, np.newaxis]
+    p_SC = np.broadcast_to(np.asarray(p_SC, dtype=dtype), (n,))[:, np.newaxis]
+    p_DS = np.broadcast_to(np.asarray(p_DS, dtype=dtype), (n,))[:, np.newaxis]
+    p_SD = np.broadcast_to(np.asarray(p_SD, dtype=dtype), (n,))[:, np.newaxis]
+    # normalized like DiscreteReligiousBeliefModel's, so an intake given as counts or shares works alike
+    incoming = np.asarray(incoming, dtype=dtype)
+    incoming = np.broadcast_to(incoming / np.sum(incoming, axis=-1, keepdims=True), (n, 3))
+
+    # A and B never change, so combine them once up front
+    combined_influence = np.asarray(A, dtype=dtype) * np.asarray(B, dtype=dtype)
+    combined_influence = np.broadcast_to(combined_influence, (n, num_age_groups, num_age_groups))
+
+    return p_CS, p_SC, p_DS, p_SD, combined_influence, incoming
+
+
+def _age_batch(state, incoming):
+    # move students up a year
+    new_state = np.zeros_like(state)
+    new_state[:, 1:] = state[:, :-1]
+    new_state[:, 0] = incoming
+    return new_state
+
+
+def _flows_batch(new_state, rates):
+    # S_to_C, C_to_S, S_to_D, D_to_S of an aged (N, K, 3) state, each (N, K)
+    p_CS, p_SC, p_DS, p_SD, combined_influence, _ = rates
+    C = new_state[:, :, C_IDX]
+    S = new_state[:, :, S_IDX]
+    D = new_state[:, :, D_IDX]
+
+    S_to_C = S * np.matmul(combined_influence, C[:, :, np.newaxis])[:, :, 0]
+    C_to_S = C * D * S * p_CS
+    S_to_D = D * S * p_SD
+    D_to_S = C * D * S * p_DS
+    return S_to_C, C_to_S, S_to_D, D_to_S
+
+
+def _transition_batch(new_state, rates):
+    # belief transitions on an aged state, in place and before the clamp
+    C = new_state[:, :, C_IDX]
+    S = new_state[:, :, S_IDX]
+    D = new_state[:, :, D_IDX]
+    S_to_C, C_to_S, S_to_D, D_to_S = _flows_batch(new_state, rates)
+
+    # update
+    new_state[:, :, C_IDX] = C - C_to_S + S_to_C
+    new_state[:, :, S_IDX] = S - S_to_C - S_to_D + C_to_S + D_to_S
+    new_state[:, :, D_IDX] = D - D_to_S + S_to_D
+    return new_state
+
+
+def _step_batch(state, rates):
+    new_state = _transition_batch(_age_batch(state, rates[-1]), rates)
+
+    # no negatives from floating point
+    new_state = np.maximum(new_state, 0)
+
+    # normalize in a single operation
+    row_sums = np.sum(new_state, axis=-1, keepdims=True)
+    return new_state / row_sums
+
+
+def _transition_tangent(aged, d_aged, rates, d_flows=None):
+    # push tangents d_aged (N, K, 3, P) of the aged state through the belief
+    # transitions, the clamp and the normalization of _step_batch. d_flows
+    # adds the direct (N, K, P) tangents of S_to_C, C_to_S, S_to_D, D_to_S
+    # with respect to parameters
+    p_CS, p_SC, p_DS, p_SD, combined_influence, _ = rates
+    C = aged[:, :, C_IDX, np.newaxis]
+    S = aged[:, :, S_IDX, np.newaxis]
+    D = aged[:, :, D_IDX, np.newaxis]
+    dC = d_aged[:, :, C_IDX]
+    dS = d_aged[:, :, S_IDX]
+    dD = d_aged[:, :, D_IDX]
+    p_CS, p_DS, p_SD = p_CS[:, :, np.newaxis], p_DS[:, :, np.newaxis], p_SD[:, :, np.newaxis]
+
+    d_S_to_C = dS * np.matmul(combined_influence, C) + S * np.matmul(combined_influence, dC)
+    d_CDS = dC * D * S + C * dD * S + C * D * dS
+    d_C_to_S = d_CDS * p_CS
+    d_S_to_D = (dD * S + D * dS) * p_SD
+    d_D_to_S = d_CDS * p_DS
+    if d_flows is not None:
+        d_S_to_C = d_S_to_C + d_flows[0]
+        d_C_to_S = d_C_to_S + d_flows[1]
+        d_S_to_D = d_S_to_D + d_flows[2]
+        d_D_to_S = d_D_to_S + d_flows[3]
+
+    d_new = np.empty_like(d_aged)
+    d_new[:, :, C_IDX] = dC - d_C_to_S + d_S_to_C
+    d_new[:, :, S_IDX] = dS - d_S_to_C - d_S_to_D + d_C_to_S + d_D_to_S
+    d_new[:, :, D_IDX] = dD - d_D_to_S + d_S_to_D
+
+    # the clamp has zero slope where it bites
+    new = _transition_batch(aged.copy(), rates)
+    d_new[new < 0] = 0
+    new = np.maximum(new, 0)
+
+    # d(x / sum x) = (dx - (x / sum x) d(sum x)) / sum x
+    row_sums = np.sum(new, axis=-1, keepdims=True)
+    normalized = new / row_sums
+    d_row_sums = np.sum(d_new, axis=2, keepdims=True)
+    return (d_new - normalized[..., np.newaxis] * d_row_sums) / row_sums[..., np.newaxis]
+
+
+def _step_jacobian_batch(state, rates):
+    # Jacobian of the flattened yearly map, shape (N, K*3, K*3)
+    n, num_age_groups, _ = state.shape
+    size = num_age_groups * 3
+    aged = _age_batch(state, rates[-1])
+
+    # aging copies cohort k-1 into k and replaces cohort 0 with the constant intake
+    d_aged = np.zeros((n, num_age_groups, 3, size))
+    d_aged.reshape(n, size, size)[:, 3:, :size - 3] = np.eye(size - 3)
+
+    return _transition_tangent(aged, d_aged, rates).reshape(n, size, size)
+
+
+class _InplaceKernel:
+    """
+    Yearly update with preallocated work buffers and out= ufuncs only.
+
+    The state is kept compartment-major in a ring of shape (3, 2K, N), so
+    each compartment of each cohort is a contiguous run over the N models,
+    and the live state is ring[:, start:start + K]. Aging moves start back
+    one row and writes the incoming cohort in front, so no cohort is copied
+    except for one shift of K - 1 rows every K years when start reaches the
+    front of the ring. The shift goes one compartment at a time, where
+    source and destination rows don't overlap, so it needs no temporary.
+    """
+
+    def __init__(self, rates):
+        p_CS, p_SC, p_DS, p_SD, combined_influence, incoming = rates
+        n, K, _ = combined_influence.shape
+        dtype = combined_influence.dtype
+        self.num_age_groups = K
+        self.ring = np.empty((3, 2 * K, n), dtype=dtype)
+        self.start = K
+
+        # rates repeated to the (K, N) compartment blocks, multiplying by (N,) rows broadcasts
+        # through a ufunc buffer that is allocated on every call
+        self.p_CS = np.ascontiguousarray(np.broadcast_to(p_CS[:, 0], (K, n)))
+        self.p_DS = np.ascontiguousarray(np.broadcast_to(p_DS[:, 0], (K, n)))
+        self.p_SD = np.ascontiguousarray(np.broadcast_to(p_SD[:, 0], (K, n)))
+        self.incoming = np.ascontiguousarray(incoming.T)
+
+        # A and B shared by every model turn the influence into one (K, K) @ (K, N) product
+        if combined_influence.strides[0] == 0:
+            self.shared_influence = np.ascontiguousarray(combined_influence[0])
+        else:
+            self.shared_influence = None
+            self.combined_influence = np.ascontiguousarray(combined_influence)
+
+        self.influence = np.empty((K, n), dtype=dtype)
+        # the same buffer as N (K, 1) columns, for the per-model matmul
+        self.influence_columns = self.influence.T[:, :, np.newaxis]
+        self.S_to_C = np.empty((K, n), dtype=dtype)
+        self.C_to_S = np.empty((K, n), dtype=dtype)
+        self.S_to_D = np.empty((K, n), dtype=dtype)
+        self.D_to_S = np.empty((K, n), dtype=dtype)
+        self.CDS = np.empty((K, n), dtype=dtype)
+        self.row_sums = np.empty((K, n), dtype=dtype)
+
+    @property
+    def state(self):
+        # (N, K, 3) view of the live rows
+        return self.ring[:, self.start:self.start + self.num_age_groups].transpose(2, 1, 0)
+
+    def load(self, state):
+        self.start = self.num_age_groups
+        self.state[...] = state
+
+    def step(self):
+        K = self.num_age_groups
+
+        # move students up a year by sliding the view back one row
+        if self.start == 0:
+            for compartment in self.ring:
+                compartment[K + 1:] = compartment[:K - 1]
+            self.start = K + 1
+        self.start -= 1
+        self.ring[:, self.start] = self.incoming
+
+        # belief transitions
+        live = self.ring[:, self.start:self.start + K]
+        C = live[C_IDX]
+        S = live[S_IDX]
+        D = live[D_IDX]
+
+        if self.shared_influence is not None:
+            np.matmul(self.shared_influence, C, out=self.influence)
+        else:
+            np.matmul(self.combined_influence, C.T[:, :, np.newaxis], out=self.influence_columns)
+        np.multiply(S, self.influence, out=self.S_to_C)
+        np.multiply(C, D, out=self.CDS)
+        np.multiply(self.CDS, S, out=self.CDS)
+        np.multiply(self.CDS, self.p_CS, out=self.C_to_S)
+        np.multiply(D, S, out=self.S_to_D)
+        np.multiply(self.S_to_D, self.p_SD, out=self.S_to_D)
+        np.multiply(self.CDS, self.p_DS, out=self.D_to_S)
+
+        # update
+        np.subtract(C, self.C_to_S, out=C)
+        np.add(C, self.S_to_C, out=C)
+        np.subtract(S, self.S_to_C, out=S)
+        np.subtract(S, self.S_to_D, out=S)
+        np.add(S, self.C_to_S, out=S)
+        np.add(S, self.D_to_S, out=S)
+        np.subtract(D, self.D_to_S, out=D)
+        np.add(D, self.S_to_D, out=D)
+
+        # no negatives from floating point, a compartment at a time since clamping the strided
+        # live view goes through a ufunc buffer
+        for compartment in (C, S, D):
+            np.maximum(compartment, 0, out=compartment)
+
+        # normalize, summing C + S + D in the same order as np.sum
+        np.add(C, S, out=self.row_sums)
+        np.add(self.row_sums, D, out=self.row_sums)
+        np.divide(live, self.row_sums, out=live)
+        return self.state
+
+
+def run_batch(p_CS, p_SC, p_DS, p_SD, A, B, initial_states, incoming, simulation_years=4,
+              output='full', kernel='reference', tracer=None, dtype=np.float64):
+    """
+    Advance N models at once with the same yearly update as
+    DiscreteReligiousBeliefModel.run_simulation.
+
+    p_CS, p_SC, p_DS, p_SD are scalars or vectors of length N, A and B are
+    (K, K) or (N, K, K), initial_states is (N, K, 3) and incoming is (3,) or
+    (N, 3), normalized to sum to 1 as the model does. Shared inputs are broadcast rather than copied. output and
+    kernel are as for run_simulation, with reducers called on the stacked
+    (N, K, 3) states. tracer is as for run_simulation, recording all N
+    models together. Every input is cast to dtype, which the states and
+    results are kept in.
+
+    Returns:
+    - For 'full', the stacked trajectories, shape (N, simulation_years + 1, K, 3)
+    - For 'final', the final states, shape (N, K, 3)
+    - For reducers, {name: values} with the year on axis 1
+    """
+    initial_states = np.asarray(initial_states, dtype=dtype)
+    n, num_age_groups, _ = initial_states.shape
+    rates = _batch_rates(n, num_age_groups, p_CS, p_SC, p_DS, p_SD, A, B, incoming, dtype)
+
+    reducers = output if isinstance(output, dict) else None
+    if reducers is None and output not in ('full', 'final'):
+        raise ValueError(f"output must be 'full', 'final' or a dict of reducers, not {output!r}")
+    if kernel not in ('reference', 'inplace'):
+        raise ValueError(f"kernel must be 'reference' or 'inplace', not {kernel!r}")
+
+    if output == 'full':
+        results = np.zeros((n, simulation_years + 1, num_age_groups, 3), dtype=dtype)
+        results[:, 0] = initial_states
+    if kernel == 'inplace':
+        stepper = _InplaceKernel(rates)
+        stepper.load(initial_states)
+
+    # outside of 'full' only the current year is kept, so memory is O(N) whatever the horizon
+    state = initial_states
+    if reducers is not None:
+        reduced = {name: [reducer(state)] for name, reducer in reducers.items()}
+    for year in range(1, simulation_years + 1):
+        if tracer is not None:
+            previous, start = np.array(state), time.perf_counter()
+        state = stepper.step() if kernel == 'inplace' else _step_batch(state, rates)
+        if tracer is not None:
+            tracer.record(year, time.perf_counter() - start, previous, rates)
+        if output == 'full':
+            results[:, year] = state
+        elif reducers is not None:
+            for name, reducer in reducers.items():
+                reduced[name].append(reducer(state))
+
+    if output == 'full':
+        return results
+    if reducers is not None:
+        return {name: np.stack(values, axis=1) for name, values in reduced.items()}
+    return state.copy() if kernel == 'inplace' else state
+
+
+def sensitivity_names(num_age_groups=4):
+    # parameter order of the last axis of run_batch_sensitivities' jacobian
+    K = range(num_age_groups)
+    return (['p_CS', 'p_DS', 'p_SD']
+            + [f'A[{i},{j}]' for i in K for j in K]
+            + [f'B[{i},{j}]' for i in K for j in K]
+            + ['C_incoming', 'S_incoming', 'D_incoming'])
+
+
+def run_batch_sensitivities(p_CS, p_SC, p_DS, p_SD, A, B, initial_states, incoming, simulation_years=4,
+                            output='final'):
+    """
+    Run N models as run_batch does while propagating forward-mode tangents,
+    giving the derivative of the final state with respect to every
+    parameter in a single pass.
+
+    The parameters, in sensitivity_names order, are p_CS, p_DS, p_SD, each
+    entry of A and B, and the three incoming proportions. p_SC only
+    enters the update through B, so its effect is in the B entries; for B
+    built by elder_efficacy_B, d/d beta is the sum over the B entries
+    (ignoring the rounding).
+
+    output='full' keeps every year instead of just the last, adding a year
+    axis after N to both results.
+
+    Returns:
+    - The final states, shape (N, K, 3)
+    - The jacobian d(final state)/d(parameter), shape (N, K, 3, P)
+    """
+    if output not in ('full', 'final'):
+        raise ValueError(f"output must be 'full' or 'final', not {output!r}")
+    state = np.asarray(initial_states, dtype=float)
+    n, K, _ = state.shape
+    rates = _batch_rates(n, K, p_CS, p_SC, p_DS, p_SD, A, B, incoming)
+    A = np.broadcast_to(np.asarray(A, dtype=float), (n, K, K))
+    B = np.broadcast_to(np.asarray(B, dtype=float), (n, K, K))
+
+    num_params = 3 + 2 * K * K + 3
+    a_cols = slice(3, 3 + K * K)
+    b_cols = slice(3 + K * K, 3 + 2 * K * K)
+    incoming_cols = slice(num_params - 3, num_params)
+    rows = np.arange(K)
+
+    tangent = np.zeros((n, K, 3, num_params))
+    if output == 'full':
+        states = np.empty((n, simulation_years + 1, K, 3))
+        tangents = np.empty((n, simulation_years + 1, K, 3, num_params))
+        states[:, 0] = state
+        tangents[:, 0] = tangent
+
+    for year in range(1, simulation_years + 1):
+        aged = _age_batch(state, rates[-1])
+        d_aged = np.zeros_like(tangent)
+        d_aged[:, 1:] = tangent[:, :-1]
+        d_aged[:, 0, :, incoming_cols] = np.eye(3)
+
+        C = aged[:, :, C_IDX]
+        S = aged[:, :, S_IDX]
+        D = aged[:, :, D_IDX]
+        CDS = C * D * S
+
+        # S_to_C = S * (A * B) @ C, so row k only depends on A[k, :] and B[k, :]
+        d_S_to_C = np.zeros((n, K, num_params))
+        d_influence_A = np.zeros((n, K, K, K))
+        d_influence_B = np.zeros((n, K, K, K))
+        d_influence_A[:, rows, rows] = B * C[:, np.newaxis, :]
+        d_influence_B[:, rows, rows] = A * C[:, np.newaxis, :]
+        d_S_to_C[:, :, a_cols] = S[:, :, np.newaxis] * d_influence_A.reshape(n, K, K * K)
+        d_S_to_C[:, :, b_cols] = S[:, :, np.newaxis] * d_influence_B.reshape(n, K, K * K)
+
+        d_C_to_S = np.zeros((n, K, num_params))
+        d_C_to_S[:, :, 0] = CDS
+        d_D_to_S = np.zeros((n, K, num_params))
+        d_D_to_S[:, :, 1] = CDS
+        d_S_to_D = np.zeros((n, K, num_params))
+        d_S_to_D[:, :, 2] = D * S
+
+        tangent = _transition_tangent(aged, d_aged, rates, (d_S_to_C, d_C_to_S, d_S_to_D, d_D_to_S))
+        state = _step_batch(state, rates)
+        if output == 'full':
+            states[:, year] = state
+            tangents[:, year] = tangent
+
+    if output == 'full':
+        return states, tangents
+    return state, tangent
+
+
+class SteadyStateResult:
+    def __init__(self, state, iterations, residual, converged):
+        self.state = state
+        self.iterations = iterations
+        self.residual = residual
+        self.converged = converged
+
+    def __repr__(self):
+        return (f'SteadyStateResult(iterations={self.iterations!r}, '
+                f'residual={self.residual!r}, converged={self.converged!r})')
+
+
+def solve_steady_state_batch(p_CS, p_SC, p_DS, p_SD, A, B, initial_states, incoming,
+                             tol=1e-12, max_iter=50):
+    """
+    Solve for the fixed point x = F(x) of the yearly update directly, with
+    Newton's method on the flattened (age group, compartment) state using the
+    analytic Jacobian of F. A Newton step that does not reduce the residual
+    max|F(x) - x| is replaced by a plain F(x) step. Inputs are as for
+    run_batch; initial_states is the starting guess.
+
+    Returns:
+    - A SteadyStateResult with the (N, K, 3) steady states and per-model
+      iteration counts, final residuals and convergence flags
+    """
+    state = np.array(initial_states, dtype=float)
+    n, num_age_groups, _ = state.shape
+    size = num_age_groups * 3
+    rates = _batch_rates(n, num_age_groups, p_CS, p_SC, p_DS, p_SD, A, B, incoming)
+
+    iterations = np.zeros(n, dtype=int)
+    image = _step_batch(state, rates)
+    residual = np.max(np.abs(image - state), axis=(1, 2))
+    active = residual > tol
+
+    for _ in range(max_iter):
+        if not np.any(active):
+            break
+        idx = np.flatnonzero(active)
+        sub_rates = tuple(r[idx] for r in rates)
+        x = state[idx]
+        g = (image[idx] - x).reshape(idx.size, size)
+
+        jacobian = _step_jacobian_batch(x, sub_rates) - np.eye(size)
+        try:
+            step = np.linalg.solve(jacobian, -g[:, :, np.newaxis])[:, :, 0]
+        except np.linalg.LinAlgError:
+            step = np.full_like(g, np.nan)
+
+        candidate = x + step.reshape(x.shape)
+        candidate_image = _step_batch(candidate, sub_rates)
+        candidate_residual = np.max(np.abs(candidate_image - candidate), axis=(1, 2))
+
+        # fall back to a fixed-point step where newton fails to improve
+        fallback = ~(candidate_residual < residual[idx])
+        if np.any(fallback):
+            candidate[fallback] = image[idx][fallback]
+            candidate_image[fallback] = _step_batch(candidate[fallback], tuple(r[fallback] for r in sub_rates))
+            candidate_residual[fallback] = np.max(
+                np.abs(candidate_image[fallback] - candidate[fallback]), axis=(1, 2))
+
+        state[idx] = candidate
+        image[idx] = candidate_image
+        residual[idx] = candidate_residual
+        iterations[idx] += 1
+        active[idx] = candidate_residual > tol
+
+    return SteadyStateResult(state, iterations, residual, ~active)
+
+
+def final_mean_C(results):
+    # mean C across age groups at the last year, assuming equal cohort sizes
+    return np.mean(results[..., -1, :, C_IDX], axis=-1)
+
+
+def mean_C(state):
+    # mean C across age groups of a (..., K, 3) state
+    return np.mean(state[..., :, C_IDX], axis=-1)
+
+
+def senior_minus_freshman_C(state):
+    # difference in C between the oldest and the youngest cohort
+    return state[..., -1, C_IDX] - state[..., 0, C_IDX]
+
+
+SWEEP_AXES = ('beta', 'beta_ret', 'B_step', 'A', 'C_restock', 'D_restock')
+
+
+class SweepResult:
+    def __init__(self, values, axes):
+        # axes is a list of (name, coordinates) in the order of values' leading dims
+        self.values = values
+        self.axes = axes
+
+        # set by run_sweep: simulations taken from a cache or store, and simulations run
+        self.reused = 0
+        self.computed = None
+
+    @property
+    def axis_names(self):
+        return [name for name, _ in self.axes]
+
+    def coords(self, name):
+        return dict(self.axes)[name]
+
+    def sel(self, **labels):
+        """
+        Select by coordinate label, e.g. sel(A='STA Data', B_step=0.1).
+
+        Returns:
+        - The values with the selected axes dropped
+        """
+        index = []
+        for name, coords in self.axes:
+            if name not in labels:
+                index.append(slice(None))
+                continue
+            matches = [k for k, c in enumerate(coords) if c == labels[name]]
+            if not matches:
+                raise KeyError(f'{labels[name]!r} is not a coordinate of axis {name!r}')
+            index.append(matches[0])
+        return self.values[tuple(index)]
+
+
+class SweepPlan:
+    def __init__(self, axes, params, initial_conds, simulation_years, reducer, dtype=np.float64,
+                 num_age_groups=None):
+        """
+        The grid of a run_sweep. The number of cohorts K is num_age_groups,
+        or else read off an A axis or the A or B of params, and 4 as for
+        DiscreteReligiousBeliefModel when none of them is given.
+        """
+        self.names = []
+        self.values = []
+        self.coords = []
+        for name, values in axes:
+            if name not in SWEEP_AXES:
+                raise ValueError(f'unknown sweep axis {name!r}, expected one of {SWEEP_AXES}')
+            if name == 'A':
+                # A axes are labeled, either {label: matrix} or a list of matrices
+                if isinstance(values, dict):
+                    labels, values = list(values.keys()), list(values.values())
+                else:
+                    labels = list(range(len(values)))
+                self.coords.append(labels)
+            else:
+                self.coords.append(list(values))
+            self.names.append(name)
+            self.values.append(np.asarray(values, dtype=float))
+
+        self.shape = tuple(len(v) for v in self.values)
+        self.params = params.sweep_params() if isinstance(params, ModelParams) else params
+        if 'incoming' in self.params and ('C_restock' in self.names or 'D_restock' in self.names):
+            raise ValueError('params cannot set incoming in a sweep over C_restock or D_restock')
+        if num_age_groups is None:
+            matrices = [v for name, v in zip(self.names, self.values) if name == 'A']
+            matrices += [self.params[key] for key in ('A', 'B') if key in self.params]
+            num_age_groups = np.shape(matrices[0])[-1] if matrices else 4
+        self.num_age_groups = num_age_groups
+        self.initial_conds = initial_conds
+        self.simulation_years = simulation_years
+        self.reducer = reducer
+        self.dtype = dtype
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    def batch_inputs(self, start, stop):
+        return self.inputs_at(np.arange(start, stop))
+
+    def inputs_at(self, flat):
+        # run_batch inputs for the grid points at flat indices into shape
+        index = np.unravel_index(flat, self.shape) if self.shape else ()
+        point = dict(zip(self.names, (v[i] for v, i in zip(self.values, index))))
+        params = self.params
+        K = self.num_age_groups
+
+        inputs = {
+            'p_SC': np.broadcast_to(point.get('beta', params.get('p_SC', 0.05)), flat.shape),
+            'p_SD': np.broadcast_to(point.get('beta', params.get('p_SD', 0.05)), flat.shape),
+            'p_CS': np.broadcast_to(point.get('beta_ret', params.get('p_CS', 0.05)), flat.shape),
+            'p_DS': np.broadcast_to(point.get('beta_ret', params.get('p_DS', 0.05)), flat.shape),
+        }
+        inputs['A'] = point.get('A', np.asarray(params.get('A', np.full((K, K), 1 / K))))
+
+        B_step = point.get('B_step', params.get('B_step'))
+        if B_step is not None:
+            inputs['B'] = elder_efficacy_B(inputs['p_SC'], B_step, K)
+        elif 'B' in params:
+            inputs['B'] = np.asarray(params['B'])
+        else:
+            inputs['B'] = np.asarray(inputs['p_SC'])[..., np.newaxis, np.newaxis] * np.ones((K, K))
+
+        if 'C_restock' in point or 'D_restock' in point:
+            incoming = incoming_from_conds(self.initial_conds)
+            C = np.broadcast_to(point.get('C_restock', incoming[C_IDX]), flat.shape)
+            D = np.broadcast_to(point.get('D_restock', incoming[D_IDX]), flat.shape)
+            restock = np.stack([C, 1 - C - D, D], axis=-1)
+            inputs['initial_states'] = np.repeat(restock[:, np.newaxis], K, axis=1)
+            inputs['incoming'] = restock
+        else:
+            state = initial_state_from_conds(self.initial_conds, K)
+            inputs['initial_states'] = np.broadcast_to(state, (flat.size, K, 3))
+            if 'incoming' in params:
+                inputs['incoming'] = np.asarray(params['incoming'])
+            else:
+                inputs['incoming'] = incoming_from_conds(self.initial_conds)
+
+        return inputs
+
+
+def _precision_key(dtype):
+    # extra key parts for a dtype, none for float64 so keys from before the option stay valid
+    return () if np.dtype(dtype) == np.float64 else (np.dtype(dtype).name,)
+
+
+def shard_chunks(num_chunks, index, count):
+    """
+    Split num_chunks chunks into count contiguous runs whose lengths differ
+    by at most one.
+
+    Returns:
+    - The [first, last) chunks of the index-th run
+    """
+    if not 0 <= index < count:
+        raise ValueError(f'shard index {index} is not in [0, {count})')
+    return index * num_chunks // count, (index + 1) * num_chunks // count
+
+
+def _run_sweep_chunk(plan, flat, tracer=None):
+    inputs = plan.inputs_at(flat)
+    if plan.reducer is None:
+        values = run_batch(simulation_years=plan.simulation_years, tracer=tracer, dtype=plan.dtype, **inputs)
+    else:
+        values = plan.reducer(run_batch(simulation_years=plan.simulation_years, output='final',
+                                        tracer=tracer, dtype=plan.dtype, **inputs))
+    # a chunk's tracer comes back with its values so process workers can report too
+    return values if tracer is None else (values, tracer)
+
+
+def _sweep_executor(backend, max_workers):
+    if backend == 'process':
+        return concurrent.futures.ProcessPoolExecutor(max_workers=max_workers)
+    if backend == 'thread':
+        return concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+    raise ValueError(f'unknown sweep backend {backend!r}')
+
+
+def _map_sweep_chunks(plan, jobs, backend, max_workers):
+    # yields the results of (flat, tracer) jobs in order, with a bounded
+    # number in flight so finished chunks do not pile up while the caller
+    # writes them out; jobs is only read as far as the workers get
+    jobs = iter(jobs)
+    first = next(jobs, None)
+    if first is None:
+        return
+    jobs = itertools.chain([first], jobs)
+    if backend == 'serial':
+        for flat, tracer in jobs:
+            yield _run_sweep_chunk(plan, flat, tracer)
+        return
+
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    executor = backend if isinstance(backend, concurrent.futures.Executor) else _sweep_executor(backend, max_workers)
+    try:
+        pending = []
+        for args in jobs:
+            pending.append(executor.submit(_run_sweep_chunk, plan, *args))
+            if len(pending) > 2 * max_workers:
+                yield pending.pop(0).result()
+        for future in pending:
+            yield future.result()
+    finally:
+        if executor is not backend:
+            executor.shutdown()
+
+
+class _SweepWriter:
+    # writes chunks to a results store, filling in the points that earlier
+    # runs into the same directory already computed
+    def __init__(self, directory, plan, metadata):
+        import results_store
+
+        # one model shows the shape and dtype of a grid point's values
+        probe = np.asarray(_run_sweep_chunk(plan, np.arange(min(plan.size, 1))))
+        self.store, self.sources = results_store.open_sweep(
+            directory, list(zip(plan.names, plan.coords)), plan.values, probe.shape[1:], probe.dtype, metadata)
+        self.shape = plan.shape
+
+    def reusable(self, start, stop):
+        """
+        Returns:
+        - The flat points of [start, stop) already in the store, as a bool mask
+        - [(source store, positions in the chunk, flat indices in the source)]
+          for the points to copy in from the sources
+        """
+        flat = np.arange(start, stop)
+        index = np.unravel_index(flat, self.shape) if self.shape else ()
+        have = np.zeros(len(flat), dtype=bool)
+        in_place = np.zeros(len(flat), dtype=bool)
+        copies = []
+        for source, axis_maps, written in self.sources:
+            old = [axis_map[i] for axis_map, i in zip(axis_maps, index)]
+            found = np.all([o >= 0 for o in old], axis=0) & ~have if old else ~have
+            positions = np.flatnonzero(found)
+            old_flat = np.ravel_multi_index([o[positions] for o in old], source.values.shape[:len(old)]) \
+                if old else np.zeros(len(positions), dtype=int)
+            keep = written[old_flat]
+            positions, old_flat = positions[keep], old_flat[keep]
+            have[positions] = True
+            if source is self.store:
+                in_place[positions] = True
+            else:
+                copies.append((source, positions, old_flat))
+        return have, in_place, copies
+
+    def write(self, start, stop, computed, missing, copies):
+        values = np.empty((stop - start,) + self.store.values.shape[len(self.shape):], dtype=self.store.values.dtype)
+        if len(missing) < stop - start:
+            # points already in place are read back so the chunk is written whole
+            values[:] = self.store.flat()[start:stop]
+        for source, positions, old_flat in copies:
+            values[positions] = source.flat()[old_flat]
+        if computed is not None:
+            values[missing] = computed
+        self.store.write(start, stop, values)
+
+    def close(self):
+        import results_store
+
+        self.store.mark_complete()
+        results_store.finish_sweep(self.store.directory)
+        return type(self.store)(self.store.directory)
+
+
+def run_sweep(axes, params=None, initial_conds=None, simulation_years=10, reducer=mean_C,
+              backend='process', max_workers=None, chunk_size=2500, cache=None, tracer=None, store=None,
+              shard=None, dtype=np.float64):
+    """
+    Run the model over the cross product of the given axes.
+
+    axes is a list of (name, values) pairs (or a dict) with names from
+    SWEEP_AXES: beta sets p_SC and p_SD, beta_ret sets p_CS and p_DS, B_step
+    builds B with elder_efficacy_B, A takes {label: matrix} or a list of
+    matrices, and C_restock / D_restock set every cohort and the incoming
+    distribution. Anything not swept comes from params and initial_conds.
+    params is a dict of the model's params, B_step and an incoming
+    distribution that takes the place of initial_conds', or a single-model
+    ModelParams (see ModelParams.sweep_params).
+
+    The grid is split into fixed chunks of chunk_size points which are run
+    with run_batch on the chosen backend: 'serial', 'thread', 'process' or a
+    concurrent.futures.Executor. Chunking does not depend on the number of
+    workers, so results are identical for any max_workers.
+
+    With a result_cache.ResultCache, each chunk is looked up by a hash of its
+    stacked inputs, simulation_years, the reducer's name and MODEL_VERSION,
+    and only missing chunks are run.
+
+    With a tracer, each chunk is run with a fresh tracer.spawn() which is
+    merged back into tracer, so it ends up covering every model of the
+    sweep. Tracing bypasses the cache so that no chunk goes unrecorded.
+
+    With store, a directory, chunks are written to a results_store on disk
+    as they arrive instead of being gathered in memory, and at most a few
+    chunks per worker are held at once, so chunk_size bounds memory even
+    for full trajectories of very large grids. Each finished chunk is a
+    checkpoint: rerunning the same sweep into the same directory after a
+    crash only runs the chunks that were not written. Rerunning it with a
+    refined or extended grid reuses every point whose coordinates match a
+    point of the previous grid (see results_store.open_sweep). The store is
+    returned in place of the SweepResult, with values memory-mapped
+    read-only.
+
+    With shard, an (index, count) pair, only the index-th of count
+    contiguous runs of chunks (see shard_chunks) is run, into store, which
+    is then required. The partition only depends on the grid, chunk_size
+    and count, so every node of a multi-node sweep can work out its own
+    slice; sharded_sweep.merge_shards assembles and checks the full grid.
+
+    dtype is passed on to run_batch, so values, the cache and the store
+    hold it too. Sweeps in different dtypes never share cache entries or
+    stores. precision.validate_precision shows what float32 costs in
+    accuracy on a sample of a sweep.
+
+    Returns:
+    - A SweepResult whose values have the axes as leading dimensions,
+      followed by the shape of reducer's output on the final (4, 3) state
+      (the full trajectory if reducer is None). Its reused and computed
+      attributes count the simulations taken from the cache or store and
+      the ones that were run
+    """
+    if isinstance(axes, dict):
+        axes = list(axes.items())
+    plan = SweepPlan(axes, params or {}, initial_conds or {}, simulation_years, reducer, dtype)
+    bounds = [(start, min(start + chunk_size, plan.size)) for start in range(0, plan.size, chunk_size)]
+    if shard is not None:
+        if store is None:
+            raise ValueError('a shard of a sweep has to be run with a store')
+        first, last = shard_chunks(len(bounds), *shard)
+        bounds = bounds[first:last]
+    chunks = [None] * len(bounds)
+
+    if tracer is not None:
+        cache = None
+    reducer_name = 'none' if reducer is None else f'{reducer.__module__}.{reducer.__qualname__}'
+    if store is not None:
+        sweep = simulation_key(','.join(plan.names), plan.params, plan.initial_conds, simulation_years,
+                               reducer_name, MODEL_VERSION, *_precision_key(dtype))
+        metadata = {'simulation_years': simulation_years, 'reducer': reducer_name,
+                    'model_version': MODEL_VERSION, 'dtype': np.dtype(dtype).name, 'sweep': sweep,
+                    'fingerprint': sweep}
+        if shard is not None:
+            # a shard's store only ever resumes the same slice of the same sweep
+            metadata['shard'] = list(shard)
+            metadata['chunk_size'] = chunk_size
+            metadata['fingerprint'] = simulation_key(sweep, 'shard', list(shard), chunk_size)
+        store = _SweepWriter(store, plan, metadata)
+    # chunks are planned as the workers take them, so only the ones in
+    # flight hold their points and cache keys, however large the grid
+    todo = collections.deque()
+    counts = {'reused': 0, 'computed': 0}
+
+    def plan_chunks():
+        # works out per chunk which points still have to be run, and takes
+        # what the store or cache already has on the way
+        for k, (start, stop) in enumerate(bounds):
+            missing = np.arange(stop - start)
+            copies = []
+            if store is not None:
+                have, in_place, copies = store.reusable(start, stop)
+                counts['reused'] += int(np.count_nonzero(have))
+                if in_place.all():
+                    continue
+                missing = np.flatnonzero(~have)
+                if not len(missing):
+                    store.write(start, stop, None, missing, copies)
+                    continue
+
+            key = None
+            if cache is not None and len(missing) == stop - start:
+                key = simulation_key(plan.batch_inputs(start, stop), simulation_years, reducer_name, MODEL_VERSION,
+                                     *_precision_key(dtype))
+                chunk = cache.get(key)
+                if chunk is not None:
+                    counts['reused'] += stop - start
+                    if store is not None:
+                        store.write(start, stop, chunk, missing, [])
+                    else:
+                        chunks[k] = chunk
+                    continue
+
+            todo.append((k, missing, key, copies))
+            yield start + missing, None if tracer is None else tracer.spawn()
+
+    if max_workers is None:
+        max_workers = min(os.cpu_count() or 1, max(len(bounds), 1))
+    for chunk in _map_sweep_chunks(plan, plan_chunks(), backend, max_workers):
+        # results come back in the order their chunks were planned
+        k, missing, key, copies = todo.popleft()
+        if tracer is not None:
+            chunk, chunk_tracer = chunk
+            tracer.merge(chunk_tracer)
+        start, stop = bounds[k]
+        counts['computed'] += len(missing)
+        if key is not None:
+            cache.put(key, chunk)
+        # with a store each chunk goes straight to disk and is dropped
+        if store is not None:
+            store.write(start, stop, chunk, missing, copies)
+        else:
+            chunks[k] = chunk
+
+    if store is not None:
+        result = store.close()
+    else:
+        values = np.concatenate(chunks, axis=0)
+        values = values.reshape(plan.shape + values.shape[1:])
+        result = SweepResult(values, list(zip(plan.names, plan.coords)))
+    result.reused = counts['reused']
+    result.computed = counts['computed']
+    return result
+
 
 if __name__ == "__main__":
+    import pprint as pp
+
     B_step = 0.1
     beta = 0.4
     beta_ret = beta * 2
@@ -182,7 +1530,7 @@ if __name__ == "__main__":
     #  [0.15, 0.175, 0.2, 0.225],
     #  [0.125, 0.15, 0.175, 0.2]]
     # Influence rate on i from j, B[i][j]
-    B = [[round(beta + B_step*(j - i), 3) for j in range(4)] for i in range(4)]
+    B = elder_efficacy_B(beta, B_step).tolist()
     print("B:")
     pp.pprint(B)
 
@@ -193,7 +1541,7 @@ if __name__ == "__main__":
     #  [0.3, 0.1, 0.3, 0.3],
     #  [0.3, 0.3, 0.1, 0.3],
     #  [0.3, 0.3, 0.3, 0.1]]
-    A = [[homophily if i == j else heterophily for j in range(4)] for i in range(4)]
+    A = mixing_A(homophily, heterophily).tolist()
     print("A:")
     pp.pprint(A)
 
@@ -1,3 +1,4 @@
+import adaptive_heatmap
 import final_project_model
 
 import numpy as np
@@ -10,14 +11,9 @@ if __name__ == "__main__":
     beta = .40
     beta_ret = .20
     B_step = .1
-    B = [[round(beta + B_step*(j - i), 3)
-          for j in range(4)] for i in range(4)]
-    A = [
-        [.3, .3, .25, .15],
-        [.3, .3, .25, .15],
-        [.3, .3, .25, .15],
-        [.3, .3, .25, .15]
-    ]
+    B = final_project_model.elder_efficacy_B(beta, B_step).tolist()
+    # STA data
+    A = final_project_model.sta_A().tolist()
     parameters = {
         'p_SC': beta,
         'p_CS': beta_ret,
@@ -27,40 +23,13 @@ if __name__ == "__main__":
         'B': B,
     }
 
-    results = np.zeros((100, 100))
-    restocks = np.linspace(0, .5, 100)
-    for i, C_restock in enumerate(restocks):
-        for j, D_restock in enumerate(restocks):
-            S_restock = 1 - C_restock - D_restock
-            initial_conditions = {
-                'C_1': C_restock,
-                'S_1': S_restock,
-                'D_1': D_restock,
-
-                'C_2': C_restock,
-                'S_2': S_restock,
-                'D_2': D_restock,
-
-                'C_3': C_restock,
-                'S_3': S_restock,
-                'D_3': D_restock,
-
-                'C_4': C_restock,
-                'S_4': S_restock,
-                'D_4': D_restock,
-
-                'C_incoming': C_restock,
-                'S_incoming': S_restock,
-                'D_incoming': D_restock,
-            }
-
-            model = final_project_model.DiscreteReligiousBeliefModel(
-                parameters, initial_conditions, simulation_years=10)
-            model.run_simulation()
-
-            C_percent = np.sum(
-                model.results[-1][:, final_project_model.C_IDX])/4
-            results[i][j] = C_percent
+    # refine only where the surface bends, then interpolate onto the 100x100 grid
+    heatmap = adaptive_heatmap.adaptive_heatmap(
+        adaptive_heatmap.restock_evaluator(parameters, simulation_years=10),
+        (0, .5), (0, .5), resolution=100)
+    results = heatmap.values
+    print(f"info: {heatmap.evaluations} simulations, estimated error {heatmap.error_estimate:.4f}, "
+          f"{heatmap.check_error:.4f} at worst on the held-out points")
 
     # put 0, 0 in the bottom left
     results_flipped = np.flipud(results)
@@ -11,20 +11,15 @@ if __name__ == "__main__":
             # .1 .7 .1 .1
             # .1 .1 .7 .1
             # .1 .1 .1 .7
-            [[.7 if i == j else .1 for j in range(4)] for i in range(4)],
+            final_project_model.homophily_A(),
             # case (2), heterophily, looks like
             # .1 .3 .3 .3
             # .3 .1 .3 .3
             # .3 .3 .1 .3
             # .3 .3 .3 .1
-            [[.1 if i == j else .3 for j in range(4)] for i in range(4)],
-            # case (3), STA data, looks like
-            [
-                [.3, .3, .25, .15],
-                [.3, .3, .25, .15],
-                [.3, .3, .25, .15],
-                [.3, .3, .25, .15]
-            ]
+            final_project_model.heterophily_A(),
+            # case (3), STA data, every row .3 .3 .25 .15
+            final_project_model.sta_A(),
     ]
 
     # fix betas
@@ -39,12 +34,12 @@ if __name__ == "__main__":
 
     for A in As:
         for B_step in elder_efficacies:
-            B = [[round(beta + B_step*(j - i), 3) for j in range(4)] for i in range(4)]
+            B = final_project_model.elder_efficacy_B(beta, B_step)
             print("B:")
-            pp.pprint(B)
+            pp.pprint(B.tolist())
 
             print("A:")
-            pp.pprint(A)
+            pp.pprint(A.tolist())
 
             parameters['A'] = A
             parameters['B'] = B
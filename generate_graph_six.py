@@ -1,3 +1,5 @@
+import final_project_model
+
 import numpy as np
 import seaborn as sb
 import matplotlib.pyplot as plt
@@ -11,20 +13,15 @@ if __name__ == "__main__":
             # .1 .7 .1 .1
             # .1 .1 .7 .1
             # .1 .1 .1 .7
-            [[.7 if i == j else .1 for j in range(4)] for i in range(4)],
+            final_project_model.homophily_A(),
             # case (2), heterophily, looks like
             # .1 .3 .3 .3
             # .3 .1 .3 .3
             # .3 .3 .1 .3
             # .3 .3 .3 .1
-            [[.1 if i == j else .3 for j in range(4)] for i in range(4)],
-            # case (3), STA data, looks like
-            [
-                [.3, .3, .25, .15],
-                [.3, .3, .25, .15],
-                [.3, .3, .25, .15],
-                [.3, .3, .25, .15]
-            ]
+            final_project_model.heterophily_A(),
+            # case (3), STA data, every row .3 .3 .25 .15
+            final_project_model.sta_A(),
     ]
     beta = 0.4
 
@@ -37,7 +34,7 @@ if __name__ == "__main__":
         ax.set_yticklabels(tick_labels)
         plt.show()
     for i, B_step in enumerate(elder_efficacies):
-        B = [[round(beta + B_step*(j - i), 3) for j in range(4)] for i in range(4)]
+        B = final_project_model.elder_efficacy_B(beta, B_step)
         ax = sb.heatmap(np.flipud(B), cmap='viridis', cbar_kws={'label': 'transmission rate'})
         plt.title('B transmission matrix - ' + B_titles[i])
         ax.set_yticklabels(tick_labels)
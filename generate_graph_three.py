@@ -1,9 +1,14 @@
 import final_project_model
+import sweep_service
+import result_cache
 import numpy as np
-import seaborn as sb
-import matplotlib.pyplot as plt
 
 if __name__ == "__main__":
+    # plotting imports stay out of module scope so spawned sweep workers skip them
+    import seaborn as sb
+    import matplotlib.pyplot as plt
+
+    cache = result_cache.ResultCache()
     restock = 1/3
     initial_conditions = {
         'C_1': restock,
@@ -30,20 +35,15 @@ if __name__ == "__main__":
         # .1 .7 .1 .1
         # .1 .1 .7 .1
         # .1 .1 .1 .7
-        [[.7 if i == j else .1 for j in range(4)] for i in range(4)],
+        final_project_model.homophily_A().tolist(),
         # case (2), heterophily, looks like
         # .1 .3 .3 .3
         # .3 .1 .3 .3
         # .3 .3 .1 .3
         # .3 .3 .3 .1
-        [[.1 if i == j else .3 for j in range(4)] for i in range(4)],
-        # case (3), STA data, looks like
-        [
-            [.3, .3, .25, .15],
-            [.3, .3, .25, .15],
-            [.3, .3, .25, .15],
-            [.3, .3, .25, .15]
-        ]
+        final_project_model.heterophily_A().tolist(),
+        # case (3), STA data, every row .3 .3 .25 .15
+        final_project_model.sta_A().tolist(),
     ]
     A_labels = ["Homophily", "Heterophily", "STA Data"]
     start, end, steps = 0, 1, 50
@@ -57,28 +57,13 @@ if __name__ == "__main__":
     all_results = []
 
     # First pass: compute all results to find global min/max
-    for idx_efficacy, B_step in enumerate(elder_efficacies):
-        for idx_A, A in enumerate(As):
-            results = np.zeros((steps, steps))
-            for i, beta in enumerate(betas):
-                for j, beta_ret in enumerate(beta_rets):
-                    B = [[round(beta + B_step*(j - i), 3)
-                          for j in range(4)] for i in range(4)]
-                    parameters = {
-                        'p_SC': beta,
-                        'p_CS': beta_ret,
-                        'p_SD': beta,
-                        'p_DS': beta_ret,
-                        'A': A,
-                        'B': B,
-                    }
-                    model = final_project_model.DiscreteReligiousBeliefModel(
-                        parameters, initial_conditions, simulation_years=10)
-                    model.run_simulation()
-                    C_percent = np.sum(
-                        model.results[-1][:, final_project_model.C_IDX])/4
-                    results[i][j] = C_percent
-            all_results.append(results)
+    sweep = sweep_service.run_sweep(
+        [('B_step', elder_efficacies), ('A', dict(zip(A_labels, As))),
+         ('beta', betas), ('beta_ret', beta_rets)],
+        initial_conds=initial_conditions,
+        simulation_years=10,
+        cache=cache)
+    all_results.extend(sweep.values.reshape(-1, steps, steps))
 
     # Find global min and max for consistent color scale
     vmin = min(np.min(r) for r in all_results)
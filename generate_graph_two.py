@@ -1,11 +1,14 @@
 import final_project_model
+import sweep_service
 
 import pprint as pp
 import numpy as np
-import seaborn as sb
-import matplotlib.pyplot as plt
 
 if __name__ == "__main__":
+    # plotting imports stay out of module scope so spawned sweep workers skip them
+    import seaborn as sb
+    import matplotlib.pyplot as plt
+
     restock = 1/3
     initial_conditions = {
         'C_1': restock,
@@ -32,37 +35,22 @@ if __name__ == "__main__":
     print("info: graphing (2)")
     B_step = .1
     # STA data
-    A = [
-            [.3, .3, .25, .15],
-            [.3, .3, .25, .15],
-            [.3, .3, .25, .15],
-            [.3, .3, .25, .15]
-        ]
+    A = final_project_model.sta_A().tolist()
 
     start, stop, steps = 0, 1, 50
     betas = np.linspace(start, stop, steps)
     beta_rets = np.linspace(start, stop, steps)
 
-    results = np.zeros((steps, steps))
-    for i, beta in enumerate(betas):
-        for j, beta_ret in enumerate(beta_rets):
-            B = [[round(beta + B_step*(j - i), 3)
-                  for j in range(4)] for i in range(4)]
-            parameters = {
-                'p_SC': beta,
-                'p_CS': beta_ret,
-                'p_SD': beta,
-                'p_DS': beta_ret,
-                'A': A,
-                'B': B,
-            }
-
-            model = final_project_model.DiscreteReligiousBeliefModel(
-                parameters, initial_conditions, simulation_years=10)
-            model.run_simulation()
-
-            C_percent = np.sum(model.results[-1][:, final_project_model.C_IDX])/4
-            results[i][j] = C_percent
+    sweep = sweep_service.run_sweep(
+        [('beta', betas), ('beta_ret', beta_rets)],
+        params={'A': A, 'B_step': B_step},
+        initial_conds=initial_conditions,
+        simulation_years=10,
+        store='sweeps/graph_two')
+    # rerunning with more steps reuses the points the earlier grid shares, and
+    # with a sweep service running (python sweep_service.py) so do other jobs
+    print(f"info: {sweep.reused} simulations reused, {sweep.computed} computed")
+    results = sweep.values
 
     results = np.flipud(results)
 
@@ -0,0 +1,285 @@
+import time
+import numpy as np
+import scipy.stats.qmc
+
+import final_project_model
+
+# parameters a problem can vary; the incoming distribution is (u, (1 - u)(1 - v), (1 - u)v)
+# as in calibration.py, and A has homophily on the diagonal and rows summing to 1
+PARAMETER_NAMES = ('p_SC', 'p_CS', 'p_SD', 'p_DS', 'B_step', 'homophily', 'incoming_u', 'incoming_v')
+DEFAULT_BOUNDS = {
+    'p_SC': (0, 1),
+    'p_CS': (0, 1),
+    'p_SD': (0, 1),
+    'p_DS': (0, 1),
+    'B_step': (-.1, .1),
+    'homophily': (0, 1),
+    'incoming_u': (0, 1),
+    'incoming_v': (0, 1),
+}
+# values of the parameters a problem leaves out of bounds, the graph four setting with uniform mixing
+DEFAULT_FIXED = {
+    'p_SC': .4,
+    'p_CS': .2,
+    'p_SD': .4,
+    'p_DS': .2,
+    'B_step': .1,
+    'homophily': .25,
+    'incoming_u': 1 / 3,
+    'incoming_v': .5,
+}
+
+
+class SensitivityProblem:
+    def __init__(self, bounds=None, fixed=None, initial_conds=None, simulation_years=10,
+                 reducer=final_project_model.mean_C, num_age_groups=4, kernel='inplace', chunk_size=20000):
+        """
+        The model as a function of the parameters in bounds, {name: (low,
+        high)} over PARAMETER_NAMES (default DEFAULT_BOUNDS), with the rest
+        held at fixed (default DEFAULT_FIXED). Each point is simulated for
+        simulation_years from initial_conds and reduced to one number by
+        reducer, a function of the (N, K, 3) final states. B is
+        p_SC + B_step * (j - i), the elder-efficacy form without rounding.
+        """
+        bounds = DEFAULT_BOUNDS if bounds is None else bounds
+        unknown = [name for name in list(bounds) + list(fixed or {}) if name not in PARAMETER_NAMES]
+        if unknown:
+            raise ValueError(f'unknown parameters {unknown}, expected some of {PARAMETER_NAMES}')
+        self.names = tuple(bounds)
+        self.lower = np.array([bounds[name][0] for name in self.names], dtype=float)
+        self.upper = np.array([bounds[name][1] for name in self.names], dtype=float)
+        if np.any(self.upper <= self.lower):
+            raise ValueError('every upper bound has to be above its lower bound')
+        self.fixed = dict(DEFAULT_FIXED, **(fixed or {}))
+
+        self.num_age_groups = num_age_groups
+        self.initial_state = final_project_model.initial_state_from_conds(initial_conds or {}, num_age_groups)
+        self.simulation_years = simulation_years
+        self.reducer = reducer
+        self.kernel = kernel
+        self.chunk_size = chunk_size
+
+    def scale(self, unit):
+        # points of the unit hypercube to parameter values
+        return self.lower + (self.upper - self.lower) * unit
+
+    def batch_inputs(self, theta):
+        # run_batch's arguments for rows of parameter values, one column per name
+        values = dict(self.fixed, **dict(zip(self.names, np.asarray(theta, dtype=float).T)))
+        n = len(theta)
+        p_SC, B_step, u, v = (np.broadcast_to(values[name], (n,))
+                              for name in ('p_SC', 'B_step', 'incoming_u', 'incoming_v'))
+        params = final_project_model.ModelParams(
+            p_CS=values['p_CS'], p_SC=p_SC, p_DS=values['p_DS'], p_SD=values['p_SD'],
+            A=final_project_model.mixing_A(values['homophily'], num_age_groups=self.num_age_groups),
+            B=final_project_model.elder_efficacy_B(p_SC, B_step, self.num_age_groups, decimals=None),
+            incoming=np.stack([u, (1 - u) * (1 - v), (1 - u) * v], axis=-1))
+        return dict(params.batch_inputs(),
+                    initial_states=np.broadcast_to(self.initial_state, (n,) + self.initial_state.shape))
+
+    def evaluate(self, unit):
+        """
+        Run the model at points of the unit hypercube, shape (N, len(names)),
+        in batches of chunk_size.
+
+        Returns:
+        - The reduced outputs, shape (N,)
+        """
+        theta = self.scale(np.atleast_2d(unit))
+        outputs = np.empty(len(theta))
+        for start in range(0, len(theta), self.chunk_size):
+            stop = min(start + self.chunk_size, len(theta))
+            final = final_project_model.run_batch(
+                simulation_years=self.simulation_years, output='final', kernel=self.kernel,
+                **self.batch_inputs(theta[start:stop]))
+            outputs[start:stop] = self.reducer(final)
+        return outputs
+
+
+class SobolResult:
+    def __init__(self, names, first, total, first_ci, total_ci, variance, evaluations):
+        self.names = names
+        self.first = first
+        self.total = total
+        self.first_ci = first_ci
+        self.total_ci = total_ci
+        self.variance = variance
+        self.evaluations = evaluations
+
+    def __repr__(self):
+        return f'SobolResult(names={self.names}, evaluations={self.evaluations})'
+
+
+class MorrisResult:
+    def __init__(self, names, mu, mu_star, sigma, mu_star_ci, evaluations):
+        self.names = names
+        self.mu = mu
+        self.mu_star = mu_star
+        self.sigma = sigma
+        self.mu_star_ci = mu_star_ci
+        self.evaluations = evaluations
+
+    def __repr__(self):
+        return f'MorrisResult(names={self.names}, evaluations={self.evaluations})'
+
+
+def saltelli_design(n, num_params, seed=0):
+    """
+    Saltelli's sampling scheme for Sobol indices from a scrambled Sobol
+    sequence of dimension 2 * num_params: the base matrices A and B, then
+    for each parameter i the matrix AB_i, A with column i taken from B. n
+    should be a power of two to keep the sequence balanced.
+
+    Returns:
+    - The design, shape (n * (num_params + 2), num_params), in the unit hypercube
+    """
+    base = scipy.stats.qmc.Sobol(2 * num_params, scramble=True, seed=seed).random(n)
+    A, B = base[:, :num_params], base[:, num_params:]
+    AB = np.repeat(A[np.newaxis], num_params, axis=0)
+    columns = np.arange(num_params)
+    AB[columns, :, columns] = B.T
+    return np.concatenate([A, B, AB.reshape(-1, num_params)])
+
+
+def _sobol_estimates(f_A, f_B, f_AB):
+    # Saltelli (2010) first order and Jansen total order estimators, over the last axis
+    variance = np.var(np.concatenate([f_A, f_B], axis=-1), axis=-1)
+    first = np.mean(f_B[..., np.newaxis, :] * (f_AB - f_A[..., np.newaxis, :]), axis=-1)
+    total = .5 * np.mean((f_A[..., np.newaxis, :] - f_AB) ** 2, axis=-1)
+    return first / variance[..., np.newaxis], total / variance[..., np.newaxis], variance
+
+
+def sobol_indices(outputs, num_params, n_bootstrap=1000, confidence=.95, seed=0):
+    """
+    First and total order Sobol indices from the model outputs on a
+    saltelli_design, with percentile bootstrap confidence intervals from
+    resampling the rows of the base matrices.
+
+    Returns:
+    - first order indices, total order indices, shape (num_params,)
+    - their confidence intervals, shape (num_params, 2)
+    - the output variance
+    """
+    outputs = np.asarray(outputs, dtype=float)
+    n = len(outputs) // (num_params + 2)
+    f_A, f_B = outputs[:n], outputs[n:2 * n]
+    f_AB = outputs[2 * n:].reshape(num_params, n)
+    first, total, variance = _sobol_estimates(f_A, f_B, f_AB)
+
+    rng = np.random.default_rng(seed)
+    resampled_first, resampled_total = np.empty((n_bootstrap, num_params)), np.empty((n_bootstrap, num_params))
+    # a block of resamples at a time keeps the (block, num_params, n) gather small
+    block = max(1, 2 ** 22 // (n * (num_params + 2)))
+    for start in range(0, n_bootstrap, block):
+        rows = rng.integers(0, n, (min(block, n_bootstrap - start), n))
+        resampled = _sobol_estimates(f_A[rows], f_B[rows], np.moveaxis(f_AB[:, rows], 0, 1))
+        resampled_first[start:start + len(rows)], resampled_total[start:start + len(rows)] = resampled[:2]
+
+    tails = 100 * np.array([(1 - confidence) / 2, (1 + confidence) / 2])
+    return (first, total, np.percentile(resampled_first, tails, axis=0).T,
+            np.percentile(resampled_total, tails, axis=0).T, variance)
+
+
+def morris_design(trajectories, num_params, levels=4, seed=0):
+    """
+    Morris one-at-a-time trajectories on a levels-level grid of the unit
+    hypercube: each starts at a random grid point and moves every
+    parameter once, in random order and direction, by
+    levels / (2 (levels - 1)).
+
+    Returns:
+    - The design, shape (trajectories * (num_params + 1), num_params)
+    """
+    if levels % 2:
+        raise ValueError(f'levels has to be even, not {levels}')
+    rng = np.random.default_rng(seed)
+    delta = levels / (2 * (levels - 1))
+    signs = rng.choice([-1., 1.], (trajectories, num_params))
+    start = rng.integers(0, levels // 2, (trajectories, num_params)) / (levels - 1) + (signs < 0) * delta
+    order = rng.permuted(np.tile(np.arange(num_params), (trajectories, 1)), axis=1)
+
+    steps = np.zeros((trajectories, num_params + 1, num_params))
+    rows = np.arange(trajectories)[:, np.newaxis]
+    steps[rows, np.arange(1, num_params + 1), order] = np.take_along_axis(signs, order, axis=1) * delta
+    return (start[:, np.newaxis] + np.cumsum(steps, axis=1)).reshape(-1, num_params)
+
+
+def morris_indices(design, outputs, num_params, n_bootstrap=1000, confidence=.95, seed=0):
+    """
+    Elementary effect statistics from the model outputs on a morris_design,
+    in output units per unit of the hypercube, i.e. per full parameter
+    range, with a percentile bootstrap interval for mu_star from
+    resampling trajectories.
+
+    Returns:
+    - mu, mu_star (mean absolute effect) and sigma, shape (num_params,)
+    - the confidence interval of mu_star, shape (num_params, 2)
+    """
+    points = np.asarray(design).reshape(-1, num_params + 1, num_params)
+    outputs = np.asarray(outputs, dtype=float).reshape(-1, num_params + 1)
+    moves = np.diff(points, axis=1)
+    moved = np.argmax(np.abs(moves), axis=2)
+    step = np.take_along_axis(moves, moved[..., np.newaxis], axis=2)[..., 0]
+
+    # effects[t, i] is trajectory t's elementary effect of parameter i
+    effects = np.empty((len(points), num_params))
+    np.put_along_axis(effects, moved, np.diff(outputs, axis=1) / step, axis=1)
+
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(0, len(effects), (n_bootstrap, len(effects)))
+    resampled = np.mean(np.abs(effects)[rows], axis=1)
+    tails = 100 * np.array([(1 - confidence) / 2, (1 + confidence) / 2])
+    return (np.mean(effects, axis=0), np.mean(np.abs(effects), axis=0), np.std(effects, axis=0, ddof=1),
+            np.percentile(resampled, tails, axis=0).T)
+
+
+def sobol_analysis(problem, n=8192, n_bootstrap=1000, confidence=.95, seed=0):
+    """
+    Variance-based global sensitivity of a SensitivityProblem, from
+    n * (len(problem.names) + 2) model runs on a saltelli_design.
+
+    Returns:
+    - A SobolResult
+    """
+    num_params = len(problem.names)
+    outputs = problem.evaluate(saltelli_design(n, num_params, seed))
+    first, total, first_ci, total_ci, variance = sobol_indices(outputs, num_params, n_bootstrap, confidence, seed)
+    return SobolResult(problem.names, first, total, first_ci, total_ci, variance, len(outputs))
+
+
+def morris_analysis(problem, trajectories=200, levels=4, n_bootstrap=1000, confidence=.95, seed=0):
+    """
+    Elementary effects screening of a SensitivityProblem, from
+    trajectories * (len(problem.names) + 1) model runs.
+
+    Returns:
+    - A MorrisResult
+    """
+    num_params = len(problem.names)
+    design = morris_design(trajectories, num_params, levels, seed)
+    outputs = problem.evaluate(design)
+    mu, mu_star, sigma, mu_star_ci = morris_indices(design, outputs, num_params, n_bootstrap, confidence, seed)
+    return MorrisResult(problem.names, mu, mu_star, sigma, mu_star_ci, len(outputs))
+
+
+if __name__ == "__main__":
+    problem = SensitivityProblem()
+
+    print("info: Morris screening of final mean C over", ', '.join(problem.names))
+    start = time.perf_counter()
+    morris = morris_analysis(problem)
+    print(f"{morris.evaluations} model runs in {time.perf_counter() - start:.2f} s")
+    for name, mu, mu_star, sigma, (low, high) in zip(morris.names, morris.mu, morris.mu_star, morris.sigma,
+                                                    morris.mu_star_ci):
+        print(f"{name:>12}: mu {mu:+.3f}  mu* {mu_star:.3f} [{low:.3f}, {high:.3f}]  sigma {sigma:.3f}")
+
+    print("info: Sobol indices of final mean C")
+    start = time.perf_counter()
+    sobol = sobol_analysis(problem)
+    print(f"{sobol.evaluations} model runs in {time.perf_counter() - start:.2f} s, "
+          f"output variance {sobol.variance:.4f}")
+    for name, first, total, first_ci, total_ci in zip(sobol.names, sobol.first, sobol.total, sobol.first_ci,
+                                                      sobol.total_ci):
+        print(f"{name:>12}: S1 {first:+.3f} [{first_ci[0]:+.3f}, {first_ci[1]:+.3f}]  "
+              f"ST {total:.3f} [{total_ci[0]:.3f}, {total_ci[1]:.3f}]")
+    print(f"sum of first order indices {np.sum(sobol.first):.3f}, the rest is interactions")
@@ -0,0 +1,140 @@
+import time
+import numpy as np
+import scipy.sparse
+
+import final_project_model
+from final_project_model import C_IDX, S_IDX
+
+
+class MetapopulationModel:
+    def __init__(self, params, initial_states, incoming, influence=None, transfer=None, simulation_years=4):
+        """
+        A university system of P campuses, each with its own K cohorts and
+        A/B matrices, stepped together as one vectorized system.
+
+        params holds p_CS, p_SC, p_DS, p_SD as scalars or (P,) arrays and A,
+        B as (K, K) or (P, K, K) arrays. initial_states is (P, K, 3) and
+        incoming is (3,) or (P, 3).
+
+        Campuses are coupled through two optional sparse (P, P) matrices:
+        - influence[p, q]: rate at which campus q's mean C recruits the
+          searching students of campus p, added to S_to_C
+        - transfer[p, q]: fraction of each of campus q's cohorts moving to
+          campus p each year, applied after aging
+
+        Only the nonzero couplings are stored, so memory grows with their
+        number rather than with P squared.
+        """
+        initial_states = np.array(initial_states, dtype=float)
+        self.num_campuses, self.num_age_groups, _ = initial_states.shape
+        self.state = initial_states / np.sum(initial_states, axis=-1, keepdims=True)
+        self.simulation_years = simulation_years
+
+        K = self.num_age_groups
+        p_SC = np.asarray(params.get('p_SC', 0.05), dtype=float)
+        A = params.get('A', np.full((K, K), 1 / K))
+        B = params['B'] if 'B' in params else p_SC[..., np.newaxis, np.newaxis] * np.ones((K, K))
+        self.rates = final_project_model._batch_rates(
+            self.num_campuses, K, params.get('p_CS', 0.05), p_SC,
+            params.get('p_DS', 0.05), params.get('p_SD', 0.05), A, B, incoming)
+
+        shape = (self.num_campuses, self.num_campuses)
+        self.influence = None if influence is None else scipy.sparse.csr_array(influence)
+        self.transfer = None if transfer is None else scipy.sparse.csr_array(transfer)
+        for name, matrix in [('influence', self.influence), ('transfer', self.transfer)]:
+            if matrix is not None and matrix.shape != shape:
+                raise ValueError(f'{name} must have shape {shape}, not {matrix.shape}')
+
+        if self.transfer is not None:
+            # students leaving each campus, and the size each campus ends up at
+            self.transfer_out = np.asarray(self.transfer.sum(axis=0)).ravel()
+            self.transfer_weight = 1 - self.transfer_out + np.asarray(self.transfer.sum(axis=1)).ravel()
+
+        self.results = None
+
+    def step(self, state):
+        aged = final_project_model._age_batch(state, self.rates[-1])
+        flat = aged.reshape(self.num_campuses, -1)
+
+        if self.transfer is not None:
+            # mix cohorts between campuses, weighting by the students each one holds
+            mixed = flat * (1 - self.transfer_out)[:, np.newaxis] + self.transfer @ flat
+            flat = mixed / self.transfer_weight[:, np.newaxis]
+            aged = flat.reshape(aged.shape)
+
+        if self.influence is not None:
+            campus_C = np.mean(aged[:, :, C_IDX], axis=1)
+            external_S_to_C = aged[:, :, S_IDX] * (self.influence @ campus_C)[:, np.newaxis]
+
+        new_state = final_project_model._transition_batch(aged, self.rates)
+        if self.influence is not None:
+            new_state[:, :, C_IDX] += external_S_to_C
+            new_state[:, :, S_IDX] -= external_S_to_C
+
+        # no negatives from floating point
+        new_state = np.maximum(new_state, 0)
+
+        # normalize in a single operation
+        row_sums = np.sum(new_state, axis=-1, keepdims=True)
+        return new_state / row_sums
+
+    def run_simulation(self, output='full'):
+        """
+        Advance every campus simulation_years years. output is 'full' or
+        'final' as for DiscreteReligiousBeliefModel.run_simulation.
+
+        Returns:
+        - The (years + 1, P, K, 3) trajectories, or the (P, K, 3) final state
+        """
+        if output not in ('full', 'final'):
+            raise ValueError(f"output must be 'full' or 'final', not {output!r}")
+
+        if output == 'full':
+            self.results = np.empty((self.simulation_years + 1,) + self.state.shape)
+            self.results[0] = self.state
+        for year in range(1, self.simulation_years + 1):
+            self.state = self.step(self.state)
+            if output == 'full':
+                self.results[year] = self.state
+
+        return self.results if output == 'full' else self.state
+
+
+def ring_coupling(num_campuses, strength, neighbours=1):
+    # each campus coupled to its nearest neighbours on a ring
+    offsets = [k for k in range(-neighbours, neighbours + 1) if k != 0]
+    rows = np.repeat(np.arange(num_campuses), len(offsets))
+    cols = (rows + np.tile(offsets, num_campuses)) % num_campuses
+    values = np.full(rows.size, strength / len(offsets))
+    return scipy.sparse.csr_array((values, (rows, cols)), shape=(num_campuses, num_campuses))
+
+
+if __name__ == "__main__":
+    print("info: metapopulation demo")
+    num_campuses = 5000
+    rng = np.random.default_rng(0)
+
+    beta = rng.uniform(.2, .6, num_campuses)
+    parameters = {
+        'p_SC': beta,
+        'p_CS': .2,
+        'p_SD': beta,
+        'p_DS': .2,
+        'A': final_project_model.sta_A(),
+        'B': final_project_model.elder_efficacy_B(beta, .1),
+    }
+    initial_states = rng.dirichlet([2, 3, 2], size=(num_campuses, 4))
+
+    model = MetapopulationModel(
+        parameters, initial_states, incoming=[.3, .4, .3],
+        influence=ring_coupling(num_campuses, .05, neighbours=2),
+        transfer=ring_coupling(num_campuses, .02),
+        simulation_years=10)
+
+    start = time.perf_counter()
+    final_state = model.run_simulation(output='final')
+    elapsed = time.perf_counter() - start
+
+    print(f"{num_campuses} campuses, {model.influence.nnz + model.transfer.nnz} couplings, {elapsed:.3f} s")
+    print("system-wide C percent:")
+    print(np.mean(final_state[:, :, C_IDX]))
@@ -0,0 +1,80 @@
+import time
+import numpy as np
+
+import final_project_model
+
+# about three significant digits of a final C share in [0, 1]
+DEFAULT_TOLERANCE = 5e-4
+
+
+def validate_precision(axes, params=None, initial_conds=None, simulation_years=10, reducer=final_project_model.mean_C,
+                       dtype=np.float32, sample=2000, seed=0, tolerance=DEFAULT_TOLERANCE):
+    """
+    Run a random sample of the grid points of a sweep (arguments as for
+    run_sweep) in float64 and in dtype, and compare the reduced values.
+
+    Returns:
+    - A dict with the number of points compared, the max and mean absolute
+      deviation, the coordinates of the worst point, the bytes per value in
+      each precision and whether the max deviation is within tolerance
+    """
+    if isinstance(axes, dict):
+        axes = list(axes.items())
+    plan = final_project_model.SweepPlan(axes, params or {}, initial_conds or {}, simulation_years, reducer)
+    rng = np.random.default_rng(seed)
+    flat = np.sort(rng.choice(plan.size, size=min(sample, plan.size), replace=False))
+    inputs = plan.inputs_at(flat)
+
+    values = {}
+    for precision in (np.float64, dtype):
+        final = final_project_model.run_batch(simulation_years=simulation_years, output='final', dtype=precision,
+                                              **inputs)
+        values[np.dtype(precision).name] = reducer(final)
+    reference, reduced = values['float64'], values[np.dtype(dtype).name]
+
+    deviation = np.abs(reduced.astype(np.float64) - reference).reshape(len(flat), -1).max(axis=1)
+    worst = int(np.argmax(deviation))
+    index = np.unravel_index(flat[worst], plan.shape) if plan.shape else ()
+    return {
+        'points': len(flat),
+        'max_abs_deviation': float(deviation[worst]),
+        'mean_abs_deviation': float(np.mean(deviation)),
+        'worst_point': {name: coords[i].item() if isinstance(coords[i], np.generic) else coords[i]
+                        for name, coords, i in zip(plan.names, plan.coords, index)},
+        'bytes_per_value': {name: v.dtype.itemsize for name, v in values.items()},
+        'tolerance': tolerance,
+        'passed': bool(deviation[worst] <= tolerance),
+    }
+
+
+if __name__ == "__main__":
+    STA = final_project_model.sta_A()
+    HOMOPHILY = final_project_model.homophily_A()
+    HETEROPHILY = final_project_model.heterophily_A()
+    betas = np.linspace(0, 1, 50)
+    restocks = np.linspace(0, .5, 100)
+    sweeps = {
+        'graph two': ([('beta', betas), ('beta_ret', betas)], {'A': STA, 'B_step': .1}),
+        'graph three': ([('B_step', [0, .1]), ('A', [HOMOPHILY, HETEROPHILY, STA]), ('beta', betas),
+                         ('beta_ret', betas)], {}),
+        'restock grid': ([('C_restock', restocks), ('D_restock', restocks)],
+                         {'p_SC': .4, 'p_CS': .2, 'p_SD': .4, 'p_DS': .2, 'A': STA, 'B_step': .1}),
+    }
+
+    print("info: comparing float32 with float64 on samples of the figure sweeps")
+    for name, (axes, params) in sweeps.items():
+        for years in (10, 100):
+            report = validate_precision(axes, params, simulation_years=years)
+            print(f"{name:>12}, {years:>3} years: max |dev| {report['max_abs_deviation']:.2e}, "
+                  f"mean {report['mean_abs_deviation']:.2e} over {report['points']} points, "
+                  f"{'ok' if report['passed'] else 'FAILED'} (worst at {report['worst_point']})")
+
+    print("info: full trajectories of a 200 x 200 beta grid in each precision")
+    betas = np.linspace(0, 1, 200)
+    for dtype in (np.float64, np.float32):
+        start = time.perf_counter()
+        sweep = final_project_model.run_sweep(
+            [('beta', betas), ('beta_ret', betas)], params={'A': STA, 'B_step': .1},
+            simulation_years=10, reducer=None, backend='serial', dtype=dtype)
+        print(f"{np.dtype(dtype).name}: {sweep.values.nbytes / 1e6:.0f} MB of results in "
+              f"{time.perf_counter() - start:.2f} s")
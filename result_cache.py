@@ -0,0 +1,134 @@
+import os
+import hashlib
+import numpy as np
+
+
+def _feed(digest, value):
+    # canonical byte encoding so equal inputs hash equally whatever their container
+    if isinstance(value, dict):
+        digest.update(b'dict')
+        for key in sorted(value):
+            _feed(digest, str(key))
+            _feed(digest, value[key])
+    elif isinstance(value, str):
+        digest.update(b'str' + value.encode() + b'\0')
+    elif value is None:
+        digest.update(b'none')
+    else:
+        array = np.ascontiguousarray(value, dtype=float)
+        digest.update(f'array{array.shape}'.encode())
+        digest.update(array.tobytes())
+
+
+def simulation_key(*parts):
+    """
+    Hash params, initial conditions, simulation_years, model version and any
+    other inputs into a content address. Dicts are hashed by sorted key and
+    numbers by their float64 bytes, so 0.4 and np.float64(0.4) collide.
+
+    Returns:
+    - A hex sha256 digest
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        _feed(digest, part)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    def __init__(self, directory=None, max_bytes=512 * 1024 ** 2):
+        if directory is None:
+            directory = os.environ.get('SIM_CACHE_DIR', '.sim_cache')
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+
+        # path -> [last use, size], scanned once so puts don't rewalk the directory
+        self._index = {}
+        for root, _, files in os.walk(directory):
+            for name in files:
+                if name.endswith('.npz'):
+                    path = os.path.join(root, name)
+                    stat = os.stat(path)
+                    self._index[path] = [stat.st_mtime, stat.st_size]
+        self._bytes = sum(size for _, size in self._index.values())
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f'{key}.npz')
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with np.load(path) as entry:
+                results = entry['results']
+        except (FileNotFoundError, OSError, ValueError, KeyError):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        # bump mtime so eviction is least recently used, also across processes
+        try:
+            os.utime(path)
+            stat = os.stat(path)
+        except OSError:
+            # another process evicted it after the load, the results in hand are still good
+            if path in self._index:
+                self._bytes -= self._index.pop(path)[1]
+            return results
+        if path not in self._index:
+            self._bytes += stat.st_size
+            self._index[path] = [0, stat.st_size]
+        self._index[path][0] = stat.st_mtime
+        return results
+
+    def put(self, key, results):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # write then rename so concurrent readers never see a partial entry
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez_compressed(f, results=results)
+        os.replace(tmp_path, path)
+
+        if path in self._index:
+            self._bytes -= self._index[path][1]
+        stat = os.stat(path)
+        self._index[path] = [stat.st_mtime, stat.st_size]
+        self._bytes += stat.st_size
+        self.evict()
+
+    def evict(self):
+        if self._bytes <= self.max_bytes:
+            return
+        for path, (_, size) in sorted(self._index.items(), key=lambda item: item[1][0]):
+            if self._bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            del self._index[path]
+            self._bytes -= size
+            self.evictions += 1
+
+    def clear(self):
+        for path in list(self._index):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self._index.clear()
+        self._bytes = 0
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self._index),
+            'bytes': self._bytes,
+        }
@@ -0,0 +1,234 @@
+import os
+import json
+import shutil
+import numpy as np
+
+from final_project_model import SweepResult
+
+VALUES_FILE = 'values.npy'
+INDEX_FILE = 'index.json'
+WRITTEN_FILE = 'written.txt'
+PREVIOUS_SUFFIX = '.previous'
+
+# grid coordinates closer than this are the same point, since linspace grids of
+# different densities can disagree in the last bit on shared points
+COORD_TOLERANCE = 1e-12
+
+
+def _json_coords(coords):
+    # numpy scalars become plain floats and ints, labels stay as they are
+    return [c.item() if isinstance(c, np.generic) else c for c in coords]
+
+
+class ResultsStore(SweepResult):
+    def __init__(self, directory, mode='r'):
+        """
+        Open a sweep stored on disk: values.npy, a plain .npy file holding
+        the (*axes, *value_shape) array, index.json with the axis names and
+        coordinates, value shape, dtype and run metadata, and written.txt
+        listing the flat [start, stop) ranges written so far.
+
+        values is an np.memmap, so slices and sel() read only the pages
+        they touch. mode is np.load's mmap_mode, 'r' or 'r+'.
+        """
+        self.directory = directory
+        with open(os.path.join(directory, INDEX_FILE)) as f:
+            self.index = json.load(f)
+        self.metadata = self.index['metadata']
+        values = np.load(os.path.join(directory, VALUES_FILE), mmap_mode=mode)
+        super().__init__(values, [(name, coords) for name, coords in self.index['axes']])
+
+    @classmethod
+    def create(cls, directory, axes, value_shape, dtype=np.float64, metadata=None):
+        """
+        Create an empty store for a grid over axes, a list of (name,
+        coordinates), with value_shape values per grid point. The values file
+        is allocated sparse, so disk space is only used as chunks are written.
+
+        Returns:
+        - The store, opened 'r+'
+        """
+        os.makedirs(directory, exist_ok=True)
+        shape = tuple(len(coords) for _, coords in axes) + tuple(value_shape)
+        values = np.lib.format.open_memmap(os.path.join(directory, VALUES_FILE), mode='w+',
+                                           dtype=dtype, shape=shape)
+        del values
+
+        index = {
+            'axes': [[name, _json_coords(coords)] for name, coords in axes],
+            'value_shape': list(value_shape),
+            'dtype': np.dtype(dtype).str,
+            'complete': False,
+            'metadata': metadata or {},
+        }
+        _write_json(os.path.join(directory, INDEX_FILE), index)
+        open(os.path.join(directory, WRITTEN_FILE), 'w').close()
+        return cls(directory, mode='r+')
+
+    @property
+    def size(self):
+        return int(np.prod(self.values.shape[:len(self.axes)]))
+
+    def write(self, start, stop, chunk):
+        # values for flat grid points [start, stop), written with plain file
+        # writes so dirty pages are not counted against this process' memory
+        chunk = np.ascontiguousarray(chunk, dtype=self.values.dtype)
+        if chunk.shape != (stop - start,) + self.values.shape[len(self.axes):]:
+            raise ValueError(f'chunk of shape {chunk.shape} does not fit points {start}:{stop}')
+        row_bytes = chunk.itemsize * int(np.prod(chunk.shape[1:]))
+        with open(os.path.join(self.directory, VALUES_FILE), 'r+b') as f:
+            f.seek(self.values.offset + start * row_bytes)
+            f.write(memoryview(chunk).cast('B'))
+        with open(os.path.join(self.directory, WRITTEN_FILE), 'a') as f:
+            f.write(f'{start} {stop}\n')
+
+    def written(self):
+        """
+        Returns:
+        - The [start, stop) flat ranges written so far, in writing order
+        """
+        ranges = []
+        with open(os.path.join(self.directory, WRITTEN_FILE)) as f:
+            for line in f:
+                # a line cut short by a crash is a chunk that has to be rerun
+                parts = line.split()
+                if line.endswith('\n') and len(parts) == 2:
+                    ranges.append((int(parts[0]), int(parts[1])))
+        return ranges
+
+    def written_mask(self):
+        mask = np.zeros(self.size, dtype=bool)
+        for start, stop in self.written():
+            mask[start:stop] = True
+        return mask
+
+    def mark_complete(self):
+        self.index['complete'] = True
+        _write_json(os.path.join(self.directory, INDEX_FILE), self.index)
+
+    @property
+    def complete(self):
+        return self.index['complete']
+
+    def flat(self):
+        # (grid points, *value_shape) view of the values, for reading chunks back by flat range
+        return self.values.reshape((self.size,) + self.values.shape[len(self.axes):])
+
+
+def _exists(directory):
+    return os.path.exists(os.path.join(directory, INDEX_FILE))
+
+
+def _axis_map(old_values, new_values):
+    # for each new coordinate, the index of the matching old one or -1
+    old = np.asarray(old_values, dtype=float).reshape(len(old_values), -1)
+    new = np.asarray(new_values, dtype=float).reshape(len(new_values), -1)
+    if not len(old) or not len(new) or old.shape[1] != new.shape[1]:
+        return np.full(len(new), -1)
+    if old.shape[1] == 1:
+        order = np.argsort(old[:, 0])
+        sorted_old = old[order, 0]
+        right = np.clip(np.searchsorted(sorted_old, new[:, 0]), 1, len(old) - 1) if len(old) > 1 \
+            else np.zeros(len(new), dtype=int)
+        left = np.maximum(right - 1, 0)
+        nearest = np.where(np.abs(sorted_old[left] - new[:, 0]) <= np.abs(sorted_old[right] - new[:, 0]), left, right)
+        match = order[nearest]
+    else:
+        distance = np.max(np.abs(new[:, np.newaxis] - old[np.newaxis]), axis=-1)
+        match = np.argmin(distance, axis=1)
+    close = np.max(np.abs(old[match] - new), axis=-1) <= COORD_TOLERANCE * np.maximum(1, np.max(np.abs(new), axis=-1))
+    return np.where(close, match, -1)
+
+
+def _axis_values(values):
+    return [np.asarray(v, dtype=float).tolist() for v in values]
+
+
+def open_sweep(directory, axes, axis_values, value_shape, dtype, metadata):
+    """
+    Open the store for a sweep, creating, resuming or refining it.
+
+    metadata['fingerprint'] identifies everything but the grid. If directory
+    holds a store with the same fingerprint and grid, it is resumed. If the
+    grid differs, the old store is moved aside to directory + '.previous'
+    and a new one is created, with the old points whose coordinates match
+    new ones (to within COORD_TOLERANCE) to be copied in; finish_sweep
+    removes the old store once the new one is complete. A refinement that
+    was interrupted is picked up the same way, from both stores. A store
+    with a different fingerprint is never overwritten.
+
+    Returns:
+    - The store, opened 'r+'
+    - [(source store, per-axis maps from new to source indices, source's
+      written mask)] to reuse points from, the store itself first
+    """
+    previous_dir = directory + PREVIOUS_SUFFIX
+    metadata = dict(metadata, axis_values=_axis_values(axis_values))
+
+    store = None
+    if _exists(directory):
+        existing = ResultsStore(directory, mode='r+')
+        if existing.metadata.get('fingerprint') != metadata['fingerprint']:
+            raise ValueError(f'{directory} holds a different sweep, remove it or choose another directory')
+        same_grid = (existing.metadata.get('axis_values') == metadata['axis_values']
+                     and list(existing.values.shape[len(axes):]) == list(value_shape))
+        if same_grid:
+            store = existing
+        elif _exists(previous_dir):
+            # an unfinished refinement towards some other grid, restart it from the previous store
+            del existing
+            shutil.rmtree(directory)
+        else:
+            del existing
+            os.replace(directory, previous_dir)
+
+    if store is None:
+        store = ResultsStore.create(directory, axes, value_shape, dtype, metadata)
+
+    sources = [(store, [np.arange(len(v)) for v in axis_values], store.written_mask())]
+    if _exists(previous_dir):
+        previous = ResultsStore(previous_dir)
+        if previous.metadata.get('fingerprint') == metadata['fingerprint']:
+            maps = [_axis_map(old, new) for old, new in zip(previous.metadata['axis_values'], axis_values)]
+            sources.append((previous, maps, previous.written_mask()))
+    return store, sources
+
+
+def finish_sweep(directory):
+    # the previous grid's points have all been copied over by now
+    previous_dir = directory + PREVIOUS_SUFFIX
+    if _exists(previous_dir):
+        shutil.rmtree(previous_dir)
+
+
+def _write_json(path, value):
+    # write then rename, so a reader never sees a half written index
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(value, f, indent=2)
+    os.replace(tmp, path)
+
+
+if __name__ == "__main__":
+    import time
+    import resource
+    import argparse
+    import final_project_model
+
+    parser = argparse.ArgumentParser(description='Stream a large full-trajectory sweep to disk.')
+    parser.add_argument('directory')
+    parser.add_argument('--steps', type=int, default=1000, help='points per axis of a beta x beta_ret grid')
+    parser.add_argument('--backend', default='process')
+    args = parser.parse_args()
+
+    print(f"info: sweeping {args.steps ** 2} models with full trajectories into {args.directory}")
+    betas = np.linspace(0, 1, args.steps)
+    start = time.perf_counter()
+    store = final_project_model.run_sweep(
+        [('beta', betas), ('beta_ret', betas)], params={'A': final_project_model.sta_A(), 'B_step': .1},
+        simulation_years=10, reducer=None, backend=args.backend, store=args.directory)
+    elapsed = time.perf_counter() - start
+
+    print(f"{store.values.nbytes / 1e9:.2f} GB of trajectories in {elapsed:.1f} s, "
+          f"peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3:.0f} MB")
+    print("final C of the first cohort at beta 0.5:", store.sel(beta=betas[args.steps // 2])[:5, -1, 0, 0])
@@ -0,0 +1,225 @@
+import os
+import re
+import sys
+import time
+import argparse
+import subprocess
+import numpy as np
+
+import final_project_model
+import results_store
+import experiments
+
+SHARD_PATTERN = re.compile(r'^shard-(\d+)-of-(\d+)$')
+MERGED_DIR = 'merged'
+
+
+def shard_directory(directory, index, count):
+    return os.path.join(directory, f'shard-{index:04d}-of-{count:04d}')
+
+
+def sweep_arguments(spec, name):
+    """
+    Look up an experiment of a spec (see experiments.py) by name.
+
+    Returns:
+    - run_sweep's axes, params, initial_conds and simulation_years for it
+    """
+    defaults = spec.get('defaults', {})
+    matrices = spec.get('matrices', {})
+    for experiment_spec in spec['experiments']:
+        if experiment_spec['name'] == name:
+            plan = experiments.Experiment(experiment_spec, defaults, matrices).plan
+            break
+    else:
+        raise KeyError(f'no experiment named {name!r}')
+
+    axes = []
+    for axis_name, values, coords in zip(plan.names, plan.values, plan.coords):
+        axes.append((axis_name, dict(zip(coords, values)) if axis_name == 'A' else values))
+    return axes, plan.params, plan.initial_conds, plan.simulation_years
+
+
+def run_shard(spec, name, directory, index, count, reducer=final_project_model.mean_C, backend='process',
+              max_workers=None, chunk_size=2500):
+    """
+    Run one node's slice of the experiment name of spec into its own
+    store, directory/shard-<index>-of-<count>, where directory is shared by
+    every node. A shard that was interrupted picks up where it stopped.
+
+    Returns:
+    - The shard's store
+    """
+    axes, params, initial_conds, simulation_years = sweep_arguments(spec, name)
+    return final_project_model.run_sweep(
+        axes, params, initial_conds, simulation_years, reducer, backend=backend, max_workers=max_workers,
+        chunk_size=chunk_size, store=shard_directory(directory, index, count), shard=(index, count))
+
+
+def validate_shards(directory):
+    """
+    Check the shard stores under directory against each other: they have to
+    be slices of one sweep over one grid with one shard count, every index
+    has to be there exactly once and complete, and each has to have written
+    exactly the points of its own slice.
+
+    Returns:
+    - The shard stores by index
+    - A list of problems, empty if the shards add up to the full grid
+    """
+    problems = []
+    candidates = []
+    names = sorted(n for n in os.listdir(directory) if SHARD_PATTERN.match(n)) if os.path.isdir(directory) else []
+    for dir_name in names:
+        path = os.path.join(directory, dir_name)
+        if not results_store._exists(path):
+            problems.append(f'{dir_name} has no results store')
+            continue
+        store = results_store.ResultsStore(path)
+        if 'shard' not in store.metadata:
+            problems.append(f'{dir_name} is not a shard')
+            continue
+        key = {field: store.metadata.get(field) for field in ('sweep', 'axis_values', 'chunk_size')}
+        key.update(count=store.metadata['shard'][1], shape=list(store.values.shape), dtype=store.values.dtype.str)
+        candidates.append((dir_name, store, key))
+
+    # the sweep most shards agree on is the one being merged
+    keys = [key for _, _, key in candidates]
+    reference = max(keys, key=keys.count) if keys else None
+
+    stores = {}
+    for dir_name, store, key in candidates:
+        index, count = store.metadata['shard']
+        if key != reference:
+            differing = ', '.join(field for field in key if key[field] != reference[field])
+            problems.append(f'{dir_name} belongs to a different sweep ({differing} differ)')
+            continue
+        if index in stores:
+            problems.append(f'{dir_name} duplicates shard {index} '
+                            f'of {os.path.basename(stores[index].directory)}')
+            continue
+        if tuple(int(n) for n in SHARD_PATTERN.match(dir_name).groups()) != (index, count):
+            problems.append(f'{dir_name} holds shard {index} of {count}')
+        stores[index] = store
+
+    if reference is None:
+        return stores, problems + [f'no shards in {directory}']
+
+    count = reference['count']
+    missing = [index for index in range(count) if index not in stores]
+    if missing:
+        problems.append(f'missing shards {missing} of {count}')
+
+    size = int(np.prod([len(values) for values in reference['axis_values']]))
+    chunk_size = reference['chunk_size']
+    num_chunks = -(-size // chunk_size)
+    for index, store in sorted(stores.items()):
+        first, last = final_project_model.shard_chunks(num_chunks, index, count)
+        start, stop = first * chunk_size, min(last * chunk_size, size)
+        written = store.written_mask()
+        if np.any(written[:start]) or np.any(written[stop:]):
+            problems.append(f'shard {index} wrote points outside its slice [{start}, {stop})')
+        if not store.complete or not np.all(written[start:stop]):
+            problems.append(f'shard {index} is incomplete, {int(np.sum(~written[start:stop]))} '
+                            f'of {stop - start} points missing')
+    return stores, problems
+
+
+def merge_shards(directory, output=None):
+    """
+    Validate the shards under directory (see validate_shards) and copy them
+    chunk by chunk into one store over the full grid, output, by default
+    directory/merged. The merged store has the metadata of the unsharded
+    sweep, so run_sweep with store=output treats it as already complete.
+
+    Returns:
+    - The merged store
+    """
+    stores, problems = validate_shards(directory)
+    if problems:
+        raise ValueError(f'cannot merge {directory}:\n' + '\n'.join(problems))
+    if output is None:
+        output = os.path.join(directory, MERGED_DIR)
+
+    first = stores[0]
+    metadata = {key: value for key, value in first.metadata.items() if key not in ('shard', 'chunk_size')}
+    metadata['fingerprint'] = metadata['sweep']
+    merged = results_store.ResultsStore.create(
+        output, first.axes, first.values.shape[len(first.axes):], first.values.dtype, metadata)
+
+    chunk_size = first.metadata['chunk_size']
+    for store in stores.values():
+        flat = store.flat()
+        # each shard wrote whole chunks, so they copy over in the same ranges
+        for start, stop in store.written():
+            for chunk_start in range(start, stop, chunk_size):
+                chunk_stop = min(chunk_start + chunk_size, stop)
+                merged.write(chunk_start, chunk_stop, flat[chunk_start:chunk_stop])
+    merged.mark_complete()
+    return results_store.ResultsStore(output)
+
+
+def launch_local(spec_path, name, directory, count, backend='serial', chunk_size=2500, full=False):
+    """
+    Stand in for a cluster on one machine: start count processes, one per
+    shard, each running this script's run command as a node would, wait
+    for them and merge.
+
+    Returns:
+    - The merged store
+    """
+    commands = []
+    for index in range(count):
+        command = [sys.executable, os.path.abspath(__file__), 'run', spec_path, name, directory,
+                   '--shard', str(index), '--shards', str(count), '--backend', backend,
+                   '--chunk-size', str(chunk_size)]
+        if full:
+            command.append('--full')
+        commands.append(command)
+    processes = [subprocess.Popen(command) for command in commands]
+    failed = [index for index, process in enumerate(processes) if process.wait() != 0]
+    if failed:
+        raise RuntimeError(f'shards {failed} failed')
+    return merge_shards(directory)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run a sweep as shards on several nodes and merge them.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help="run one node's shard of an experiment")
+    local_parser = commands.add_parser('local', help='run every shard as a local process, then merge')
+    for sub in (run_parser, local_parser):
+        sub.add_argument('spec', help='experiment spec, as for experiments.py')
+        sub.add_argument('name', help='experiment to sweep')
+        sub.add_argument('directory', help='directory shared by the nodes')
+        sub.add_argument('--chunk-size', type=int, default=2500)
+        sub.add_argument('--full', action='store_true', help='store full trajectories instead of mean C')
+    run_parser.add_argument('--shard', type=int, required=True, help='index of this node, from 0')
+    run_parser.add_argument('--shards', type=int, required=True, help='number of nodes')
+    run_parser.add_argument('--backend', default='process', help="'serial', 'thread' or 'process' within the node")
+    local_parser.add_argument('--shards', type=int, default=4)
+    local_parser.add_argument('--backend', default='serial')
+
+    merge_parser = commands.add_parser('merge', help='validate the shards and assemble the full grid')
+    merge_parser.add_argument('directory')
+    merge_parser.add_argument('-o', '--output', help=f'merged store, by default directory/{MERGED_DIR}')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.command == 'run':
+        print(f"info: running shard {args.shard} of {args.shards} of {args.name}")
+        store = run_shard(experiments.load_spec(args.spec), args.name, args.directory, args.shard, args.shards,
+                          None if args.full else final_project_model.mean_C, args.backend,
+                          chunk_size=args.chunk_size)
+        print(f"shard {args.shard}: {store.computed} simulations run, {store.reused} reused "
+              f"in {time.perf_counter() - start:.1f} s")
+    elif args.command == 'local':
+        print(f"info: running {args.name} as {args.shards} local shards")
+        merged = launch_local(args.spec, args.name, args.directory, args.shards, args.backend,
+                              args.chunk_size, args.full)
+        print(f"merged {merged.size} points into {merged.directory} in {time.perf_counter() - start:.1f} s")
+    else:
+        print(f"info: merging shards in {args.directory}")
+        merged = merge_shards(args.directory, args.output)
+        print(f"merged {merged.size} points into {merged.directory} in {time.perf_counter() - start:.1f} s")
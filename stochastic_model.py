@@ -0,0 +1,123 @@
+import time
+import numpy as np
+
+import final_project_model
+from final_project_model import DiscreteReligiousBeliefModel, C_IDX, S_IDX, D_IDX
+
+
+class StochasticReligiousBeliefModel(DiscreteReligiousBeliefModel):
+    def __init__(self, params, initial_conds, simulation_years=4, num_age_groups=None, incoming=None,
+                 cohort_size=300, replicates=1000, seed=None, block_size=10000):
+        """
+        Finite-population version of DiscreteReligiousBeliefModel. Each
+        cohort holds cohort_size students as integer C, S, D head counts and
+        every flow is a binomial draw whose probability is the per-student
+        rate of the deterministic update, e.g. S_to_C ~ Binomial(S, A*B @ C).
+        A draw can never move more students than a compartment holds, so no
+        clamping or normalization is needed.
+
+        All replicates are stepped together. They are split into blocks of
+        block_size, each drawing from its own Generator spawned from seed, so
+        runs are reproducible for a given seed and block_size.
+        """
+        super().__init__(params, initial_conds, simulation_years, num_age_groups, incoming)
+        self.cohort_size = int(cohort_size)
+        self.replicates = int(replicates)
+        self.block_size = int(block_size)
+        self.seed = seed
+
+        self.quantiles = None
+        self.quantile_levels = None
+        self.replicate_state = None
+
+    def _draw_flows(self, rng, counts, p_CS, p_DS, p_SD, combined_influence):
+        C = counts[..., C_IDX]
+        S = counts[..., S_IDX]
+        D = counts[..., D_IDX]
+        frac = counts / self.cohort_size
+
+        # per-student probabilities of each flow, as in the deterministic update
+        p_S_to_C = np.clip(frac[..., C_IDX] @ combined_influence.T, 0, 1)
+        p_S_to_D = np.clip(frac[..., D_IDX] * p_SD, 0, 1)
+        p_C_to_S = np.clip(frac[..., D_IDX] * frac[..., S_IDX] * p_CS, 0, 1)
+        p_D_to_S = np.clip(frac[..., C_IDX] * frac[..., S_IDX] * p_DS, 0, 1)
+
+        # S splits three ways, drawn as a binomial for S_to_C then one on the remainder
+        S_to_C = rng.binomial(S, p_S_to_C)
+        remaining = 1 - p_S_to_C
+        p_S_to_D = np.divide(p_S_to_D, remaining, out=np.zeros_like(remaining), where=remaining > 0)
+        S_to_D = rng.binomial(S - S_to_C, np.clip(p_S_to_D, 0, 1))
+        C_to_S = rng.binomial(C, p_C_to_S)
+        D_to_S = rng.binomial(D, p_D_to_S)
+
+        counts[..., C_IDX] += S_to_C - C_to_S
+        counts[..., S_IDX] += C_to_S + D_to_S - S_to_C - S_to_D
+        counts[..., D_IDX] += S_to_D - D_to_S
+
+    def run_simulation(self, quantiles=(0.05, 0.5, 0.95)):
+        """
+        Run every replicate for simulation_years years.
+
+        Returns:
+        - The per-year quantiles of each cohort's C, S, D proportions over the
+          replicates, shape (years + 1, len(quantiles), K, 3). The replicate
+          mean is kept in self.results and its final year in self.state, so
+          plot_results, find_steady_state and further runs work on it; the
+          final proportions of every replicate are in self.replicate_state.
+        """
+        p_CS, _, p_DS, p_SD, _, _ = self._rates()
+        combined_influence = self.combined_influence
+
+        blocks = [slice(start, min(start + self.block_size, self.replicates))
+                  for start in range(0, self.replicates, self.block_size)]
+        rngs = [np.random.default_rng(child) for child in np.random.SeedSequence(self.seed).spawn(len(blocks))]
+
+        counts = np.empty((self.replicates, self.num_age_groups, 3), dtype=np.int64)
+        for block, rng in zip(blocks, rngs):
+            counts[block] = rng.multinomial(self.cohort_size, self.state,
+                                            size=(block.stop - block.start, self.num_age_groups))
+
+        self.quantile_levels = np.asarray(quantiles)
+        self.quantiles = np.empty((self.simulation_years + 1, len(quantiles), self.num_age_groups, 3))
+        self.results = np.empty((self.simulation_years + 1, self.num_age_groups, 3))
+        self.quantiles[0] = np.quantile(counts / self.cohort_size, quantiles, axis=0)
+        self.results[0] = np.mean(counts, axis=0) / self.cohort_size
+
+        for year in range(1, self.simulation_years + 1):
+            # move students up a year and admit a freshly drawn cohort
+            counts[:, 1:] = counts[:, :-1]
+            for block, rng in zip(blocks, rngs):
+                counts[block, 0] = rng.multinomial(self.cohort_size, self.incoming, size=block.stop - block.start)
+                self._draw_flows(rng, counts[block], p_CS, p_DS, p_SD, combined_influence)
+
+            self.quantiles[year] = np.quantile(counts / self.cohort_size, quantiles, axis=0)
+            self.results[year] = np.mean(counts, axis=0) / self.cohort_size
+
+        # state stays (K, 3) like the deterministic model's, so later runs and steady-state solves still work
+        self.replicate_state = counts / self.cohort_size
+        self.state = self.results[-1].copy()
+        return self.quantiles
+
+
+if __name__ == "__main__":
+    print("info: stochastic model demo")
+    beta = 0.4
+    beta_ret = 0.2
+    parameters = {
+        'p_SC': beta,
+        'p_CS': beta_ret,
+        'p_SD': beta,
+        'p_DS': beta_ret,
+        'A': final_project_model.sta_A(),
+        'B': final_project_model.elder_efficacy_B(beta, .1),
+    }
+
+    model = StochasticReligiousBeliefModel(
+        parameters, np.full((4, 3), 1 / 3), simulation_years=10,
+        cohort_size=300, replicates=100000, seed=0)
+    start = time.perf_counter()
+    quantiles = model.run_simulation()
+    print(f"{model.replicates} replicates in {time.perf_counter() - start:.2f} s")
+
+    print("final mean C percent, 5% / 50% / 95% quantiles by cohort:")
+    print(quantiles[-1, :, :, C_IDX])
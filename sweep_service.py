@@ -0,0 +1,411 @@
+import os
+import json
+import time
+import socket
+import asyncio
+import hashlib
+import argparse
+import tempfile
+import warnings
+import collections
+import concurrent.futures
+import numpy as np
+
+import final_project_model
+import experiments
+
+ADDRESS_VARIABLE = 'SWEEP_SERVICE'
+DEFAULT_ADDRESS = os.path.join(tempfile.gettempdir(), 'sweep_service.sock')
+
+# requests are single JSON lines, so allow for long axes
+LINE_LIMIT = 2 ** 26
+
+
+def final_state(state):
+    # the whole final (N, K, 3) state as the value of each grid point
+    return state
+
+
+# reducers a job can ask for by name
+REDUCERS = {
+    'mean_C': final_project_model.mean_C,
+    'senior_minus_freshman_C': final_project_model.senior_minus_freshman_C,
+    'final_state': final_state,
+}
+
+
+def _parse_address(address):
+    """
+    Returns:
+    - (host, port) for 'host:port', otherwise address as a unix socket path
+    """
+    if address is None:
+        address = os.environ.get(ADDRESS_VARIABLE, DEFAULT_ADDRESS)
+    host, _, port = address.rpartition(':')
+    if host and port.isdigit() and os.sep not in address:
+        return host, int(port)
+    return address
+
+
+def _jsonable(value):
+    # numpy arrays and scalars, nested in dicts and lists, as plain JSON values
+    if isinstance(value, dict):
+        return {str(key): _jsonable(v) for key, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(v) for v in value]
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _simulate(rows, num_age_groups, reducer, dtype):
+    # runs in a worker: final states of stacked experiments.plan_rows rows, reduced
+    inputs = experiments._unpack_rows(rows, num_age_groups)
+    final = final_project_model.run_batch(simulation_years=int(rows[0, 0]), output='final', dtype=dtype, **inputs)
+    return REDUCERS[reducer](final)
+
+
+class SweepService:
+    def __init__(self, executor=None, max_workers=None, chunk_size=500, max_results=1_000_000):
+        """
+        Serves sweep jobs to any number of connected clients, see serve.
+
+        Each grid point of a job is keyed by a hash of every model input,
+        simulation_years, the reducer and the dtype, so identical
+        simulations are found whatever sweep they come from. A point is
+        taken from the max_results most recently computed values if it is
+        there, waits on the batch computing it if some job already
+        submitted it, and is otherwise batched with the job's other new
+        points, chunk_size at a time, onto the executor, a process pool of
+        max_workers by default.
+        """
+        self.executor = executor or concurrent.futures.ProcessPoolExecutor(max_workers)
+        self.chunk_size = chunk_size
+        self.max_results = max_results
+
+        # key -> value, least recently used first
+        self.completed = collections.OrderedDict()
+        # key -> (task computing its batch, position in the batch)
+        self.pending = {}
+        self.counts = {'jobs': 0, 'points': 0, 'computed': 0, 'reused': 0, 'shared': 0}
+
+    def _remember(self, key, value):
+        self.completed[key] = value
+        self.completed.move_to_end(key)
+        if len(self.completed) > self.max_results:
+            self.completed.popitem(last=False)
+
+    async def _run_batch(self, keys, rows, num_age_groups, reducer, dtype):
+        loop = asyncio.get_running_loop()
+        try:
+            values = await loop.run_in_executor(self.executor, _simulate, rows, num_age_groups, reducer, dtype)
+        finally:
+            for key in keys:
+                del self.pending[key]
+        for key, value in zip(keys, values):
+            self._remember(key, value)
+        self.counts['computed'] += len(keys)
+        return values
+
+    async def _schedule(self, plan, reducer, dtype, counts):
+        """
+        Returns:
+        - For every grid point, (None, value) if it was already computed or
+          (task, position) for the batch that computes it
+        """
+        salt = f'{reducer}:{np.dtype(dtype).name}:{final_project_model.MODEL_VERSION}'.encode()
+        sources = []
+        for start in range(0, plan.size, self.chunk_size):
+            stop = min(start + self.chunk_size, plan.size)
+            rows = experiments.plan_rows(plan, start, stop)
+            fresh = {}
+            new_rows = []
+            chunk_sources = []
+            for row in rows:
+                key = hashlib.blake2b(salt + row.tobytes(), digest_size=16).digest()
+                if key in self.completed:
+                    self.completed.move_to_end(key)
+                    chunk_sources.append((None, self.completed[key]))
+                    counts['reused'] += 1
+                elif key in self.pending or key in fresh:
+                    chunk_sources.append(self.pending[key] if key in self.pending else ('fresh', fresh[key]))
+                    counts['shared'] += 1
+                else:
+                    fresh[key] = len(new_rows)
+                    new_rows.append(row)
+                    chunk_sources.append(('fresh', fresh[key]))
+            if fresh:
+                # a batch only holds rows of its plan, so they all unpack with its number of cohorts
+                task = asyncio.ensure_future(self._run_batch(list(fresh), np.array(new_rows), plan.num_age_groups,
+                                                             reducer, dtype))
+                for key, position in fresh.items():
+                    self.pending[key] = (task, position)
+                chunk_sources = [(task, position) if source == 'fresh' else (source, position)
+                                 for source, position in chunk_sources]
+                counts['computed'] += len(fresh)
+            sources.extend(chunk_sources)
+            # let other connections in between chunks of a large job
+            await asyncio.sleep(0)
+        return sources
+
+    async def sweep(self, job, send):
+        """
+        Run one job, a dict with axes ([name, values] pairs), params,
+        initial_conds, simulation_years, reducer (a name from REDUCERS) and
+        dtype, as for run_sweep. Results are sent as heatmap rows, the
+        points along the last axis, in the order they finish.
+        """
+        axes = [(name, values) for name, values in job.get('axes', [])]
+        dtype = np.dtype(job.get('dtype', 'float64'))
+        reducer = job.get('reducer', 'mean_C')
+        if reducer not in REDUCERS:
+            raise ValueError(f'unknown reducer {reducer!r}, expected one of {list(REDUCERS)}')
+        plan = final_project_model.SweepPlan(axes, job.get('params', {}), job.get('initial_conds', {}),
+                                             job.get('simulation_years', 10), None, dtype)
+        row_length = plan.shape[-1] if plan.shape else 1
+        await send({'type': 'start', 'shape': list(plan.shape), 'axes': list(zip(plan.names, plan.coords))})
+
+        counts = {'points': plan.size, 'computed': 0, 'reused': 0, 'shared': 0}
+        sources = await self._schedule(plan, reducer, dtype, counts)
+        self.counts['jobs'] += 1
+        for field in ('points', 'reused', 'shared'):
+            self.counts[field] += counts[field]
+
+        async def row(r):
+            entries = sources[r * row_length:(r + 1) * row_length]
+            tasks = {id(task): task for task, _ in entries if task is not None}
+            await asyncio.gather(*tasks.values())
+            return r, [value if task is None else task.result()[value] for task, value in entries]
+
+        # an empty axis leaves no rows at all
+        num_rows = plan.size // row_length if row_length else 0
+        for finished in asyncio.as_completed([row(r) for r in range(num_rows)]):
+            r, values = await finished
+            await send({'type': 'row', 'row': r, 'index': list(np.unravel_index(r, plan.shape[:-1])),
+                        'values': values})
+        await send(dict(counts, type='done'))
+
+    async def handle(self, reader, writer):
+        async def send(message):
+            writer.write(json.dumps(_jsonable(message)).encode() + b'\n')
+            await writer.drain()
+
+        try:
+            while line := await reader.readline():
+                request = json.loads(line)
+                op = request.get('op')
+                try:
+                    if op == 'sweep':
+                        await self.sweep(request, send)
+                    elif op == 'stats':
+                        await send(dict(self.counts, type='stats', completed=len(self.completed),
+                                        pending=len(self.pending)))
+                    elif op == 'ping':
+                        await send({'type': 'pong'})
+                    else:
+                        raise ValueError(f'unknown op {op!r}')
+                except (ConnectionError, asyncio.CancelledError):
+                    raise
+                except Exception as error:
+                    await send({'type': 'error', 'message': f'{type(error).__name__}: {error}'})
+        except ConnectionError:
+            # the client went away, anything it started still finishes into completed
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(address=None, service=None):
+    """
+    Listen on address, a unix socket path or 'host:port' (by default the
+    SWEEP_SERVICE environment variable or DEFAULT_ADDRESS), for newline
+    delimited JSON requests: {"op": "sweep", ...} (see SweepService.sweep),
+    {"op": "stats"} and {"op": "ping"}. Runs until cancelled.
+    """
+    service = service or SweepService()
+    address = _parse_address(address)
+    if isinstance(address, tuple):
+        server = await asyncio.start_server(service.handle, *address, limit=LINE_LIMIT)
+    else:
+        if os.path.exists(address):
+            # a socket left behind by a service that is no longer running
+            os.unlink(address)
+        server = await asyncio.start_unix_server(service.handle, address, limit=LINE_LIMIT)
+    async with server:
+        await server.serve_forever()
+
+
+class SweepClient:
+    def __init__(self, address=None, timeout=None):
+        # a blocking client, for scripts and notebooks
+        self.address = _parse_address(address)
+        self.timeout = timeout
+
+    def _connect(self):
+        family = socket.AF_INET if isinstance(self.address, tuple) else socket.AF_UNIX
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.address)
+        return sock
+
+    def request(self, message, last=('done', 'stats', 'pong')):
+        """
+        Send one request and yield the messages that come back, up to and
+        including the one whose type is in last.
+        """
+        with self._connect() as sock, sock.makefile('rb') as replies:
+            sock.sendall(json.dumps(_jsonable(message)).encode() + b'\n')
+            for line in replies:
+                reply = json.loads(line)
+                if reply['type'] == 'error':
+                    raise RuntimeError(f"sweep service: {reply['message']}")
+                yield reply
+                if reply['type'] in last:
+                    return
+        raise ConnectionError('sweep service closed the connection')
+
+    def ping(self):
+        return next(self.request({'op': 'ping'}))['type'] == 'pong'
+
+    def stats(self):
+        return next(self.request({'op': 'stats'}))
+
+    def iter_rows(self, axes, params=None, initial_conds=None, simulation_years=10, reducer='mean_C',
+                  dtype='float64'):
+        """
+        Submit a sweep, arguments as for run_sweep with reducer by name, and
+        yield its messages as they arrive: 'start' with the grid shape and
+        coordinates, a 'row' per heatmap row with its index and values, and
+        'done' with how many points were computed, reused from earlier jobs
+        or shared with jobs still running.
+        """
+        if isinstance(axes, dict):
+            axes = list(axes.items())
+        if isinstance(params, final_project_model.ModelParams):
+            params = params.sweep_params()
+        job = {
+            'op': 'sweep',
+            'axes': [[name, values] for name, values in axes],
+            'params': params or {},
+            'initial_conds': initial_conds or {},
+            'simulation_years': simulation_years,
+            'reducer': reducer,
+            'dtype': np.dtype(dtype).name,
+        }
+        yield from self.request(job)
+
+    def sweep(self, axes, params=None, initial_conds=None, simulation_years=10, reducer='mean_C',
+              dtype='float64', on_row=None):
+        """
+        Run a sweep on the service, calling on_row(index, values) for each
+        heatmap row as it arrives.
+
+        Returns:
+        - A SweepResult as run_sweep's, with reused counting the points
+          that were not computed for this job
+        """
+        values = None
+        for message in self.iter_rows(axes, params, initial_conds, simulation_years, reducer, dtype):
+            if message['type'] == 'start':
+                shape = tuple(message['shape'])
+                result_axes = [(name, coords) for name, coords in message['axes']]
+                row_length = shape[-1] if shape else 1
+            elif message['type'] == 'row':
+                row = np.asarray(message['values'], dtype=dtype)
+                if values is None:
+                    values = np.empty(shape + row.shape[1:], dtype=dtype)
+                values.reshape((-1, row_length) + row.shape[1:])[message['row']] = row
+                if on_row is not None:
+                    on_row(tuple(message['index']), row)
+            else:
+                done = message
+
+        if values is None:
+            # no rows came back, an axis is empty
+            values = np.empty(shape, dtype=dtype)
+        result = final_project_model.SweepResult(values, result_axes)
+        result.computed = done['computed']
+        result.reused = done['reused'] + done['shared']
+        return result
+
+
+def connect(address=None):
+    """
+    Returns:
+    - A SweepClient for the service at address, or None if none answers
+    """
+    client = SweepClient(address, timeout=2)
+    try:
+        client.ping()
+    except OSError:
+        return None
+    client.timeout = None
+    return client
+
+
+class _ServiceChunks(concurrent.futures.Executor):
+    # stands in for run_sweep's backend, answering each chunk from the
+    # service's values for the whole grid, fetched when the first one is asked for
+    def __init__(self, fetch):
+        self.fetch = fetch
+        self.values = None
+
+    def submit(self, fn, plan, flat, tracer=None):
+        if self.values is None:
+            self.values = self.fetch().values
+        future = concurrent.futures.Future()
+        future.set_result(self.values.reshape((plan.size,) + self.values.shape[len(plan.shape):])[flat])
+        return future
+
+
+def run_sweep(axes, params=None, initial_conds=None, simulation_years=10, reducer='mean_C', address=None,
+              on_row=None, **local):
+    """
+    run_sweep through the service if one is listening at address, and
+    locally with the extra run_sweep arguments in local (cache, store,
+    backend, ...) otherwise.
+
+    With a service, store and cache still work as for run_sweep: points
+    found there are used as they are, and the rest come from the service
+    and are written back, so computed counts the points the service
+    supplied. The service is only asked if something is missing, and
+    on_row only sees the rows it sends. backend, max_workers and tracer
+    describe local runs and are dropped with a warning.
+
+    Returns:
+    - The SweepResult, or the results store with store
+    """
+    client = connect(address)
+    if client is None:
+        return final_project_model.run_sweep(axes, params, initial_conds, simulation_years, REDUCERS[reducer],
+                                             **local)
+
+    dropped = [name for name in ('backend', 'max_workers', 'tracer') if local.pop(name, None) is not None]
+    if dropped:
+        warnings.warn(f"the sweep service ignores {', '.join(dropped)}, only local sweeps use them")
+    dtype = local.get('dtype', 'float64')
+    if local.get('store') is None and local.get('cache') is None:
+        return client.sweep(axes, params, initial_conds, simulation_years, reducer, dtype, on_row)
+
+    service = _ServiceChunks(lambda: client.sweep(axes, params, initial_conds, simulation_years, reducer, dtype,
+                                                  on_row))
+    return final_project_model.run_sweep(axes, params, initial_conds, simulation_years, REDUCERS[reducer],
+                                         backend=service, **local)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Serve sweep jobs to the generate_graph_* scripts and notebooks.')
+    parser.add_argument('--address', help=f'unix socket path or host:port, default ${ADDRESS_VARIABLE} '
+                                          f'or {DEFAULT_ADDRESS}')
+    parser.add_argument('--workers', type=int, help='worker processes, default one per CPU')
+    parser.add_argument('--chunk-size', type=int, default=500, help='simulations per worker batch')
+    args = parser.parse_args()
+
+    print(f"info: serving sweeps on {_parse_address(args.address)}")
+    started = time.perf_counter()
+    try:
+        asyncio.run(serve(args.address, SweepService(max_workers=args.workers, chunk_size=args.chunk_size)))
+    except KeyboardInterrupt:
+        print(f"info: stopped after {time.perf_counter() - started:.0f} s")
@@ -0,0 +1,79 @@
+import copy
+import pickle
+import numpy as np
+
+import final_project_model
+import stochastic_model
+
+
+def test_mixing_A_vector_diagonal():
+    diagonal = np.array([.1, .4, .7])
+    A = final_project_model.mixing_A(diagonal)
+    assert A.shape == (3, 4, 4)
+    for matrix, value in zip(A, diagonal):
+        np.testing.assert_allclose(matrix, final_project_model.mixing_A(value))
+    np.testing.assert_allclose(A.sum(axis=-1), 1)
+
+
+def test_mixing_A_presets():
+    assert final_project_model.homophily_A().tolist() == [[.7 if i == j else .1 for j in range(4)] for i in range(4)]
+    assert final_project_model.heterophily_A().tolist() == [[.1 if i == j else .3 for j in range(4)] for i in range(4)]
+    assert final_project_model.sta_A().tolist() == [[.3, .3, .25, .15]] * 4
+
+
+def test_sweep_takes_age_groups_from_A():
+    A = final_project_model.mixing_A(.4, num_age_groups=5)
+    betas = np.linspace(0, 1, 3)
+    sweep = final_project_model.run_sweep([('beta', betas)], {'A': A, 'B_step': .1}, simulation_years=5,
+                                          reducer=None, backend='serial')
+    assert sweep.values.shape == (3, 6, 5, 3)
+    for beta, trajectory in zip(betas, sweep.values):
+        model = final_project_model.DiscreteReligiousBeliefModel(
+            {'p_SC': beta, 'p_SD': beta, 'A': A, 'B': final_project_model.elder_efficacy_B(beta, .1, 5)},
+            {}, simulation_years=5, num_age_groups=5)
+        np.testing.assert_allclose(trajectory, model.run_simulation(), atol=1e-14)
+
+
+def test_model_round_trips_through_pickle_and_deepcopy():
+    params = {'p_SC': .4, 'p_CS': .2, 'p_SD': .4, 'p_DS': .2, 'A': final_project_model.sta_A(),
+              'B': final_project_model.elder_efficacy_B(.4, .1)}
+    model = final_project_model.DiscreteReligiousBeliefModel(params, {}, simulation_years=10)
+    copies = [pickle.loads(pickle.dumps(model)), copy.deepcopy(model)]
+    expected = model.run_simulation()
+    for copied in copies:
+        np.testing.assert_array_equal(copied.model_params.combined_influence, model.model_params.combined_influence)
+        assert not copied.model_params.A.flags.writeable
+        np.testing.assert_array_equal(copied.run_simulation(), expected)
+
+
+def test_model_params_batch_round_trips_through_pickle():
+    params = final_project_model.ModelParams.from_betas(np.linspace(0, 1, 5), .2, B_step=.1, incoming=[.3, .4, .3])
+    copied = pickle.loads(pickle.dumps(params))
+    assert copied.size == 5
+    for name in ('p_CS', 'p_SC', 'A', 'B', 'incoming', 'combined_influence'):
+        np.testing.assert_array_equal(getattr(copied, name), getattr(params, name))
+
+
+def test_stochastic_model_keeps_a_cohort_state_between_runs():
+    params = {'p_SC': .4, 'p_CS': .2, 'p_SD': .4, 'p_DS': .2, 'A': final_project_model.sta_A(),
+              'B': final_project_model.elder_efficacy_B(.4, .1)}
+    model = stochastic_model.StochasticReligiousBeliefModel(
+        params, np.full((4, 3), 1 / 3), simulation_years=3, replicates=25, seed=0, block_size=10)
+    model.run_simulation()
+    assert model.state.shape == (4, 3)
+    assert model.replicate_state.shape == (25, 4, 3)
+    np.testing.assert_allclose(model.state, model.replicate_state.mean(axis=0))
+    assert model.run_simulation().shape == (4, 3, 4, 3)
+    model.solve_steady_state()
+
+
+def test_sweep_rebuilds_B_and_takes_incoming_from_model_params():
+    betas = np.linspace(0, 1, 5)
+    params = final_project_model.ModelParams.from_betas(.4, .2, A=final_project_model.sta_A(), B_step=.1,
+                                                        incoming=[.5, .3, .2])
+    expected = final_project_model.run_sweep(
+        [('beta', betas)], {'p_CS': .2, 'p_DS': .2, 'A': final_project_model.sta_A(), 'B_step': .1},
+        {'C_incoming': .5, 'S_incoming': .3, 'D_incoming': .2}, backend='serial')
+    sweep = final_project_model.run_sweep([('beta', betas)], params, backend='serial')
+    np.testing.assert_array_equal(sweep.values, expected.values)
+    np.testing.assert_array_equal(params.replace(p_SC=.6).B, final_project_model.elder_efficacy_B(.6, .1))
@@ -0,0 +1,31 @@
+import numpy as np
+
+import global_sensitivity
+
+
+def test_sobol_indices_ishigami():
+    # analytic indices of sin(x1) + 7 sin(x2)^2 + .1 x3^4 sin(x1) over [-pi, pi]^3
+    design = global_sensitivity.saltelli_design(2 ** 14, 3)
+    x = -np.pi + 2 * np.pi * design
+    y = np.sin(x[:, 0]) + 7 * np.sin(x[:, 1]) ** 2 + .1 * x[:, 2] ** 4 * np.sin(x[:, 0])
+    first, total, first_ci, total_ci, _ = global_sensitivity.sobol_indices(y, 3, n_bootstrap=200)
+    np.testing.assert_allclose(first, [.314, .442, 0], atol=.01)
+    np.testing.assert_allclose(total, [.558, .442, .244], atol=.01)
+    assert np.all(first_ci[:, 0] <= first) and np.all(first <= first_ci[:, 1])
+    assert np.all(total_ci[:, 0] <= total) and np.all(total <= total_ci[:, 1])
+
+
+def test_morris_linear():
+    design = global_sensitivity.morris_design(50, 3)
+    assert design.min() >= 0 and design.max() <= 1
+    mu, mu_star, sigma, _ = global_sensitivity.morris_indices(design, design @ [1., -2., 0.], 3)
+    np.testing.assert_allclose(mu, [1, -2, 0], atol=1e-12)
+    np.testing.assert_allclose(mu_star, [1, 2, 0], atol=1e-12)
+    np.testing.assert_allclose(sigma, 0, atol=1e-12)
+
+
+def test_problem_fixes_unvaried_parameters():
+    problem = global_sensitivity.SensitivityProblem(bounds={'incoming_u': (0, 1)})
+    outputs = problem.evaluate(np.array([[0.], [.5], [1.]]))
+    assert outputs.shape == (3,)
+    assert outputs[0] < outputs[1] < outputs[2]
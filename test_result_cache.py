@@ -0,0 +1,18 @@
+import os
+import numpy as np
+
+import result_cache
+
+
+def test_get_survives_eviction_after_load(tmp_path, monkeypatch):
+    cache = result_cache.ResultCache(str(tmp_path))
+    cache.put('ab12', np.arange(3.))
+
+    def evicted(path, *args):
+        os.remove(path)
+        raise FileNotFoundError(path)
+
+    monkeypatch.setattr(os, 'utime', evicted)
+    np.testing.assert_array_equal(cache.get('ab12'), np.arange(3.))
+    assert cache.stats()['entries'] == 0 and cache.stats()['bytes'] == 0
+    assert cache.get('ab12') is None